@@ -0,0 +1,43 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Benchmarks for the bit manipulation utilities."""
+from bufrtools.util import bitmath
+
+# Number of fields packed by every call of the benchmarked functions
+FIELDS = 1_000
+
+
+def pack_encode_uint(data: bytes):
+    """Embeds 17 bit fields across the buffer one at a time."""
+    for i in range(FIELDS):
+        data = bitmath.encode_uint(data, i, (i * 17) % 256, 17)
+    return data
+
+
+def pack_shift_uint():
+    """Shifts 17 bit fields into 4 byte words."""
+    for i in range(FIELDS):
+        bitmath.shift_uint(i, 32, i % 15, 17)
+
+
+def pack_bit_writer():
+    """Appends 17 bit fields to a writer."""
+    writer = bitmath.BitWriter()
+    for i in range(FIELDS):
+        writer.write_uint(i, 17)
+    return writer.getvalue()
+
+
+def test_encode_uint(measure):
+    """Benchmarks embedding fields in a 36 byte buffer."""
+    measure(FIELDS, pack_encode_uint, bytes(36))
+
+
+def test_shift_uint(measure):
+    """Benchmarks shifting fields into words."""
+    measure(FIELDS, pack_shift_uint)
+
+
+def test_bit_writer(measure):
+    """Benchmarks the sequential writer for comparison."""
+    measure(FIELDS, pack_bit_writer)
@@ -0,0 +1,106 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Benchmarks for encoding Wildlife Computers profiles."""
+import io
+
+from bufrtools.decoding.bufr import read_subsets
+from bufrtools.encoding import bufr, wildlife_computers
+from bufrtools.encoding.stream import MessageWriter
+from bufrtools.encoding.encoder import Encoder
+from bufrtools.encoding.verify import verify_message
+from bufrtools.util.bitmath import BitWriter
+
+
+# Smallest message, whose encoding time is all fixed cost
+SMALL_MESSAGE = {
+    'section1': wildlife_computers.get_section1(),
+    'section3': {**wildlife_computers.get_section3(), 'descriptors': ['301011', '301012']},
+    'section4': [2020, 6, 10, 1, 2],
+}
+
+# Platform IDs of 32 characters, the widest string field of 315023
+PLATFORM_IDS = [f'ct145-933-BAT2-{i}' for i in range(1000)]
+
+
+def count_fields(profiles) -> int:
+    """Returns the number of elements the profiles are encoded as."""
+    data = wildlife_computers.encode_message(profiles, uuid='benchmark', ptt='0')
+    return sum(len(values) for values in read_subsets(data))
+
+
+def encode_section4(records: list):
+    """Encodes the section 4 records into a new buffer."""
+    bufr.encode_section4({'section4': records}, {'buf': io.BytesIO()})
+
+
+def test_encode_section4(measure, profiles):
+    """Benchmarks packing section 4."""
+    records = wildlife_computers.get_section4(profiles, uuid='benchmark', ptt='0')
+    measure(count_fields(profiles), encode_section4, records)
+
+
+def test_get_section4(measure, profiles):
+    """Benchmarks building the section 4 records from the dataset."""
+    measure(count_fields(profiles), wildlife_computers.get_section4, profiles,
+            uuid='benchmark', ptt='0')
+
+
+def test_wildlife_computers_encode(measure, profiles, tmp_path):
+    """Benchmarks encoding a parquet dataset end to end, reading and writing files included."""
+    dataset = tmp_path / 'profiles.parquet'
+    profiles.to_parquet(dataset)
+    output = tmp_path / 'profiles.bufr'
+    measure(count_fields(profiles), wildlife_computers.encode, dataset, output,
+            uuid='benchmark', ptt='0')
+
+
+def test_verify_message(measure, profiles, tmp_path):
+    """Benchmarks verifying an encoded message against the message it was encoded from."""
+    dataset = tmp_path / 'profiles.parquet'
+    profiles.to_parquet(dataset)
+    message = wildlife_computers.get_message(dataset, uuid='benchmark', ptt='0')
+    data = wildlife_computers.encode_message(dataset, uuid='benchmark', ptt='0')
+    measure(count_fields(profiles), verify_message, message, data)
+
+
+def write_message(message: dict):
+    """Writes the message into a new buffer, encoding every section."""
+    MessageWriter(io.BytesIO()).write(message)
+
+
+def test_write_small_message(measure):
+    """Benchmarks the fixed cost of a message when every section is encoded."""
+    measure(len(SMALL_MESSAGE['section4']), write_message, SMALL_MESSAGE)
+
+
+def test_encoder_small_message(measure):
+    """Benchmarks the fixed cost of a message when only section 4 is encoded."""
+    encoder = Encoder(SMALL_MESSAGE['section3']['descriptors'], SMALL_MESSAGE['section1'])
+    measure(len(SMALL_MESSAGE['section4']), encoder.encode, SMALL_MESSAGE['section4'])
+
+
+def pack_strings(values: list) -> bytes:
+    """Packs the strings one field at a time, off a byte boundary."""
+    writer = BitWriter()
+    writer.write_uint(0, 3)
+    for value in values:
+        bufr.pack_ascii(writer, value, 256)
+    return writer.getvalue()
+
+
+def pack_string_array(values: list) -> bytes:
+    """Packs the strings as a single array, off a byte boundary."""
+    writer = BitWriter()
+    writer.write_uint(0, 3)
+    bufr.pack_ascii_array(writer, values, 256)
+    return writer.getvalue()
+
+
+def test_pack_ascii(measure):
+    """Benchmarks packing string fields one by one."""
+    measure(len(PLATFORM_IDS), pack_strings, PLATFORM_IDS)
+
+
+def test_pack_ascii_array(measure):
+    """Benchmarks packing string fields as an array."""
+    measure(len(PLATFORM_IDS), pack_string_array, PLATFORM_IDS)
@@ -0,0 +1,34 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Benchmarks for importing the core modules in a fresh interpreter."""
+import sys
+import json
+import subprocess
+
+import pytest
+
+IMPORT_SCRIPT = '''
+import json, time
+import numpy
+start = time.perf_counter()
+import {module}
+print(json.dumps(time.perf_counter() - start))
+'''
+
+
+def import_in_subprocess(module: str) -> float:
+    """Returns the seconds importing the module takes in a new process, NumPy is imported first."""
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT.format(module=module)])
+    return json.loads(output)
+
+
+@pytest.mark.parametrize('module', [
+    'bufrtools.encoding.bufr',
+    'bufrtools.decoding.bufr',
+    'bufrtools.tables',
+])
+def test_core_import(benchmark, module):
+    """Benchmarks importing a core module, the import alone is recorded as `import_seconds`."""
+    elapsed = []
+    benchmark.pedantic(lambda: elapsed.append(import_in_subprocess(module)), rounds=5)
+    benchmark.extra_info['import_seconds'] = min(elapsed)
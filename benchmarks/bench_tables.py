@@ -0,0 +1,23 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Benchmarks for the table lookups."""
+import numpy as np
+
+from bufrtools.tables import get_code_table_figure, get_sequence_description, resolve_code_figures
+
+
+def test_get_sequence_description(measure):
+    """Benchmarks describing the marine animal tag sequence."""
+    rows = len(get_sequence_description('315023'))
+    measure(rows, get_sequence_description, '315023')
+
+
+def test_get_code_table_figure(measure):
+    """Benchmarks looking up a code figure."""
+    measure(1, get_code_table_figure, '002148', 1)
+
+
+def test_resolve_code_figures(measure):
+    """Benchmarks resolving a column of code figures, ranges included."""
+    figures = np.arange(100000) % 40000
+    measure(len(figures), resolve_code_figures, '001036', figures)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Synthetic datasets and measurement helpers shared by the benchmarks."""
+import tracemalloc
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Total number of levels of the synthetic datasets
+LEVELS = [10, 1_000, 100_000]
+
+# Profiles are split so that none has more levels than this
+MAX_PROFILE_LEVELS = 1_000
+
+
+def make_profiles(levels: int, seed: int = 0) -> pd.DataFrame:
+    """Returns a Wildlife Computers profile dataset with `levels` levels in total."""
+    rng = np.random.default_rng(seed)
+    per_profile = min(levels, MAX_PROFILE_LEVELS)
+    nprofiles = -(-levels // per_profile)
+    profile = np.repeat(np.arange(nprofiles, dtype=np.int32), per_profile)[:levels]
+    time = pd.Timestamp('2020-01-01') + pd.to_timedelta(profile.astype(np.int64) * 3600, unit='s')
+    return pd.DataFrame({
+        'time': time,
+        'lon': np.linspace(-158.0, -150.0, nprofiles)[profile],
+        'lat': np.linspace(20.0, 25.0, nprofiles)[profile],
+        'z': np.tile(np.arange(per_profile, dtype=np.float64), nprofiles)[:levels],
+        'profile': profile,
+        'pressure': np.tile(np.arange(per_profile, dtype=np.float64), nprofiles)[:levels],
+        'temperature': rng.uniform(2.0, 28.0, levels),
+        'salinity': rng.uniform(32.0, 36.0, levels),
+    })
+
+
+@pytest.fixture(params=LEVELS, ids=lambda levels: f'{levels}-levels')
+def profiles(request) -> pd.DataFrame:
+    """Fixture for synthetic profile datasets of every size."""
+    return make_profiles(request.param)
+
+
+@pytest.fixture
+def measure(benchmark) -> Callable:
+    """Fixture that benchmarks a function and records its throughput and peak memory.
+
+    Returns a function taking the number of fields the benchmarked function handles per call,
+    followed by the function and its arguments.
+    """
+    def run(fields: int, func: Callable, *args, **kwargs):
+        result = benchmark(func, *args, **kwargs)
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info['fields'] = fields
+        benchmark.extra_info['fields_per_second'] = fields / benchmark.stats.stats.mean
+        benchmark.extra_info['peak_memory_bytes'] = peak
+        return result
+    return run
@@ -3,30 +3,22 @@
 """Package for some decoding utilities."""
 import logging
 
-from bufrtools.tables import get_code_table_figure
+from bufrtools.tables.codes import get_code_table_resolver
+from bufrtools.util.bitmath import extract_uint
 
 log = logging.getLogger(__name__)
 
 
 def read_bytes_bitlen(data: bytes, offset_bits: int, bitlen: int):
     """Read a set of bytes for an exact bitlength and a specific bit offset."""
-    count = 0
-    first_bitmask = ((1 << (8 - offset_bits)) - 1)
-    second_bitmask = 0xff ^ first_bitmask
-    values = []
-    while count < (((bitlen - 1) // 8) + 1):
-        value = (data[count] & first_bitmask) << (offset_bits)
-        if second_bitmask and (count * 8 + (8 - offset_bits)) < bitlen:
-            value = value | ((data[count + 1] & second_bitmask) >> (8 - offset_bits))
-        values.append(value)
-        count += 1
-    return bytes(values)
+    nbytes = ((bitlen - 1) // 8) + 1
+    value = extract_uint(data, offset_bits, bitlen)
+    return (value << (nbytes * 8 - bitlen)).to_bytes(nbytes, 'big')
 
 
 def parse_unsigned_int(data: bytes, bitlen: int):
     """Parses an unsigned integer from data that is `bitlen` bits long."""
-    val = '0b' + ''.join([f'{b:08b}' for b in data])
-    return int(val[0:2 + bitlen], 2)
+    return extract_uint(data, 0, bitlen)
 
 
 def decode_empty(context: dict,
@@ -59,27 +51,29 @@ def decode_numeric(data: bytes,
                    scale: float = None,
                    offset: float = None,
                    fxy: str = None,
-                   code_table: bool = False) -> dict:
-    """Decodes a numeric data field."""
+                   code_table: bool = False,
+                   missing: bool = False) -> dict:
+    """Decodes a numeric data field.
+
+    If `missing` is set, a field with all bits set is decoded as the missing value None.
+    """
     start = bit_offset // 8
     r = bit_offset % 8
     byte_len = (bit_len + r) // 8 + 1
-    raw = read_bytes_bitlen(
-        data[start:start + byte_len],
-        r,
-        bit_len)
-    value = parse_unsigned_int(raw, bit_len)
-    if offset is not None:
+    value = extract_uint(data, bit_offset, bit_len)
+    if missing and value == (1 << bit_len) - 1:
+        value = None
+    elif offset is not None:
         value = offset + value
-    if scale is not None:
+    if scale is not None and value is not None:
         value = value / (10 ** scale)
-    log.debug(f'Decoded value {value}')
-    if code_table:
-        try:
-            code_figure = get_code_table_figure(fxy, int(value))
-            value = f'{value:0.0f} ({code_figure["EntryName_en"]})'
-        except Exception:
-            log.warning(f'Unable to find code table value for {fxy}')
+    log.debug('Decoded value %s', value)
+    if code_table and value is not None:
+        name = get_code_table_resolver(fxy).name(int(value))
+        if name is None:
+            log.warning('Unable to find code table value %s for %s', value, fxy)
+        else:
+            value = f'{value:0.0f} ({name})'
     return {
         'text': text,
         'offset': context['offset'] + start,
@@ -96,20 +90,22 @@ def decode_ccit(data: bytes,
                 bit_offset: int,
                 bit_len: int,
                 text: str,
-                fxy: str = None) -> dict:
-    """Decodes an ASCII field."""
+                fxy: str = None,
+                missing: bool = False) -> dict:
+    """Decodes an ASCII field.
+
+    If `missing` is set, a field with all bits set is decoded as the missing value None.
+    """
     start = bit_offset // 8
     r = bit_offset % 8
     byte_len = (bit_len + r) // 8 + 1
-    raw = read_bytes_bitlen(
-        data[start:start + byte_len],
-        r,
-        bit_len)
+    raw = read_bytes_bitlen(data, bit_offset, bit_len)
     ascii_value = 'INVALID'
     try:
         ascii_value = raw.decode('ascii').strip()
     except UnicodeDecodeError:
-        pass
+        if missing and all(b == 0xFF for b in raw):
+            ascii_value = None
     return {
         'text': text,
         'offset': context['offset'] + start,
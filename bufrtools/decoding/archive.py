@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Parallel decoding of files of concatenated BUFR messages into Arrow record batches.
+
+The messages of an indexed file are split into shards of consecutive messages and decoded across a
+pool of worker processes. Each worker memory-maps the file itself, only message offsets are sent to
+the workers and only the decoded record batches come back.
+"""
+import os
+import sys
+import math
+import mmap
+import logging
+from typing import List, Tuple, Iterator, Optional
+from pathlib import Path
+from argparse import Namespace, ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from bufrtools.decoding.bufr import read_subsets
+from bufrtools.decoding.scan import build_index
+
+log = logging.getLogger(__name__)
+
+# One row per decoded element, keyed by message, subset and position of the element in the subset
+SCHEMA = pa.schema([
+    ('message', pa.int32()),
+    ('subset', pa.int32()),
+    ('element', pa.int32()),
+    ('fxy', pa.string()),
+    ('value', pa.float64()),
+    ('string_value', pa.string()),
+])
+
+# Largest number of messages decoded by a worker in a single task
+MAX_SHARD_SIZE = 256
+
+# A shard is a list of (message number, offset, length)
+Shard = List[Tuple[int, int, int]]
+
+_worker_file = None
+_worker_data = None
+
+
+def open_worker(path: str):
+    """Memory-maps the file in the worker process, once for every shard it decodes."""
+    global _worker_file, _worker_data
+    _worker_file = open(path, 'rb')
+    _worker_data = mmap.mmap(_worker_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def decode_shard(shard: Shard) -> Tuple[pa.RecordBatch, List[Tuple[int, str]]]:
+    """Returns the record batch of the messages of the shard and the messages that failed."""
+    columns = {name: [] for name in SCHEMA.names}
+    failures = []
+    data = memoryview(_worker_data)
+    for number, offset, length in shard:
+        try:
+            subsets = list(read_subsets(data[offset:offset + length]))
+        except Exception as e:
+            failures.append((number, f'{type(e).__name__}: {e}'))
+            continue
+        for subset, elements in enumerate(subsets):
+            for i, (fxy, value) in enumerate(elements):
+                is_string = isinstance(value, str)
+                columns['message'].append(number)
+                columns['subset'].append(subset)
+                columns['element'].append(i)
+                columns['fxy'].append(fxy)
+                columns['value'].append(None if is_string else value)
+                columns['string_value'].append(value if is_string else None)
+    data.release()
+    return pa.RecordBatch.from_pydict(columns, schema=SCHEMA), failures
+
+
+def get_shards(path: str, workers: int, shard_size: Optional[int] = None) -> List[Shard]:
+    """Returns the messages of the indexed file split into shards of consecutive messages."""
+    entries = build_index(path)
+    if shard_size is None:
+        # A few shards per worker balances the load without too many small batches
+        shard_size = max(1, min(MAX_SHARD_SIZE, math.ceil(len(entries) / (workers * 4))))
+    messages = [(i, entry.offset, entry.length) for i, entry in enumerate(entries)]
+    return [messages[i:i + shard_size] for i in range(0, len(messages), shard_size)]
+
+
+def decode_many(path: str,
+                workers: Optional[int] = None,
+                shard_size: Optional[int] = None) -> Iterator[pa.RecordBatch]:
+    """Yields a record batch of decoded elements for every shard of the file, in message order.
+
+    Shards are decoded across `workers` processes, one per CPU by default. The file is indexed
+    first, reusing the index saved next to it when there is one. Messages that fail to decode are
+    logged and left out.
+    """
+    path = str(path)
+    workers = workers or os.cpu_count() or 1
+    shards = get_shards(path, workers, shard_size)
+    if not shards:
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards)),
+                             initializer=open_worker,
+                             initargs=(path,)) as executor:
+        for batch, failures in executor.map(decode_shard, shards):
+            for number, error in failures:
+                log.warning('Unable to decode message %d of %s: %s', number, path, error)
+            yield batch
+
+
+def write_parquet(path: str,
+                  output: str,
+                  workers: Optional[int] = None,
+                  shard_size: Optional[int] = None) -> int:
+    """Decodes the file into a Parquet file with one row group per shard, returns the row count."""
+    rows = 0
+    with pq.ParquetWriter(str(output), SCHEMA) as writer:
+        for batch in decode_many(path, workers, shard_size):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+def parse_args(argv: List[str]) -> Namespace:
+    """Returns the namespace parsed from the command line arguments."""
+    parser = ArgumentParser(description=main.__doc__)
+    parser.add_argument('input', type=Path, help='File of concatenated BUFR messages')
+    parser.add_argument('-o',
+                        '--output',
+                        type=Path,
+                        default=Path('output.parquet'),
+                        help='Parquet file to output to.')
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        default=None,
+                        help='Number of worker processes, defaults to the number of CPUs.')
+    parser.add_argument('--shard-size',
+                        type=int,
+                        default=None,
+                        help='Number of messages decoded by a worker at a time.')
+    args = parser.parse_args(argv)
+    return args
+
+
+def main():
+    """Decode every message of a BUFR file into a Parquet file."""
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args(sys.argv[1:])
+    rows = write_parquet(args.input, args.output, args.jobs, args.shard_size)
+    print(f'{rows} elements written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
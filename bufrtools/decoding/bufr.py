@@ -0,0 +1,597 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Module for decoding whole BUFR edition 4 messages."""
+from typing import (Any, List, Tuple, Union, Iterator, Optional, Sequence, Generator,
+                    NamedTuple)
+from functools import lru_cache
+
+import numpy as np
+
+from bufrtools.decoding import read_bytes_bitlen
+from bufrtools.tables.plan import (STRING, NUMERIC, REFERENCE, ASSOCIATED, REPLICATION,
+                                   DELAYED_REPLICATION, Plan, Step, get_plan)
+from bufrtools.tables.registry import get_registry
+from bufrtools.util.bitmath import extract_uint
+
+
+def read_uint(data: memoryview, offset: int, length: int) -> int:
+    """Returns the big-endian unsigned integer of `length` bytes starting at byte `offset`."""
+    return int.from_bytes(data[offset:offset + length], 'big')
+
+
+def decode_section0(data: memoryview) -> dict:
+    """Returns the contents of section 0, the indicator section."""
+    if bytes(data[0:4]) != b'BUFR':
+        raise ValueError('Data does not start with a BUFR indicator section')
+    section0 = {
+        'total_length': read_uint(data, 4, 3),
+        'edition': data[7],
+    }
+    if section0['edition'] != 4:
+        raise ValueError(f'Unsupported BUFR edition: {section0["edition"]}')
+    if section0['total_length'] > len(data):
+        raise ValueError(f'BUFR message is truncated, expected {section0["total_length"]} bytes '
+                         f'but got {len(data)}')
+    return section0
+
+
+def decode_section1(data: memoryview, offset: int) -> dict:
+    """Returns the contents of section 1, the identification section, starting at `offset`."""
+    section1 = {
+        'length': read_uint(data, offset, 3),
+        'master_table': data[offset + 3],
+        'originating_centre': read_uint(data, offset + 4, 2),
+        'sub_centre': read_uint(data, offset + 6, 2),
+        'seq_no': data[offset + 8],
+        'optional_section': bool(data[offset + 9] & 0x80),
+        'data_category': data[offset + 10],
+        'sub_category': data[offset + 11],
+        'local_category': data[offset + 12],
+        'master_table_version': data[offset + 13],
+        'local_table_version': data[offset + 14],
+        'year': read_uint(data, offset + 15, 2),
+        'month': data[offset + 17],
+        'day': data[offset + 18],
+        'hour': data[offset + 19],
+        'minute': data[offset + 20],
+        'second': data[offset + 21],
+    }
+    return section1
+
+
+def decode_section3(data: memoryview, offset: int) -> dict:
+    """Returns the contents of section 3, the data description section, starting at `offset`."""
+    length = read_uint(data, offset, 3)
+    flags = data[offset + 6]
+    descriptors = []
+    for i in range(offset + 7, offset + length - 1, 2):
+        f = data[i] >> 6
+        x = data[i] & 0x3F
+        y = data[i + 1]
+        descriptors.append(f'{f}{x:02d}{y:03d}')
+    section3 = {
+        'length': length,
+        'number_of_subsets': read_uint(data, offset + 4, 2),
+        'observed_flag': bool(flags & 0x80),
+        'compressed_flag': bool(flags & 0x40),
+        'descriptors': descriptors,
+    }
+    return section3
+
+
+def decode_sections(data: Union[bytes, memoryview]) -> dict:
+    """Returns the contents of every section of the message except for the section 4 data.
+
+    The returned message uses the same keys as the message accepted by
+    `bufrtools.encoding.bufr.encode_bufr`, with section 4 described by its byte offset and length.
+    """
+    data = memoryview(data)
+    section0 = decode_section0(data)
+    section1 = decode_section1(data, 8)
+    offset = 8 + section1['length']
+    if section1['optional_section']:
+        offset += read_uint(data, offset, 3)
+    section3 = decode_section3(data, offset)
+    offset += section3['length']
+    section4 = {
+        'offset': offset,
+        'length': read_uint(data, offset, 3),
+    }
+    offset += section4['length']
+    if bytes(data[offset:offset + 4]) != b'7777':
+        raise ValueError(f'Missing end section at offset {offset}')
+    return {
+        'section0': section0,
+        'section1': section1,
+        'section3': section3,
+        'section4': section4,
+    }
+
+
+@lru_cache(maxsize=None)
+def get_element(fxy: str) -> dict:
+    """Returns the Table B entry used to decode the element descriptor."""
+    row = get_registry().table_b(fxy)
+    if row is None:
+        raise ValueError(f'Unknown element descriptor: {fxy}')
+    unit = row['BUFR_Unit']
+    return {
+        'fxy': fxy,
+        'text': f'{row["ElementName_en"]} ({unit})',
+        'unit': unit,
+        'scale': int(row['BUFR_Scale']),
+        'offset': int(row['BUFR_ReferenceValue']),
+        'bit_len': int(row['BUFR_DataWidth_Bits']),
+        'type': 'string' if unit == 'CCITT IA5' else 'numeric',
+    }
+
+
+@lru_cache(maxsize=None)
+def get_text(fxy: str) -> str:
+    """Returns the text describing the fields of a plan step."""
+    if fxy.startswith('204'):
+        return 'Associated field'
+    if fxy.startswith('205'):
+        return 'Character data (CCITT IA5)'
+    if get_registry().table_b(fxy) is None:
+        # The local elements of 2-06 aren't in Table B
+        return f'Local element {fxy}'
+    return get_element(fxy)['text']
+
+
+def describe(step: Step, value: Any, bit_offset: int, bit_len: int, offset: int) -> dict:
+    """Returns the element dictionary of the field read for a plan step.
+
+    The dictionary is the same as `bufrtools.decoding.decode_numeric` and
+    `bufrtools.decoding.decode_ccit` return, `offset` is the byte offset of section 4 data in the
+    message.
+    """
+    text = get_text(step.fxy)
+    if step.kind == REFERENCE:
+        text = f'New reference value of {text}'
+    return {
+        'text': text,
+        'offset': offset + bit_offset // 8,
+        'length': (bit_len + bit_offset % 8) // 8 + 1,
+        'type': 'string' if step.kind == STRING else 'other',
+        'value': value,
+        'fxy': step.fxy,
+        'bit_offset': bit_offset,
+    }
+
+
+def get_section4_data(data: memoryview) -> Tuple[dict, memoryview]:
+    """Returns the decoded sections of the message and the data of section 4."""
+    message = decode_sections(data)
+    section4 = message['section4']
+    return message, data[section4['offset'] + 4:section4['offset'] + section4['length']]
+
+
+def decode_bufr(data: Union[bytes, memoryview]) -> Iterator[dict]:
+    """Yields every element of section 4 of the BUFR message, decoded lazily.
+
+    Each element is described with the same dictionary as `bufrtools.decoding.decode_numeric` and
+    `bufrtools.decoding.decode_ccit` return, `value` is None for missing values. Sequences,
+    replications and operators are expanded and applied but are not yielded, the fields they add to
+    the data, like delayed replication factors and associated fields, are. The elements of every
+    subset are yielded in turn, compressed messages are decoded whole before the first subset is
+    yielded.
+    """
+    data = memoryview(data)
+    message, body = get_section4_data(data)
+    section3 = message['section3']
+    if section3['compressed_flag']:
+        for subset in decode_subsets(data):
+            yield from subset
+        return
+    plan = get_plan(section3['descriptors'])
+    offset = message['section4']['offset'] + 4
+    bit_offset = 0
+    for _ in range(section3['number_of_subsets']):
+        end = []
+        for step, field_offset, value in iter_plan(body, plan, bit_offset, end):
+            yield describe(step, value, field_offset, step.bit_len, offset)
+        bit_offset = end[0]
+
+
+def decode_subsets(data: Union[bytes, memoryview]) -> Iterator[List[dict]]:
+    """Yields the decoded elements of every subset of the BUFR message, one list per subset."""
+    data = memoryview(data)
+    message, body = get_section4_data(data)
+    section3 = message['section3']
+    plan = get_plan(section3['descriptors'])
+    number_of_subsets = section3['number_of_subsets']
+    offset = message['section4']['offset'] + 4
+    if section3['compressed_flag']:
+        subsets = [[] for _ in range(number_of_subsets)]
+        fields = []
+        read_compressed_steps(body, plan.steps, 0, len(plan.steps), 0, subsets, {}, fields)
+        for j, subset in enumerate(subsets):
+            yield [describe(step, value, bit_offset + j * stride, bit_len, offset)
+                   for (_, value), (step, bit_offset, bit_len, stride) in zip(subset, fields)]
+        return
+    bit_offset = 0
+    for _ in range(number_of_subsets):
+        end = []
+        yield [describe(step, value, field_offset, step.bit_len, offset)
+               for step, field_offset, value in iter_plan(body, plan, bit_offset, end)]
+        bit_offset = end[0]
+
+
+def read_subsets(data: Union[bytes, memoryview]) -> Iterator[List[Tuple[str, Any]]]:
+    """Yields the descriptor and value of every element of every subset, one list per subset.
+
+    Values are the same as the `value` of the elements yielded by `decode_subsets`, but are not
+    described by a dictionary each, which makes this much cheaper for messages with many values.
+    Every operator from 2-01 to 2-08 is supported.
+    """
+    data = memoryview(data)
+    message, body = get_section4_data(data)
+    section3 = message['section3']
+    plan = get_plan(section3['descriptors'])
+    number_of_subsets = section3['number_of_subsets']
+    if section3['compressed_flag']:
+        yield from read_compressed_plan(body, plan, number_of_subsets)
+        return
+    bit_offset = 0
+    for _ in range(number_of_subsets):
+        values, bit_offset = read_plan(body, plan, bit_offset)
+        yield values
+
+
+def read_string(data: memoryview, bit_offset: int, bit_len: int) -> Optional[str]:
+    """Returns the CCITT IA5 string of the field, None if every bit is set."""
+    raw = read_bytes_bitlen(data, bit_offset, bit_len)
+    try:
+        return raw.decode('ascii').strip()
+    except UnicodeDecodeError:
+        if all(b == 0xFF for b in raw):
+            return None
+        return 'INVALID'
+
+
+def read_plan(data: memoryview, plan: Plan, bit_offset: int = 0) -> Tuple[list, int]:
+    """Returns the (fxy, value) of every element of an uncompressed subset and the bit offset after.
+
+    Delayed replication factors, the new reference values of 2-03 and the associated fields of 2-04,
+    named by their operator, are returned as elements too. Associated fields with every bit set are
+    missing.
+    """
+    end = []
+    values = [(step.fxy, value) for step, _, value in iter_plan(data, plan, bit_offset, end)]
+    return values, end[0]
+
+
+def iter_plan(data: memoryview, plan: Plan, bit_offset: int, end: list) -> Iterator[tuple]:
+    """Yields the (step, bit offset, value) of every field of the uncompressed subset.
+
+    The subset starts at `bit_offset`, the bit offset after it is appended to `end`.
+    """
+    end.append((yield from iter_steps(data, plan.steps, 0, len(plan.steps), bit_offset, {})))
+
+
+def iter_steps(data: memoryview,
+               steps: Sequence,
+               start: int,
+               stop: int,
+               bit_offset: int,
+               references: dict) -> Generator:
+    """Yields the (step, bit offset, value) of the field of every step from `start` up to `stop`.
+
+    Replications are run from a stack rather than by recursing, so that every field is yielded
+    through a single generator. Returns the bit offset after the last step.
+    """
+    # Replications being run, as the (first step of the body, repeats left, step after the body,
+    # stop of the enclosing steps)
+    stack = []
+    i = start
+    while True:
+        if i == stop:
+            if not stack:
+                return bit_offset
+            body, left, after, outer = stack[-1]
+            if left:
+                stack[-1] = (body, left - 1, after, outer)
+                i = body
+            else:
+                stack.pop()
+                i, stop = after, outer
+            continue
+        step = steps[i]
+        kind, fxy, bit_len, scale, offset, missing, span, count = step
+        i += 1
+        raw = extract_uint(data, bit_offset, bit_len) if bit_len else 0
+        if kind == NUMERIC:
+            if raw == missing:
+                yield step, bit_offset, None
+            else:
+                if offset is None:
+                    offset = references[fxy]
+                yield step, bit_offset, (offset + raw) / (10 ** scale)
+        elif kind == STRING:
+            yield step, bit_offset, read_string(data, bit_offset, bit_len)
+        elif kind == REPLICATION or kind == DELAYED_REPLICATION:
+            if kind == DELAYED_REPLICATION:
+                factor = (offset + raw) / (10 ** scale)
+                yield step, bit_offset, factor
+                count = int(factor)
+            if count:
+                stack.append((i, count - 1, i + span, stop))
+                stop = i + span
+            else:
+                i += span
+        elif kind == REFERENCE:
+            references[fxy] = signed_reference(raw, bit_len)
+            yield step, bit_offset, references[fxy]
+        elif kind == ASSOCIATED:
+            yield step, bit_offset, None if raw == missing else raw
+        bit_offset += bit_len
+
+
+def signed_reference(raw: int, bit_len: int) -> int:
+    """Returns the new reference value of 2-03, the leftmost bit is the sign."""
+    sign = 1 << (bit_len - 1)
+    return -(raw & (sign - 1)) if raw & sign else raw
+
+
+def read_compressed_plan(data: memoryview, plan: Plan, number_of_subsets: int) -> List[list]:
+    """Returns the (fxy, value) of every element of every subset of compressed data."""
+    subsets = [[] for _ in range(number_of_subsets)]
+    read_compressed_steps(data, plan.steps, 0, len(plan.steps), 0, subsets, {})
+    return subsets
+
+
+def read_compressed_steps(data: memoryview,
+                          steps: Sequence,
+                          start: int,
+                          stop: int,
+                          bit_offset: int,
+                          subsets: List[list],
+                          references: dict,
+                          fields: Optional[list] = None) -> int:
+    """Appends the elements of the steps from `start` up to `stop` to the list of every subset.
+
+    Every element starts with the reference value, followed by the bit width of the increments and
+    the increment of every subset, strings have a width in characters instead. If `fields` is given,
+    the (step, bit offset, bit length, stride) of the field of the first subset of every element is
+    appended to it, the field of the n-th subset is n strides after it. Returns the bit offset after
+    the last step.
+    """
+    number_of_subsets = len(subsets)
+    i = start
+    while i < stop:
+        step = steps[i]
+        kind, fxy, bit_len, scale, offset, missing, span, count = step
+        i += 1
+        if kind == REPLICATION:
+            for _ in range(count):
+                bit_offset = read_compressed_steps(data, steps, i, i + span, bit_offset, subsets,
+                                                   references, fields)
+            i += span
+            continue
+        reference = extract_uint(data, bit_offset, bit_len)
+        width = extract_uint(data, bit_offset + bit_len, 6)
+        if fields is not None:
+            if width == 0:
+                fields.append((step, bit_offset, bit_len, 0))
+            else:
+                increment_len = width * 8 if kind == STRING else width
+                fields.append((step, bit_offset + bit_len + 6, increment_len, increment_len))
+        bit_offset += bit_len + 6
+        if kind == STRING:
+            if width == 0:
+                values = [read_string(data, bit_offset - bit_len - 6, bit_len)] * number_of_subsets
+            else:
+                values = [read_string(data, bit_offset + j * width * 8, width * 8)
+                          for j in range(number_of_subsets)]
+            bit_offset += number_of_subsets * width * 8
+        elif width == 0:
+            # Every subset has the same value
+            if kind == REFERENCE:
+                value = references[fxy] = signed_reference(reference, bit_len)
+            elif reference == missing:
+                value = None
+            elif kind == ASSOCIATED:
+                value = reference
+            else:
+                if offset is None:
+                    offset = references[fxy]
+                value = (offset + reference) / (10 ** scale)
+            values = [value] * number_of_subsets
+        else:
+            if offset is None:
+                offset = references[fxy]
+            # Increments are relative to the reference, all ones increments are missing
+            increment_missing = (1 << width) - 1 if missing >= 0 else -1
+            values = []
+            for j in range(number_of_subsets):
+                increment = extract_uint(data, bit_offset + j * width, width)
+                if increment == increment_missing:
+                    values.append(None)
+                elif kind == ASSOCIATED:
+                    values.append(reference + increment)
+                else:
+                    values.append((offset + reference + increment) / (10 ** scale))
+            bit_offset += number_of_subsets * width
+        for subset, value in zip(subsets, values):
+            subset.append((fxy, value))
+        if kind == DELAYED_REPLICATION:
+            # Replication factors are the same for every subset of compressed data
+            for _ in range(int(values[0])):
+                bit_offset = read_compressed_steps(data, steps, i, i + span, bit_offset, subsets,
+                                                   references, fields)
+            i += span
+    return bit_offset
+
+
+class Layout(NamedTuple):
+    """Where the fields of the elements of uncompressed subsets are, one entry per element.
+
+    `subsets` holds the index of the first element of every subset, followed by the number of
+    elements.
+    """
+
+    steps: np.ndarray
+    bit_offsets: np.ndarray
+    subsets: np.ndarray
+
+
+@lru_cache(maxsize=256)
+def get_runs(plan: Plan) -> dict:
+    """Returns the static runs of the plan compiled so far, keyed by their (start, stop) steps."""
+    return {}
+
+
+def static_run(steps: Sequence, start: int, stop: int, runs: dict) -> tuple:
+    """Returns the run of steps from `start` that lay out the same way in every subset.
+
+    The run is the (end, step indices, relative bit offsets, bits) of the steps from `start` up to
+    `end`, stopping before the first step whose layout depends on the data, like a delayed
+    replication.
+    """
+    key = (start, stop)
+    run = runs.get(key)
+    if run is not None:
+        return run
+    indices = []
+    offsets = []
+    bits = 0
+    i = start
+    while i < stop:
+        kind, fxy, bit_len, scale, offset, missing, span, count = steps[i]
+        if kind == DELAYED_REPLICATION or kind == REFERENCE:
+            break
+        if kind == REPLICATION:
+            end, body_indices, body_offsets, body_bits = static_run(steps, i + 1, i + 1 + span,
+                                                                    runs)
+            if end != i + 1 + span:
+                break
+            indices.append(np.tile(body_indices, count))
+            offsets.append((bits + body_bits * np.arange(count)[:, None] + body_offsets).ravel())
+            bits += body_bits * count
+            i = end
+            continue
+        indices.append([i])
+        offsets.append([bits])
+        bits += bit_len
+        i += 1
+    run = runs[key] = (i, np.concatenate(indices or [[]]).astype(np.int32),
+                       np.concatenate(offsets or [[]]).astype(np.int64), bits)
+    return run
+
+
+class Walk(NamedTuple):
+    """Where the runs of a plan occur in uncompressed subsets, before they're expanded.
+
+    `occurrences` holds the bit offsets of the first repeat and the numbers of repeats of every
+    static run, keyed by the (start, stop) steps of the run in `runs`. `factors` holds the (step
+    indices, bit offsets) of the delayed replication factors, and `starts` the bit offset of every
+    subset followed by the bit offset after the last one.
+    """
+
+    runs: dict
+    occurrences: dict
+    factors: tuple
+    starts: list
+
+
+def walk_plan(data: Union[bytes, memoryview], plan: Plan, number_of_subsets: int) -> Walk:
+    """Returns where the static runs of the plan occur in the uncompressed subsets.
+
+    Only the delayed replication factors are read while walking the plan, every run of steps that
+    lays out the same way each time it occurs is recorded by where it starts. The new reference
+    values of 2-03 are not supported.
+    """
+    runs = get_runs(plan)
+    occurrences = {}
+    factors = ([], [])
+    starts = []
+    bit_offset = 0
+    for _ in range(number_of_subsets):
+        starts.append(bit_offset)
+        bit_offset = locate_steps(data, plan.steps, 0, len(plan.steps), bit_offset, runs,
+                                  occurrences, factors)
+    starts.append(bit_offset)
+    return Walk(runs, occurrences, factors, starts)
+
+
+def expand_walk(walk: Walk) -> Layout:
+    """Returns where the fields of every element are, locating the occurrences of a run at once."""
+    steps = [np.array(walk.factors[0], dtype=np.int32)]
+    bit_offsets = [np.array(walk.factors[1], dtype=np.int64)]
+    for key, (firsts, counts) in walk.occurrences.items():
+        _, indices, offsets, bits = walk.runs[key]
+        counts = np.array(counts, dtype=np.int64)
+        total = int(counts.sum())
+        # The n-th repeat of a run within a replication starts n times its width after the first
+        repeats = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        run_starts = np.repeat(np.array(firsts, dtype=np.int64), counts) + bits * repeats
+        steps.append(np.tile(indices, total))
+        bit_offsets.append((run_starts[:, None] + offsets).ravel())
+    steps = np.concatenate(steps)
+    bit_offsets = np.concatenate(bit_offsets)
+    # Every element occupies at least one bit, so the bit offsets order the elements
+    order = np.argsort(bit_offsets, kind='stable')
+    bit_offsets = bit_offsets[order]
+    return Layout(steps[order], bit_offsets, np.searchsorted(bit_offsets, walk.starts))
+
+
+def locate_plan(data: Union[bytes, memoryview], plan: Plan, number_of_subsets: int) -> Layout:
+    """Returns where the fields of every element of the uncompressed subsets are in the data.
+
+    The plan is walked with `walk_plan` and all the occurrences of a run are located at once
+    afterwards. The new reference values of 2-03 are not supported.
+    """
+    return expand_walk(walk_plan(data, plan, number_of_subsets))
+
+
+def locate_steps(data: Union[bytes, memoryview],
+                 steps: Sequence,
+                 start: int,
+                 stop: int,
+                 bit_offset: int,
+                 runs: dict,
+                 occurrences: dict,
+                 factors: tuple) -> int:
+    """Records where the steps from `start` up to `stop` are, returns the bit offset after them.
+
+    Static runs are recorded in `occurrences` as the bit offset of their first repeat and their
+    number of repeats, keyed by run. Delayed replication factors are appended to the (step
+    indices, bit offsets) of `factors`.
+    """
+    i = start
+    while i < stop:
+        key = (i, stop)
+        i, indices, offsets, bits = static_run(steps, i, stop, runs)
+        if len(indices):
+            record_run(occurrences, key, bit_offset, 1)
+            bit_offset += bits
+        if i >= stop:
+            break
+        kind, fxy, bit_len, scale, offset, missing, span, count = steps[i]
+        if kind == REFERENCE:
+            raise ValueError(f'Locating the new reference value of {fxy} is not supported')
+        if kind == DELAYED_REPLICATION:
+            factors[0].append(i)
+            factors[1].append(bit_offset)
+            count = int((offset + extract_uint(data, bit_offset, bit_len)) / (10 ** scale))
+            bit_offset += bit_len
+        body = i + 1 + span
+        end, indices, offsets, bits = static_run(steps, i + 1, body, runs)
+        if end == body:
+            if len(indices) and count:
+                record_run(occurrences, (i + 1, body), bit_offset, count)
+            bit_offset += bits * count
+        else:
+            for _ in range(count):
+                bit_offset = locate_steps(data, steps, i + 1, body, bit_offset, runs, occurrences,
+                                          factors)
+        i = body
+    return bit_offset
+
+
+def record_run(occurrences: dict, key: tuple, bit_offset: int, count: int):
+    """Records `count` consecutive repeats of the static run starting at `bit_offset`."""
+    firsts, counts = occurrences.setdefault(key, ([], []))
+    firsts.append(bit_offset)
+    counts.append(count)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Decoding of BUFR messages straight into typed columns, one per element descriptor.
+
+Decoded values are appended to a buffer per descriptor instead of being described by a dictionary
+each. Every subset becomes a row and every descriptor a list column holding the values of the
+subset for that descriptor, in order, so replicated elements like the levels of a profile stay
+together. Numeric columns are float64 with missing values as nulls, CCITT IA5 columns are strings.
+The associated fields of 2-04 and the local elements of 2-06 are numeric columns, the character
+data of 2-05 string columns.
+"""
+import sys
+import math
+import logging
+from array import array
+from typing import Dict, List, Union, Optional
+from pathlib import Path
+from argparse import Namespace, ArgumentParser
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from bufrtools.decoding.bufr import read_subsets
+from bufrtools.tables.codes import resolve_code_figures
+from bufrtools.tables.registry import get_registry
+from bufrtools.decoding.scan import BufrFile
+
+log = logging.getLogger(__name__)
+
+
+def get_unit(fxy: str) -> Optional[str]:
+    """Returns the Table B unit of the descriptor, None for operators and local elements."""
+    if not fxy.startswith('0'):
+        return None
+    row = get_registry().table_b(fxy)
+    return None if row is None else row['BUFR_Unit']
+
+
+class ColumnSink:
+    """Collects the values of decoded messages into one typed buffer per element descriptor.
+
+    Numeric values are kept in `array('d')` buffers, with NaN for missing values, and strings in
+    lists. Nothing is converted until `to_table` is called.
+    """
+
+    def __init__(self):
+        """Initializes an empty sink."""
+        self.messages = array('i')
+        self.subsets = array('i')
+        self.messages_added = 0
+        self._columns: Dict[str, Union[array, list]] = {}
+        self._offsets: Dict[str, array] = {}
+        self._missing: Dict[str, Optional[float]] = {}
+
+    @property
+    def num_rows(self) -> int:
+        """Returns the number of subsets collected."""
+        return len(self.subsets)
+
+    def _add_column(self, fxy: str) -> Union[array, list]:
+        """Returns a new column for the descriptor, without values for the rows collected so far."""
+        if fxy.startswith('205') or get_unit(fxy) == 'CCITT IA5':
+            column = []
+            self._missing[fxy] = None
+        else:
+            column = array('d')
+            self._missing[fxy] = math.nan
+        self._columns[fxy] = column
+        self._offsets[fxy] = array('i', [0] * (self.num_rows + 1))
+        return column
+
+    def add_message(self, data: Union[bytes, memoryview], message: Optional[int] = None) -> int:
+        """Decodes the message into the columns and returns the number of subsets added.
+
+        Rows are labelled with the `message` number, which defaults to the number of messages added
+        so far.
+        """
+        if message is None:
+            message = self.messages_added
+        columns = self._columns
+        missing = self._missing
+        # Decode the whole message first so a message that fails leaves the columns untouched
+        subsets = list(read_subsets(data))
+        for subset, values in enumerate(subsets):
+            for fxy, value in values:
+                column = columns.get(fxy)
+                if column is None:
+                    column = self._add_column(fxy)
+                column.append(missing[fxy] if value is None else value)
+            for fxy, offsets in self._offsets.items():
+                offsets.append(len(columns[fxy]))
+            self.messages.append(message)
+            self.subsets.append(subset)
+        self.messages_added += 1
+        return len(subsets)
+
+    def to_table(self) -> pa.Table:
+        """Returns a table with a row per subset and a list column per element descriptor."""
+        names = ['message', 'subset']
+        arrays = [
+            pa.array(np.array(self.messages, dtype=np.int32)),
+            pa.array(np.array(self.subsets, dtype=np.int32)),
+        ]
+        for fxy, column in self._columns.items():
+            if isinstance(column, array):
+                values = np.array(column, dtype=np.float64)
+                values = pa.array(values, mask=np.isnan(values))
+            else:
+                values = pa.array(column, type=pa.string())
+            offsets = pa.array(np.array(self._offsets[fxy], dtype=np.int32))
+            names.append(fxy)
+            arrays.append(pa.ListArray.from_arrays(offsets, values))
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def write_parquet(self, output: str):
+        """Writes the table of the collected values to a Parquet file."""
+        pq.write_table(self.to_table(), str(output))
+
+
+def annotate_code_tables(table: pa.Table) -> pa.Table:
+    """Returns the table with the entry names of every code table column appended to it.
+
+    The names of a column `<fxy>` are added as a list column `<fxy>_name`, with nulls for missing
+    values and figures that aren't in the code table. Each column is resolved with a single lookup
+    of all its values.
+    """
+    for fxy in table.column_names:
+        if get_unit(fxy) != 'Code table':
+            continue
+        column = table.column(fxy).combine_chunks()
+        figures = column.flatten().to_numpy(zero_copy_only=False)
+        names = pa.array(resolve_code_figures(fxy, figures), type=pa.string())
+        offsets = column.offsets.to_numpy()
+        offsets = pa.array(offsets - offsets[0], type=pa.int32())
+        table = table.append_column(f'{fxy}_name', pa.ListArray.from_arrays(offsets, names))
+    return table
+
+
+def read_table(path: str) -> pa.Table:
+    """Returns the table of every message of a file of concatenated BUFR messages.
+
+    Messages that fail to decode are logged and left out.
+    """
+    sink = ColumnSink()
+    with BufrFile(path) as bufr_file:
+        for i in range(len(bufr_file)):
+            with bufr_file.message(i) as data:
+                try:
+                    sink.add_message(data, i)
+                except Exception as e:
+                    # Only log the text, the exception holds views of the mapped file
+                    log.warning('Unable to decode message %d of %s: %s', i, path,
+                                f'{type(e).__name__}: {e}')
+    return sink.to_table()
+
+
+def parse_args(argv: List[str]) -> Namespace:
+    """Returns the namespace parsed from the command line arguments."""
+    parser = ArgumentParser(description=main.__doc__)
+    parser.add_argument('input', type=Path, help='File of concatenated BUFR messages')
+    parser.add_argument('-o',
+                        '--output',
+                        type=Path,
+                        default=Path('output.parquet'),
+                        help='Parquet file to output to.')
+    args = parser.parse_args(argv)
+    return args
+
+
+def main():
+    """Decode every message of a BUFR file into a Parquet file with a column per descriptor."""
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args(sys.argv[1:])
+    table = read_table(args.input)
+    pq.write_table(table, str(args.output))
+    print(f'{table.num_rows} subsets written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
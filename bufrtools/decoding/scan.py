@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Module for locating the messages of files holding many concatenated BUFR messages.
+
+Files are memory-mapped and scanned for `BUFR` indicators, each message is delimited by the total
+length in its section 0 and must end with `7777`. Anything between messages, like GTS bulletin
+envelopes, is skipped. The resulting index can be saved next to the file so later readers can go
+straight to any message, when the directory is writable.
+"""
+import os
+import re
+import json
+import mmap
+import logging
+from typing import List, Iterator, Optional, NamedTuple
+from datetime import datetime
+
+from bufrtools.decoding.bufr import decode_bufr
+
+# Suffix of the index saved next to a BUFR file
+INDEX_SUFFIX = '.bufridx'
+
+INDEX_VERSION = 1
+
+# Indicator that starts every message, searched for in any buffer without copying it
+INDICATOR = re.compile(b'BUFR')
+
+log = logging.getLogger(__name__)
+
+
+class IndexEntry(NamedTuple):
+    """Location and summary of one message in a file."""
+
+    offset: int
+    length: int
+    date: Optional[datetime]
+    data_category: int
+    number_of_subsets: int
+
+
+def read_uint(data, offset: int, length: int) -> int:
+    """Returns the big-endian unsigned integer of `length` bytes starting at byte `offset`."""
+    return int.from_bytes(data[offset:offset + length], 'big')
+
+
+def read_entry(data, offset: int) -> Optional[IndexEntry]:
+    """Returns the index entry of the message starting at `offset`, None if there is none."""
+    if offset + 8 > len(data) or data[offset + 7] != 4:
+        return None
+    length = read_uint(data, offset + 4, 3)
+    end = offset + length
+    if length < 8 + 22 + 7 + 4 + 4 or end > len(data) or data[end - 4:end] != b'7777':
+        return None
+    section1 = offset + 8
+    try:
+        date = datetime(read_uint(data, section1 + 15, 2), *data[section1 + 17:section1 + 22])
+    except ValueError:
+        date = None
+    section3 = section1 + read_uint(data, section1, 3)
+    if data[section1 + 9] & 0x80:
+        # Skip the optional section 2
+        section3 += read_uint(data, section3, 3)
+    if section3 + 7 > end:
+        return None
+    return IndexEntry(offset, length, date, data[section1 + 10], read_uint(data, section3 + 4, 2))
+
+
+def scan_messages(data) -> Iterator[IndexEntry]:
+    """Yields the index entry of every message in the buffer, in the order they appear.
+
+    The buffer is anything that supports the buffer protocol, like bytes, an mmap or a memoryview.
+    """
+    match = INDICATOR.search(data)
+    while match is not None:
+        offset = match.start()
+        entry = read_entry(data, offset)
+        if entry is None:
+            match = INDICATOR.search(data, offset + 1)
+        else:
+            yield entry
+            match = INDICATOR.search(data, offset + entry.length)
+
+
+def get_index_path(path: str) -> str:
+    """Returns the path of the index saved next to the BUFR file."""
+    return f'{path}{INDEX_SUFFIX}'
+
+
+def save_index(path: str, entries: List[IndexEntry]):
+    """Saves the index next to the BUFR file, along with the size and time the file was modified."""
+    stat = os.stat(path)
+    index = {
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'messages': [[
+            entry.offset,
+            entry.length,
+            entry.date.isoformat() if entry.date else None,
+            entry.data_category,
+            entry.number_of_subsets,
+        ] for entry in entries],
+    }
+    with open(get_index_path(path), 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+
+
+def load_index(path: str) -> Optional[List[IndexEntry]]:
+    """Returns the saved index of the BUFR file, or None if there isn't one or it's out of date."""
+    try:
+        with open(get_index_path(path), encoding='utf-8') as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+    stat = os.stat(path)
+    if (index.get('version') != INDEX_VERSION or index['size'] != stat.st_size or
+            index['mtime_ns'] != stat.st_mtime_ns):
+        return None
+    return [
+        IndexEntry(offset, length, datetime.fromisoformat(date) if date else None, category,
+                   subsets)
+        for offset, length, date, category, subsets in index['messages']
+    ]
+
+
+def build_index(path: str, save: bool = True) -> List[IndexEntry]:
+    """Returns the index of every message in the BUFR file, reusing the saved index when current.
+
+    A newly built index is saved next to the file if `save` is set. Failing to save it, in a
+    read-only archive for instance, is logged and the index is returned all the same.
+    """
+    entries = load_index(path)
+    if entries is not None:
+        return entries
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            entries = []
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                entries = list(scan_messages(data))
+    if save:
+        try:
+            save_index(path, entries)
+        except OSError as e:
+            log.warning('Unable to save the index of %s: %s', path, e)
+    return entries
+
+
+class BufrFile:
+    """Random access to the messages of a file of concatenated BUFR messages.
+
+    The file is memory-mapped, so accessing a message only reads the pages it spans. Use it as a
+    context manager, messages returned by `message` are views of the mapping and must be released
+    before the file is closed.
+    """
+
+    def __init__(self, path: str, save: bool = True):
+        """Opens and indexes the file."""
+        self.path = str(path)
+        self.index = build_index(self.path, save)
+        self._file = open(self.path, 'rb')
+        self._data = None
+        if self.index:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self) -> 'BufrFile':
+        """Returns the file."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Closes the file."""
+        self.close()
+
+    def __len__(self) -> int:
+        """Returns the number of messages in the file."""
+        return len(self.index)
+
+    def close(self):
+        """Unmaps and closes the file."""
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._file.close()
+
+    def message(self, i: int) -> memoryview:
+        """Returns a view of the bytes of the `i`th message."""
+        entry = self.index[i]
+        return memoryview(self._data)[entry.offset:entry.offset + entry.length]
+
+    def decode(self, i: int) -> List[dict]:
+        """Returns every decoded element of the `i`th message."""
+        with self.message(i) as data:
+            return list(decode_bufr(data))
@@ -11,6 +11,8 @@ import yaml
 import numpy as np
 import pandas as pd
 from bufrtools.encoding.bufr import encode_bufr
+from bufrtools.encoding.verify import verify_message, format_mismatches
+from bufrtools.util.instrument import dump, collect
 
 
 def parse_args(argv: List[str]) -> Namespace:
@@ -25,6 +27,15 @@ def parse_args(argv: List[str]) -> Namespace:
     parser.add_argument('descriptor',
                         type=Path,
                         help='A YAML or JSON file describing the message\'s global attributes.')
+    parser.add_argument('--profile-stats',
+                        type=str,
+                        default=None,
+                        help='Write the timings and counters of every stage as JSON to this file, '
+                        'or to stdout if it is -.')
+    parser.add_argument('--verify',
+                        action='store_true',
+                        help='Decode the encoded message and compare it with the input before '
+                        'writing it, fails on the first mismatches.')
     args = parser.parse_args(argv)
     return args
 
@@ -53,10 +64,21 @@ def main():
         msg['section4'] = section4
 
     context = {}
-    encode_bufr(msg, context)
+    if args.profile_stats is None:
+        encode_bufr(msg, context)
+    else:
+        with collect() as stats:
+            encode_bufr(msg, context)
+        dump(stats, args.profile_stats)
     buf = context['buf']
     buf.seek(0)
-    args.output.write_bytes(buf.read())
+    data = buf.read()
+    if args.verify:
+        mismatches = verify_message(msg, data)
+        if mismatches:
+            print(format_mismatches(mismatches), file=sys.stderr)
+            return 1
+    args.output.write_bytes(data)
     return 0
 
 
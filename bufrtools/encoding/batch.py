@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Batch encoding of Wildlife Computers datasets across a pool of worker processes.
+
+Inputs are given as directories, glob patterns, file paths or a manifest CSV with an `input`
+column and optional `output`, `uuid` and `ptt` columns. Each input is encoded to its own BUFR file
+in the output directory, at its path relative to the directory or glob pattern it was found by.
+"""
+import os
+import csv
+import sys
+import glob
+import time
+import tempfile
+from typing import List, Optional, NamedTuple
+from pathlib import Path
+from argparse import Namespace, ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+from bufrtools.tables import get_sequence_template
+from bufrtools.encoding import wildlife_computers
+
+# Suffixes of the dataset files picked up from directories
+DATASET_SUFFIXES = ('.nc', '.parquet', '.csv')
+
+# Sequences used by every Wildlife Computers message, compiled once when a worker starts
+WARM_SEQUENCES = ('301150', '315023')
+
+
+class Job(NamedTuple):
+    """A dataset to encode and where to write it."""
+
+    input: Path
+    output: Path
+    uuid: Optional[str] = None
+    ptt: Optional[str] = None
+
+
+class Result(NamedTuple):
+    """The outcome of encoding a single dataset."""
+
+    input: Path
+    output: Path
+    seconds: float
+    size: int = 0
+    error: Optional[str] = None
+
+
+def expand_source(source: str) -> List[Path]:
+    """Returns the dataset files for a directory, glob pattern or file path."""
+    path = Path(source)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.suffix in DATASET_SUFFIXES)
+    if glob.has_magic(source):
+        return sorted(Path(p) for p in glob.glob(source, recursive=True))
+    return [path]
+
+
+def get_source_root(source: str) -> Path:
+    """Returns the directory the dataset files of a source are found in.
+
+    For glob patterns it's the part of the pattern before the first wildcard.
+    """
+    path = Path(source)
+    if path.is_dir():
+        return path
+    if glob.has_magic(source):
+        root = Path()
+        for part in path.parts:
+            if glob.has_magic(part):
+                break
+            root /= part
+        return root
+    return path.parent
+
+
+def read_manifest(manifest: Path, output_dir: Path) -> List[Job]:
+    """Returns the jobs listed in a manifest CSV, relative paths are relative to the manifest."""
+    jobs = []
+    with open(manifest, encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            input_path = manifest.parent / row['input']
+            if row.get('output'):
+                output = output_dir / row['output']
+            else:
+                output = output_dir / f'{input_path.stem}.bufr'
+            jobs.append(Job(input_path, output, row.get('uuid') or None, row.get('ptt') or None))
+    return jobs
+
+
+def collect_jobs(sources: List[str],
+                 output_dir: Path,
+                 manifest: Optional[Path] = None,
+                 uuid: Optional[str] = None,
+                 ptt: Optional[str] = None) -> List[Job]:
+    """Returns one job per dataset found in the sources and the manifest.
+
+    Outputs mirror the path of every input relative to the directory of its source, so datasets
+    found in subdirectories by a recursive glob pattern are written to the same subdirectories.
+    Raises a ValueError if two inputs would be written to the same output.
+    """
+    jobs = []
+    for source in sources:
+        root = get_source_root(source)
+        for path in expand_source(source):
+            output = output_dir / path.relative_to(root).with_suffix('.bufr')
+            jobs.append(Job(path, output, uuid, ptt))
+    if manifest is not None:
+        for job in read_manifest(manifest, output_dir):
+            jobs.append(job._replace(uuid=job.uuid or uuid, ptt=job.ptt or ptt))
+    inputs = {}
+    for job in jobs:
+        other = inputs.setdefault(job.output, job.input)
+        if other != job.input:
+            raise ValueError(f'{other} and {job.input} would both be written to {job.output}')
+    return jobs
+
+
+def write_atomic(output: Path, data: bytes):
+    """Writes the data to a temporary file next to `output` and renames it to `output`.
+
+    Readers never see a partially written file, and a failed write leaves `output` untouched.
+    """
+    fd, tmp_name = tempfile.mkstemp(prefix=f'.{output.name}.', dir=output.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, output)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def warm_worker():
+    """Loads the tables and compiles the sequence templates before the worker takes any job."""
+    for fxy in WARM_SEQUENCES:
+        get_sequence_template(fxy)
+
+
+def encode_job(job: Job) -> Result:
+    """Encodes the dataset of the job and returns the outcome, failures are returned not raised."""
+    start = time.perf_counter()
+    try:
+        data = wildlife_computers.encode_message(job.input, uuid=job.uuid, ptt=job.ptt)
+        write_atomic(job.output, data)
+    except Exception as e:
+        return Result(job.input, job.output, time.perf_counter() - start,
+                      error=f'{type(e).__name__}: {e}')
+    return Result(job.input, job.output, time.perf_counter() - start, len(data))
+
+
+def run_batch(jobs: List[Job], workers: Optional[int] = None) -> List[Result]:
+    """Encodes every job across a pool of `workers` processes, one per CPU by default.
+
+    Results are returned in the order of the jobs.
+    """
+    if not jobs:
+        return []
+    for output_dir in {job.output.parent for job in jobs}:
+        output_dir.mkdir(parents=True, exist_ok=True)
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    # Small chunks keep the workers busy when dataset sizes vary
+    chunksize = max(1, len(jobs) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_worker) as executor:
+        return list(executor.map(encode_job, jobs, chunksize=chunksize))
+
+
+def format_summary(results: List[Result], elapsed: float) -> str:
+    """Returns a human readable summary with the timing of every file and the failures."""
+    lines = []
+    for result in results:
+        if result.error is None:
+            lines.append(f'ok     {result.seconds:8.3f}s {result.size:10d} B  {result.input} -> '
+                         f'{result.output}')
+        else:
+            lines.append(f'FAILED {result.seconds:8.3f}s {"":10s}    {result.input}: '
+                         f'{result.error}')
+    failures = sum(1 for result in results if result.error is not None)
+    busy = sum(result.seconds for result in results)
+    lines.append(f'{len(results) - failures} encoded, {failures} failed in {elapsed:.3f}s '
+                 f'({busy:.3f}s spent encoding)')
+    return '\n'.join(lines)
+
+
+def parse_args(argv: List[str]) -> Namespace:
+    """Returns the namespace parsed from the command line arguments."""
+    parser = ArgumentParser(description=main.__doc__)
+    parser.add_argument('sources',
+                        nargs='*',
+                        help='Dataset files, directories or glob patterns (quote the pattern).')
+    parser.add_argument('-m',
+                        '--manifest',
+                        type=Path,
+                        default=None,
+                        help='CSV with an input column and optional output, uuid and ptt columns.')
+    parser.add_argument('-o',
+                        '--output-dir',
+                        type=Path,
+                        default=Path('.'),
+                        help='Directory to write the BUFR files to.')
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        default=None,
+                        help='Number of worker processes, defaults to the number of CPUs.')
+    parser.add_argument('-u',
+                        '--uuid',
+                        type=str,
+                        default=None)
+    parser.add_argument('-p',
+                        '--ptt',
+                        type=str,
+                        default=None)
+    args = parser.parse_args(argv)
+    if not args.sources and args.manifest is None:
+        parser.error('at least one source or a manifest is required')
+    return args
+
+
+def main():
+    """Encode many Wildlife Computers profile datasets in parallel."""
+    args = parse_args(sys.argv[1:])
+    try:
+        jobs = collect_jobs(args.sources, args.output_dir, args.manifest, args.uuid, args.ptt)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    start = time.perf_counter()
+    results = run_batch(jobs, args.jobs)
+    print(format_summary(results, time.perf_counter() - start))
+    return 1 if any(result.error is not None for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,22 +4,54 @@
 import io
 import os
 import math
+from typing import List, Iterator, Optional, Sequence, NamedTuple
+from functools import lru_cache
 
 import numpy as np
 from bufrtools.util.parse import parse_ref
-from bufrtools.util.bitmath import shift_uint, encode_uint
+from bufrtools.tables.plan import (STRING, NUMERIC, REFERENCE, ASSOCIATED, REPLICATION,
+                                   DELAYED_REPLICATION, Plan, get_plan)
+from bufrtools.util.bitmath import BitWriter, shift_uint
+from bufrtools.util.instrument import stage
+
+
+# Width of the increment width field written for every element of a compressed section 4
+COMPRESSED_WIDTH_BITS = 6
+
+# Number of rows packed at once by `pack_columns`, a multiple of 8 so that every chunk ends on a
+# byte boundary
+COLUMN_CHUNK_ROWS = 8192
+
+
+class ColumnLayout(NamedTuple):
+    """Compiled layout of a block of numeric elements that repeats once per row."""
+
+    fxy: tuple
+    bit_len: np.ndarray
+    scale: np.ndarray
+    offset: np.ndarray
 
 
 def encode_bufr(message: dict, context: dict):
     """Encodes a BUFR file based on the contents of message."""
     if 'buf' not in context:
         context['buf'] = io.BytesIO()
-    encode_section0(message, context)
-    encode_section1(message, context)
-    encode_section3(message, context)
-    encode_section4(message, context)
-    encode_section5(context)
-    finalize_bufr(context)
+    with stage('encode_bufr') as record:
+        buf = context['buf']
+        start = buf.tell()
+        encode_section0(message, context)
+        encode_section1(message, context)
+        encode_section3(message, context)
+        with stage('pack_section4') as section4_record:
+            section4_start = buf.tell()
+            if message['section3']['compressed_flag']:
+                encode_compressed_section4(message, context)
+            else:
+                encode_section4(message, context)
+            section4_record.add(len(message['section4']), buf.tell() - section4_start)
+        encode_section5(context)
+        record.add(1, buf.tell() - start)
+        finalize_bufr(context)
 
 
 def finalize_bufr(context: dict):
@@ -45,147 +77,139 @@ def encode_section0(message: dict, context: dict):
 
 def encode_section1(message: dict, context: dict):
     """Encodes section1."""
-    buf = context['buf']
-    section1 = message['section1']
-    start = buf.tell()
-    section_len_total = 0  # This number will be updated during finalization
-    buf.seek(start + 3)
-    buf.write(b'\x00')  # BUFR Master Table 0
-    originating_centre = shift_uint(section1['originating_centre'], 16, 0, 16)
-    buf.write(originating_centre)
-    sub_centre = shift_uint(section1['sub_centre'], 16, 0, 16)
-    buf.write(sub_centre)
-    seq_no = bytes([section1['seq_no']])
-    buf.write(seq_no)
-    buf.write(b'\x00')  # No section 2
-    data_category = bytes([section1['data_category']])
-    buf.write(data_category)
-    sub_category = bytes([section1['sub_category']])
-    buf.write(sub_category)
-    local_category = bytes([section1['local_category']])
-    buf.write(local_category)
-    master_table_version = bytes([section1['master_table_version']])
-    buf.write(master_table_version)
-    local_table_version = bytes([section1['local_table_version']])
-    buf.write(local_table_version)
-    year = shift_uint(section1['year'], 16, 0, 16)
-    buf.write(year)
-    month = bytes([section1['month']])
-    buf.write(month)
-    day = bytes([section1['day']])
-    buf.write(day)
-    hour = bytes([section1['hour']])
-    buf.write(hour)
-    minute = bytes([section1['minute']])
-    buf.write(minute)
-    second = bytes([section1['second']])
-    buf.write(second)
-    end = buf.tell()
-    buf.seek(start)
-    section_len_total = end - start
-    section_len_total_b = shift_uint(section_len_total, 24, 0, 24)
-    buf.write(section_len_total_b)
-    buf.seek(end)
+    context['buf'].write(section1_bytes(message['section1']))
+
+
+def section1_bytes(section1: dict) -> bytes:
+    """Returns the encoded section 1, the identification section."""
+    data = b''.join([
+        b'\x00',  # BUFR Master Table 0
+        section1['originating_centre'].to_bytes(2, 'big'),
+        section1['sub_centre'].to_bytes(2, 'big'),
+        bytes([section1['seq_no']]),
+        b'\x00',  # No section 2
+        bytes([
+            section1['data_category'],
+            section1['sub_category'],
+            section1['local_category'],
+            section1['master_table_version'],
+            section1['local_table_version'],
+        ]),
+        section1['year'].to_bytes(2, 'big'),
+        bytes([
+            section1['month'],
+            section1['day'],
+            section1['hour'],
+            section1['minute'],
+            section1['second'],
+        ]),
+    ])
+    return (len(data) + 3).to_bytes(3, 'big') + data
 
 
 def encode_section3(message: dict, context: dict):
     """Encodes section 3."""
-    buf = context['buf']
-    section3 = message['section3']
-    start = buf.tell()
-    buf.seek(start + 3)
-    buf.write(b'\x00')  # Set to 0 per standard
-    number_of_subsets = shift_uint(section3['number_of_subsets'], 16, 0, 16)
-    buf.write(number_of_subsets)
+    context['buf'].write(section3_bytes(message['section3']))
+
+
+def section3_bytes(section3: dict) -> bytes:
+    """Returns the encoded section 3, the data description section."""
     flags_byte = 0
     if section3['observed_flag']:
         flags_byte |= 0x80
     if section3['compressed_flag']:
         flags_byte |= 0x40
-    buf.write(bytes([flags_byte]))
+    descriptors = encode_descriptors(tuple(section3['descriptors']))
+    section_len = 7 + len(descriptors)
+    return b''.join([
+        section_len.to_bytes(3, 'big'),
+        b'\x00',  # Set to 0 per standard
+        section3['number_of_subsets'].to_bytes(2, 'big'),
+        bytes([flags_byte]),
+        descriptors,
+    ])
 
-    for descriptor in section3['descriptors']:
-        f, x, y = parse_ref(descriptor)
-        fx = bytearray(1)
-        fx = encode_uint(fx, f, 0, 2)
-        fx = encode_uint(fx, x, 2, 6)
-        buf.write(fx)
-        buf.write(bytes([y]))
 
-    end = buf.tell()
-    section_len = end - start
-    buf.seek(start)
-    section_len_b = shift_uint(section_len, 24, 0, 24)
-    buf.write(section_len_b)
-    buf.seek(end)
+@lru_cache(maxsize=256)
+def encode_descriptors(descriptors: tuple) -> bytes:
+    """Returns the descriptors of section 3 encoded as two bytes each."""
+    data = bytearray()
+    for descriptor in descriptors:
+        f, x, y = parse_ref(descriptor)
+        data.append((f << 6) | x)
+        data.append(y)
+    return bytes(data)
 
 
 def encode_section4(message: dict, context: dict):
     """Encodes section 4."""
-    buf = context['buf']
-    write_buf = io.BytesIO()
-    start = buf.tell()
-    buf.seek(start + 3)
-    buf.write(b'\x00')
-
-    bit_offset = 0
-    sequence = message['section4'][:]
-    override_bitlength = None
+    if is_values(message['section4']):
+        write_section4(context['buf'], pack_data(message))
+    else:
+        write_section4(context['buf'], pack_section4(message['section4']))
+
+
+def write_section4(buf, writer: BitWriter):
+    """Writes the header of section 4 followed by the packed data of the writer."""
+    data = writer.getbuffer()
+    section_len = 4 + len(data)
+    buf.write(section_len.to_bytes(3, 'big') + b'\x00')
+    buf.write(data)
+    data.release()
+
+
+def pack_section4(sequence: List[dict], writer: Optional[BitWriter] = None) -> BitWriter:
+    """Returns a writer holding the packed data of the section 4 records of a single subset.
+
+    The data is appended to `writer` if one is given.
+    """
+    if writer is None:
+        writer = BitWriter()
+    append_uint = writer.write_uint
+    # 2-01-YYY changes the width of numeric elements by YYY - 128 bits
+    width_delta = 0
+    # 2-08-YYY changes the width of CCITT IA5 elements to YYY characters
+    string_bitlength = None
     for seq in sequence:
+        # Blocks of numeric columns are packed in a single vectorized step
+        if seq['type'] == 'columns':
+            encode_columns(writer, seq['layout'], seq['value'])
+            continue
         # Deal with operators
         if seq['type'] == 'operator':
             f, x, y = parse_ref(seq['fxy'])
             if (f, x) == (2, 8):
                 if y > 0:
-                    override_bitlength = y * 8
+                    string_bitlength = y * 8
                 else:
-                    override_bitlength = None
-            # This is a cancel code
-            if (f, x, y) == (2, 1, 0):
-                override_bitlength = None
-            # Special case or is 129 always a change to 24?
-            if (f, x, y) == (2, 1, 129):
-                override_bitlength = 24
+                    string_bitlength = None
+            # A YYY of 0 is a cancel code
+            if (f, x) == (2, 1):
+                width_delta = y - 128 if y > 0 else 0
             continue
         if seq['bit_len'] < 1:
             # Skip 0-length sections, they're for information purposes only
             continue
         if seq['type'] == 'numeric':
-            bitlen = seq['bit_len']
-            if override_bitlength:
-                bitlen = override_bitlength
-            value = seq['value']
-            if np.isnan(float(value)):
+            bitlen = seq['bit_len'] + width_delta
+            value = float(seq['value'])
+            if math.isnan(value):
                 # If a value is NaN, fill it with all 1s,
                 # which is the BUFR missing_value. Do not
                 # apply scale and offset
-                value = float(int('1' * bitlen, 2))
+                value = float((1 << bitlen) - 1)
             else:
-                value = float(seq['value'])
                 if seq['scale']:
                     value = value * math.pow(10, seq['scale'])
                 if seq['offset']:
                     value = value - seq['offset']
             # The value should be ROUNDED to the nearest integer
-            value = int(np.round(value))
-            write_uint(write_buf, value, bit_offset, bitlen)
-            bit_offset += seq['bit_len']
+            value = round(value)
+            append_uint(value, bitlen)
         elif seq['type'] == 'string':
-            bitlen = seq['bit_len']
-            if override_bitlength:
-                bitlen = override_bitlength
-            write_ascii(write_buf, str(seq['value']), bit_offset, bitlen)
-            bit_offset += seq['bit_len']
-
-    write_buf.seek(0)
-    buf.write(write_buf.read())
-    # Write section length
-    end = buf.tell()
-    section_len = end - start
-    section_len_b = shift_uint(section_len, 24, 0, 24)
-    buf.seek(start)
-    buf.write(section_len_b)
-    buf.seek(end)
+            bitlen = string_bitlength or seq['bit_len']
+            pack_ascii(writer, str(seq['value']), bitlen)
+    return writer
 
 
 def encode_section5(context: dict):
@@ -194,22 +218,365 @@ def encode_section5(context: dict):
     buf.write(b'7777')
 
 
-def write_uint(buf, value, bit_offset, bitlen):
-    """Writes an unsgined integer to the buffer at `bit_offset` that occupies `bitlen` bits."""
-    byte_start = bit_offset // 8
+def encode_compressed_section4(message: dict, context: dict):
+    """Encodes section 4 for several subsets with the WMO data compression.
+
+    `message['section4']` holds one list of records per subset, in the format accepted by
+    `encode_section4`.
+    """
+    write_section4(context['buf'], pack_data(message))
+
+
+def pack_data(message: dict, writer: Optional[BitWriter] = None) -> BitWriter:
+    """Returns a writer holding the packed section 4 data of the message.
+
+    The data is compressed when section 3 sets the compressed flag, `message['section4']` then holds
+    one list of records per subset. Instead of records, a subset can be given as the list of its
+    values in the order the descriptors of section 3 expand to, which is encoded with the compiled
+    plan of the descriptors. The data is appended to `writer` if one is given.
+    """
+    section3 = message['section3']
+    section4 = message['section4']
+    number_of_subsets = section3['number_of_subsets']
+    if not section3['compressed_flag']:
+        if is_values(section4):
+            return pack_values(get_plan(section3['descriptors']), section4, number_of_subsets,
+                               writer)
+        return pack_section4(section4, writer)
+    if len(section4) != number_of_subsets:
+        raise ValueError(f'Section 3 declares {number_of_subsets} subsets, '
+                         f'got {len(section4)}')
+    if section4 and is_values(section4[0]):
+        plan = get_plan(section3['descriptors'])
+        return pack_compressed_elements([list(expand_plan(plan, values)) for values in section4],
+                                        writer)
+    return pack_compressed_section4(section4, writer)
+
+
+def is_values(section4: list) -> bool:
+    """Returns True if the section 4 data is given as values instead of records."""
+    return bool(section4) and not isinstance(section4[0], dict)
+
+
+def pack_values(plan: Plan,
+                values: Sequence,
+                number_of_subsets: int = 1,
+                writer: Optional[BitWriter] = None) -> BitWriter:
+    """Returns a writer holding the uncompressed data of the values of every subset.
+
+    `values` holds the values of each subset in turn, in the order of the elements of the plan. NaN
+    and None are missing values. The data is appended to `writer` if one is given.
+    """
+    if writer is None:
+        writer = BitWriter()
+    write_uint = writer.write_uint
+    values = iter(values)
+    end = object()
+    for _ in range(number_of_subsets):
+        for fxy, typename, bit_len, scale, offset, value in expand_plan(plan, values):
+            if value is None or value != value:
+                write_uint((1 << bit_len) - 1, bit_len)
+            elif typename == 'string':
+                pack_ascii(writer, str(value), bit_len)
+            else:
+                write_uint(round(value * math.pow(10, scale) - offset), bit_len)
+    if next(values, end) is not end:
+        raise ValueError('More values than the descriptors of section 3 expand to')
+    return writer
+
+
+def expand_plan(plan: Plan, values) -> Iterator[tuple]:
+    """Yields the (fxy, type, bit_len, scale, offset, value) of every element of a subset.
+
+    Values are taken from the `values` iterable in the order of the elements of the plan, including
+    the delayed replication factors, the new reference values of 2-03 and the associated fields of
+    2-04. Replications are run with their factors. New reference values have the type `reference`
+    and are yielded as the raw field, with the leftmost bit as the sign.
+    """
+    values = iter(values)
+    try:
+        yield from expand_steps(plan.steps, 0, len(plan.steps), values, {})
+    except StopIteration:
+        raise ValueError('Fewer values than the descriptors of section 3 expand to') from None
+
+
+def expand_steps(steps: Sequence, start: int, stop: int, values: Iterator, references: dict):
+    """Yields the elements of the steps from `start` up to `stop` of a plan."""
+    i = start
+    while i < stop:
+        kind, fxy, bit_len, scale, offset, missing, span, count = steps[i]
+        i += 1
+        if kind == NUMERIC:
+            if offset is None:
+                offset = references[fxy]
+            yield fxy, 'numeric', bit_len, scale, offset, next(values)
+        elif kind == STRING:
+            yield fxy, 'string', bit_len, 0, 0, next(values)
+        elif kind == REPLICATION or kind == DELAYED_REPLICATION:
+            if kind == DELAYED_REPLICATION:
+                count = next(values)
+                yield fxy, 'numeric', bit_len, scale, offset, count
+                count = int(count)
+            for _ in range(count):
+                yield from expand_steps(steps, i, i + span, values, references)
+            i += span
+        elif kind == REFERENCE:
+            # New reference values are written with the leftmost bit as the sign
+            reference = int(next(values))
+            references[fxy] = reference
+            raw = abs(reference) | (1 << (bit_len - 1)) if reference < 0 else reference
+            yield fxy, 'reference', bit_len, 0, 0, raw
+        elif kind == ASSOCIATED:
+            yield fxy, 'numeric', bit_len, 0, 0, next(values)
+
+
+def pack_compressed_section4(subsets: List[List[dict]],
+                             writer: Optional[BitWriter] = None) -> BitWriter:
+    """Returns a writer holding the compressed data of the section 4 records of every subset.
+
+    Every subset must expand to the same elements, so replication factors must be identical across
+    subsets. For each element the minimum value of the subsets is written as the reference,
+    followed by the bit width of the increments and the increment of every subset. The data is
+    appended to `writer` if one is given.
+    """
+    return pack_compressed_elements([list(expand_elements(records)) for records in subsets], writer)
+
+
+def pack_compressed_elements(expanded: List[List[tuple]],
+                             writer: Optional[BitWriter] = None) -> BitWriter:
+    """Returns a writer holding the compressed data of the expanded elements of every subset.
+
+    The data is appended to `writer` if one is given.
+    """
+    descriptors = [element[:3] for element in expanded[0]]
+    for i, elements in enumerate(expanded[1:], 1):
+        if [element[:3] for element in elements] != descriptors:
+            raise ValueError(f'Subset {i} does not expand to the same elements as the first '
+                             'subset, compressed subsets need identical replication factors')
+
+    if writer is None:
+        writer = BitWriter()
+    for j, (fxy, typename, bit_len, scale, offset, _) in enumerate(expanded[0]):
+        values = [elements[j][5] for elements in expanded]
+        if typename == 'string':
+            pack_compressed_ascii(writer, [None if v is None else str(v) for v in values], bit_len)
+        else:
+            pack_compressed_numeric(writer, [np.nan if v is None else v for v in values], bit_len,
+                                    scale, offset)
+    return writer
+
+
+def expand_elements(records: List[dict]) -> Iterator[tuple]:
+    """Yields the (fxy, type, bit_len, scale, offset, value) of every element in the records.
+
+    Operators are applied to the widths of the elements that follow them and blocks of columns are
+    expanded row by row.
+    """
+    width_delta = 0
+    string_bitlength = None
+    for seq in records:
+        if seq['type'] == 'columns':
+            layout = seq['layout']
+            bit_len = layout.bit_len.tolist()
+            scale = layout.scale.tolist()
+            offset = layout.offset.tolist()
+            arrays = [np.asarray(column, dtype=np.float64) for column in seq['value']]
+            nrows = max((a.shape[0] for a in arrays if a.ndim), default=1)
+            rows = np.column_stack([np.broadcast_to(a, (nrows,)) for a in arrays]).tolist()
+            for row in rows:
+                for k, fxy in enumerate(layout.fxy):
+                    yield fxy, 'numeric', bit_len[k], scale[k], offset[k], row[k]
+            continue
+        if seq['type'] == 'operator':
+            f, x, y = parse_ref(seq['fxy'])
+            if (f, x) == (2, 8):
+                string_bitlength = y * 8 if y > 0 else None
+            if (f, x) == (2, 1):
+                width_delta = y - 128 if y > 0 else 0
+            continue
+        if seq['bit_len'] < 1:
+            continue
+        if seq['type'] == 'numeric':
+            yield (seq['fxy'], 'numeric', seq['bit_len'] + width_delta, seq['scale'] or 0,
+                   seq['offset'] or 0, seq['value'])
+        elif seq['type'] == 'string':
+            yield seq['fxy'], 'string', string_bitlength or seq['bit_len'], 0, 0, seq['value']
+
+
+def pack_compressed_numeric(writer: BitWriter,
+                            values: Sequence,
+                            bit_len: int,
+                            scale: float,
+                            offset: float):
+    """Appends the reference, increment width and increments of a numeric element.
+
+    NaN values are missing. When some subsets are missing their increments are all ones, and when
+    every subset is missing the reference is all ones and there are no increments.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    if missing.all():
+        writer.write_uint((1 << bit_len) - 1, bit_len)
+        writer.write_uint(0, COMPRESSED_WIDTH_BITS)
+        return
+    missing = missing.tolist()
+    scaled = (values * math.pow(10, scale) - offset).tolist()
+    ints = [0 if is_missing else round(value) for value, is_missing in zip(scaled, missing)]
+    present = [value for value, is_missing in zip(ints, missing) if not is_missing]
+    reference = min(present)
+    max_increment = max(present) - reference
+    writer.write_uint(reference, bit_len)
+    if max_increment == 0 and not any(missing):
+        writer.write_uint(0, COMPRESSED_WIDTH_BITS)
+        return
+    # All ones is reserved for missing values, so the increments need room for one more value
+    width = (max_increment + 1).bit_length()
+    if width >= 1 << COMPRESSED_WIDTH_BITS:
+        raise ValueError(f'Increments of {width} bits do not fit the increment width field')
+    writer.write_uint(width, COMPRESSED_WIDTH_BITS)
+    missing_value = (1 << width) - 1
+    for value, is_missing in zip(ints, missing):
+        writer.write_uint(missing_value if is_missing else value - reference, width)
+
+
+def pack_compressed_ascii(writer: BitWriter, values: List[str], bit_len: int):
+    """Appends a CCITT IA5 element of every subset.
+
+    Identical strings are written once as the reference. Otherwise the reference is all zeros, the
+    increment width is the number of characters and every subset's string follows. None is the
+    missing value, all bits set.
+    """
+    nchars = bit_len // 8
+    if all(value == values[0] for value in values):
+        pack_ascii_array(writer, values[:1], bit_len)
+        writer.write_uint(0, COMPRESSED_WIDTH_BITS)
+        return
+    if nchars >= 1 << COMPRESSED_WIDTH_BITS:
+        raise ValueError(f'Strings of {nchars} characters can not be compressed')
+    writer.write_uint(0, bit_len)
+    writer.write_uint(nchars, COMPRESSED_WIDTH_BITS)
+    pack_ascii_array(writer, values, bit_len)
+
+
+def compile_layout(records: List[dict]) -> ColumnLayout:
+    """Returns the column layout for a sequence of numeric section 4 records.
+
+    Records with a zero bit length are informational and are left out of the layout.
+    """
+    fields = [rec for rec in records if rec['bit_len'] >= 1]
+    for rec in fields:
+        if rec['type'] != 'numeric':
+            raise ValueError(f'Only numeric elements can be encoded as columns: {rec["fxy"]}')
+        if not 1 <= rec['bit_len'] <= 64:
+            raise ValueError(f'Unsupported bit length for column {rec["fxy"]}: {rec["bit_len"]}')
+    return ColumnLayout(
+        fxy=tuple(rec['fxy'] for rec in fields),
+        bit_len=np.array([rec['bit_len'] for rec in fields], dtype=np.uint64),
+        scale=np.array([rec['scale'] or 0 for rec in fields], dtype=np.float64),
+        offset=np.array([rec['offset'] or 0 for rec in fields], dtype=np.float64),
+    )
+
+
+def scale_columns(layout: ColumnLayout, columns: Sequence) -> np.ndarray:
+    """Returns the unsigned integers to encode for each row and column of the layout.
+
+    `columns` holds one array per element of the layout, scalars are repeated for every row. Scale
+    and reference values are applied and the results are rounded to the nearest integer, NaN values
+    are replaced with the BUFR missing value, all bits set.
+    """
+    if len(columns) != len(layout.fxy):
+        raise ValueError(f'Expected {len(layout.fxy)} columns, got {len(columns)}')
+    arrays = [np.asarray(column, dtype=np.float64) for column in columns]
+    nrows = max((a.shape[0] for a in arrays if a.ndim), default=1)
+    values = np.column_stack([np.broadcast_to(a, (nrows,)) for a in arrays])
+    missing = np.isnan(values)
+    values = values * np.power(10.0, layout.scale) - layout.offset
+    values[missing] = 0
+    masks = (np.uint64(1) << layout.bit_len) - np.uint64(1)
+    # Negative values wrap to their two's complement before being masked, like the scalar path
+    ints = np.rint(values).astype(np.int64).view(np.uint64) & masks
+    return np.where(missing, masks, ints)
+
+
+def pack_columns(writer: BitWriter, layout: ColumnLayout, ints: np.ndarray):
+    """Appends the rows of unsigned integers to the writer, one element after another."""
+    widths = layout.bit_len.astype(np.int64)
+    row_bits = int(widths.sum())
+    # For every bit of a row, the column it comes from and how far that column must be shifted
+    column_index = np.repeat(np.arange(len(widths)), widths)
+    shifts = np.concatenate([np.arange(w - 1, -1, -1) for w in widths]).astype(np.uint64)
+    for start in range(0, ints.shape[0], COLUMN_CHUNK_ROWS):
+        chunk = ints[start:start + COLUMN_CHUNK_ROWS]
+        bits = ((chunk[:, column_index] >> shifts) & np.uint64(1)).astype(np.uint8)
+        writer.write_bits(np.packbits(bits.ravel()).tobytes(), chunk.shape[0] * row_bits)
+
+
+def encode_columns(writer: BitWriter, layout: ColumnLayout, columns: Sequence):
+    """Scales, offsets and packs a block of numeric columns into the writer."""
+    if len(layout.fxy) == 0:
+        return
+    pack_columns(writer, layout, scale_columns(layout, columns))
+
+
+def encode_ascii(data: str, nchars: int) -> bytes:
+    """Returns the string right-justified in a field of `nchars` CCITT IA5 characters.
+
+    Strings longer than the field are truncated to their leading characters.
+    """
+    return data.rjust(nchars)[:nchars].encode('ascii')
+
+
+def pack_ascii(writer: BitWriter, data: str, bitlen: int):
+    """Appends a right-justified ASCII string that occupies `bitlen` bits to the writer.
+
+    Strings longer than the field are truncated to their leading characters.
+    """
+    writer.write_bytes(encode_ascii(data, bitlen // 8))
+
+
+def pack_ascii_array(writer: BitWriter, values: Sequence[Optional[str]], bitlen: int):
+    """Appends a field of `bitlen` bits for every string, like `pack_ascii` would one by one.
+
+    The fields are joined and written at once, shifted into place in a single step when the writer
+    isn't on a byte boundary. None is the missing value, all bits set.
+    """
+    nchars = bitlen // 8
+    missing = b'\xff' * nchars
+    data = b''.join(missing if value is None else encode_ascii(value, nchars)
+                    for value in values)
+    if data:
+        writer.write_bits(data, len(data) * 8)
+
+
+def _seed_writer(buf, bit_offset: int) -> BitWriter:
+    """Returns a writer holding the bits of `buf` that precede `bit_offset` in its first byte."""
+    writer = BitWriter(16)
     r = bit_offset % 8
-    byte_len = math.ceil((bitlen + r) / 8)
-    data = bytearray(byte_len)
-    buf.seek(byte_start)
+    buf.seek(bit_offset // 8)
     if r != 0:
-        data[0] = buf.read(1)[0]
-        buf.seek(byte_start)
-    data = encode_uint(data, value, r, bitlen)
-    buf.write(data)
+        writer.write_uint(buf.read(1)[0] >> (8 - r), r)
+        buf.seek(bit_offset // 8)
+    return writer
+
+
+def write_uint(buf, value, bit_offset, bitlen):
+    """Writes an unsgined integer to the buffer at `bit_offset` that occupies `bitlen` bits."""
+    writer = _seed_writer(buf, bit_offset)
+    writer.write_uint(value, bitlen)
+    buf.write(writer.getvalue())
 
 
 def write_ascii(buf, data, bit_offset, bitlen):
-    """Writes ASCII to the buffer with a bit offset."""
-    ascii_encoded = data.rjust(bitlen // 8).encode('ascii')
-    for i, value in enumerate(ascii_encoded):
-        write_uint(buf, value, bit_offset + (i * 8), 8)
+    """Writes ASCII to the buffer with a bit offset.
+
+    The string is right-justified in `bitlen` bits and truncated to fit, on a byte boundary its
+    bytes are written as they are.
+    """
+    encoded = encode_ascii(data, bitlen // 8)
+    if bit_offset % 8 == 0:
+        buf.seek(bit_offset // 8)
+        buf.write(encoded)
+        return
+    writer = _seed_writer(buf, bit_offset)
+    writer.write_bytes(encoded)
+    buf.write(writer.getvalue())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Reusable encoder for many messages that share the same descriptors.
+
+Section 3 and a template of section 1 are encoded once, when the encoder is created. Each message
+then only packs its section 4, into a buffer that's reused from message to message, and patches
+the typical time into the section 1 template.
+"""
+import io
+from typing import Dict, Tuple, Optional, Sequence
+from datetime import datetime
+
+from bufrtools.encoding.bufr import pack_data, section1_bytes, section3_bytes
+from bufrtools.encoding.stream import MAX_MESSAGE_LENGTH
+from bufrtools.util.bitmath import BitWriter
+from bufrtools.util.instrument import stage
+
+# Offset of the year of the typical time in the encoded section 1, it's followed by the month, day,
+# hour, minute and second
+TYPICAL_TIME_OFFSET = 15
+
+
+class Encoder:
+    """Encodes messages of the given section 3 descriptors and section 1.
+
+    `section1` has the same keys as the section 1 accepted by
+    `bufrtools.encoding.bufr.encode_bufr`, its typical time is used unless a message is given a
+    timestamp. An encoder reuses its buffer, so it must not be shared between threads.
+    """
+
+    def __init__(self,
+                 descriptors: Sequence[str],
+                 section1: dict,
+                 observed: bool = True,
+                 compressed: bool = False):
+        """Initializes the encoder and encodes the static sections."""
+        self.descriptors = list(descriptors)
+        self.observed = observed
+        self.compressed = compressed
+        self._section1 = section1_bytes(section1)
+        self._section3: Dict[int, Tuple[dict, bytes]] = {}
+        self.get_section3(1)
+        self._writer = BitWriter()
+
+    def get_section3(self, number_of_subsets: int) -> Tuple[dict, bytes]:
+        """Returns section 3 for the number of subsets, and the same section encoded."""
+        section3 = self._section3.get(number_of_subsets)
+        if section3 is None:
+            section = {
+                'number_of_subsets': number_of_subsets,
+                'observed_flag': self.observed,
+                'compressed_flag': self.compressed,
+                'descriptors': self.descriptors,
+            }
+            section3 = self._section3[number_of_subsets] = (section, section3_bytes(section))
+        return section3
+
+    def get_section1(self, timestamp: Optional[datetime] = None) -> bytes:
+        """Returns the encoded section 1, with the typical time of `timestamp` if it's given."""
+        if timestamp is None:
+            return self._section1
+        section1 = bytearray(self._section1)
+        section1[TYPICAL_TIME_OFFSET:TYPICAL_TIME_OFFSET + 7] = (
+            timestamp.year.to_bytes(2, 'big') +
+            bytes([timestamp.month, timestamp.day, timestamp.hour, timestamp.minute,
+                   timestamp.second]))
+        return bytes(section1)
+
+    def write(self,
+              sink,
+              section4: list,
+              number_of_subsets: int = 1,
+              timestamp: Optional[datetime] = None) -> int:
+        """Writes the message holding the section 4 data and returns the number of bytes written.
+
+        `section4` is given in any of the forms accepted by `bufrtools.encoding.bufr.pack_data`.
+        The sink is anything with a `write` method or a socket.
+        """
+        write = sink.write if hasattr(sink, 'write') else sink.sendall
+        section3, section3_data = self.get_section3(number_of_subsets)
+        with stage('pack_section4') as record:
+            self._writer.reset()
+            pack_data({'section3': section3, 'section4': section4}, self._writer)
+            data = self._writer.getbuffer()
+            record.add(len(section4), len(data))
+        try:
+            section1 = self.get_section1(timestamp)
+            section4_len = 4 + len(data)
+            total_len = 8 + len(section1) + len(section3_data) + section4_len + 4
+            if total_len > MAX_MESSAGE_LENGTH:
+                raise ValueError(f'Message of {total_len} bytes exceeds the BUFR maximum length')
+            with stage('write_message') as record:
+                write(b'BUFR' + total_len.to_bytes(3, 'big') + b'\x04' + section1 + section3_data +
+                      section4_len.to_bytes(3, 'big') + b'\x00')
+                write(data)
+                write(b'7777')
+                record.add(1, total_len)
+        finally:
+            data.release()
+        return total_len
+
+    def encode(self,
+               section4: list,
+               number_of_subsets: int = 1,
+               timestamp: Optional[datetime] = None) -> bytes:
+        """Returns the message holding the section 4 data."""
+        buf = io.BytesIO()
+        self.write(buf, section4, number_of_subsets, timestamp)
+        return buf.getvalue()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Encoding service for near real-time feeds of Wildlife Computers datasets.
+
+The service speaks a small subset of HTTP/1.1 over TCP or a Unix socket. `POST /encode` takes the
+dataset file as the request body, with optional `uuid` and `ptt` query parameters, and responds
+with the BUFR message. `GET /health` responds with `ok`. Connections are kept alive between
+requests.
+
+Encoding runs in a pool of worker processes whose table caches are warmed when they start. Only a
+bounded number of requests are received or queued for the pool at a time, requests beyond that are
+turned away with `503 Service Unavailable` before their body is read, so that clients back off
+instead of piling up work and memory.
+"""
+import os
+import sys
+import asyncio
+import tempfile
+from typing import Tuple, Optional
+from pathlib import Path
+from datetime import datetime
+from argparse import Namespace, ArgumentParser
+from urllib.parse import parse_qs, urlsplit
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from bufrtools.encoding import wildlife_computers
+from bufrtools.encoding.batch import warm_worker
+from bufrtools.util.parse import sniff_format
+
+# Largest dataset accepted in a request body, every pending request may hold one in memory
+MAX_BODY_SIZE = 1 << 26
+
+# Size of the blocks the BUFR message is streamed back in
+RESPONSE_CHUNK_SIZE = 1 << 16
+
+# Reason phrases of the status codes the service responds with
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    422: 'Unprocessable Entity',
+    503: 'Service Unavailable',
+}
+
+
+class HTTPError(Exception):
+    """An error that's answered with its status code and message."""
+
+    def __init__(self, status: int, message: str):
+        """Initializes the error with the status code of the response."""
+        super().__init__(message)
+        self.status = status
+
+
+def encode_payload(payload: bytes, uuid: Optional[str] = None, ptt: Optional[str] = None) -> bytes:
+    """Returns the dataset file held in `payload` encoded as a BUFR message.
+
+    netCDF datasets are read as contiguous ragged arrays, like they're streamed by
+    `wildlife_computers.get_messages`, rather than loaded whole with pocean.
+    """
+    with tempfile.NamedTemporaryFile(prefix='bufrtools-', suffix='.dataset') as f:
+        f.write(payload)
+        f.flush()
+        path = Path(f.name)
+        if sniff_format(path) != 'netcdf':
+            return wildlife_computers.encode_message(path, uuid=uuid, ptt=ptt)
+        # Every profile goes into the one message
+        message = next(wildlife_computers.get_messages(path, sys.maxsize, uuid=uuid, ptt=ptt),
+                       None)
+        if message is None:
+            raise ValueError('The dataset holds no profiles')
+        return wildlife_computers.get_encoder().encode(message['section4'],
+                                                       timestamp=datetime.utcnow())
+
+
+async def read_head(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, dict, int]]:
+    """Returns the method, target, headers and body length of the next request.
+
+    The body is left to be read from `reader`. Returns None if the connection was closed before a
+    request started. Header names are lower case.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400, 'Malformed request line') from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n'):
+            break
+        if not line:
+            raise HTTPError(400, 'Connection closed in the headers')
+        name, sep, value = line.decode('latin-1').partition(':')
+        if not sep:
+            raise HTTPError(400, 'Malformed header')
+        headers[name.strip().lower()] = value.strip()
+    if 'transfer-encoding' in headers:
+        raise HTTPError(411, 'Chunked requests are not supported, send a Content-Length')
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(400, 'Malformed Content-Length') from None
+    if length < 0:
+        raise HTTPError(400, 'Malformed Content-Length')
+    if length > MAX_BODY_SIZE:
+        raise HTTPError(413, f'Datasets are limited to {MAX_BODY_SIZE} bytes')
+    return method, target, headers, length
+
+
+async def write_response(writer: asyncio.StreamWriter,
+                         status: int,
+                         body: bytes,
+                         content_type: str = 'text/plain; charset=utf-8',
+                         keep_alive: bool = True):
+    """Writes the response, the body is streamed in blocks as the client reads it."""
+    head = (f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n')
+    if status == 503:
+        head += 'Retry-After: 1\r\n'
+    if not keep_alive:
+        head += 'Connection: close\r\n'
+    writer.write(head.encode('latin-1') + b'\r\n')
+    view = memoryview(body)
+    for start in range(0, len(view), RESPONSE_CHUNK_SIZE):
+        writer.write(view[start:start + RESPONSE_CHUNK_SIZE])
+        await writer.drain()
+    await writer.drain()
+
+
+class EncodeService:
+    """Accepts encoding requests and runs them on a bounded pool of workers.
+
+    `workers` processes are started, one per CPU by default, and at most `max_pending` requests
+    with a body are being received, encoded or waiting for a worker at a time, twice the number of
+    workers by default. An `executor` can be given instead of the process pool, it isn't shut down
+    by the service.
+    """
+
+    def __init__(self,
+                 workers: Optional[int] = None,
+                 max_pending: Optional[int] = None,
+                 executor: Optional[Executor] = None):
+        """Initializes the service, the workers are started by `start`."""
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.executor = executor
+        self._owns_executor = executor is None
+        self.pending = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._connections = {}
+
+    async def start(self,
+                    host: str = '127.0.0.1',
+                    port: int = 0,
+                    path: Optional[str] = None) -> asyncio.AbstractServer:
+        """Starts the workers and listens on the TCP address, or on the Unix socket at `path`."""
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker)
+            # Start every worker now rather than on the first requests
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self.executor, warm_worker)
+                                   for _ in range(self.workers)))
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+        """Stops listening and shuts down the workers."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        # Closing the open connections lets their handlers finish
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._owns_executor and self.executor is not None:
+            self.executor.shutdown()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answers the requests of a connection until the client closes it."""
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    head = await read_head(reader)
+                except HTTPError as e:
+                    await write_response(writer, e.status, str(e).encode('utf-8'),
+                                         keep_alive=False)
+                    return
+                if head is None:
+                    return
+                method, target, headers, length = head
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if length:
+                    if self.pending >= self.max_pending:
+                        # The body is left unread, so the connection can't be reused
+                        await write_response(writer, 503,
+                                             b'Too many requests are pending, retry later',
+                                             keep_alive=False)
+                        return
+                    # The request is pending from before its body is read until it's encoded
+                    self.pending += 1
+                try:
+                    try:
+                        body = await reader.readexactly(length) if length else b''
+                        data, content_type = await self.respond(method, target, body)
+                    finally:
+                        if length:
+                            self.pending -= 1
+                    await write_response(writer, 200, data, content_type, keep_alive)
+                except HTTPError as e:
+                    await write_response(writer, e.status, str(e).encode('utf-8'), keep_alive)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        finally:
+            del self._connections[task]
+            writer.close()
+
+    async def respond(self, method: str, target: str, body: bytes) -> Tuple[bytes, str]:
+        """Returns the body and content type of the response to the request.
+
+        Errors are raised as `HTTPError`.
+        """
+        url = urlsplit(target)
+        if url.path == '/health':
+            if method != 'GET':
+                raise HTTPError(405, 'Use GET')
+            return b'ok', 'text/plain; charset=utf-8'
+        if url.path != '/encode':
+            raise HTTPError(404, f'Unknown path {url.path}')
+        if method != 'POST':
+            raise HTTPError(405, 'Use POST with the dataset as the body')
+        if not body:
+            raise HTTPError(400, 'The dataset is missing from the body')
+        query = parse_qs(url.query)
+        uuid = query.get('uuid', [None])[0]
+        ptt = query.get('ptt', [None])[0]
+        try:
+            loop = asyncio.get_running_loop()
+            data = await loop.run_in_executor(self.executor, encode_payload, body, uuid, ptt)
+        except Exception as e:
+            raise HTTPError(422, f'{type(e).__name__}: {e}') from e
+        return data, 'application/octet-stream'
+
+
+async def serve(args: Namespace):
+    """Runs the service until it's cancelled."""
+    service = EncodeService(args.jobs, args.max_pending)
+    server = await service.start(args.host, args.port, args.unix_socket)
+    addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+    print(f'Listening on {addresses}', file=sys.stderr)
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
+
+
+def parse_args(argv) -> Namespace:
+    """Returns the namespace parsed from the command line arguments."""
+    parser = ArgumentParser(description=main.__doc__)
+    parser.add_argument('--host',
+                        type=str,
+                        default='127.0.0.1',
+                        help='Address to listen on.')
+    parser.add_argument('--port',
+                        type=int,
+                        default=8080,
+                        help='Port to listen on.')
+    parser.add_argument('--unix-socket',
+                        type=str,
+                        default=None,
+                        help='Listen on this Unix socket instead of TCP.')
+    parser.add_argument('-j',
+                        '--jobs',
+                        type=int,
+                        default=None,
+                        help='Number of worker processes, defaults to the number of CPUs.')
+    parser.add_argument('--max-pending',
+                        type=int,
+                        default=None,
+                        help='Requests queued before new ones are turned away, defaults to twice '
+                        'the number of workers.')
+    args = parser.parse_args(argv)
+    return args
+
+
+def main():
+    """Serve encoding requests for Wildlife Computers profile datasets."""
+    args = parse_args(sys.argv[1:])
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
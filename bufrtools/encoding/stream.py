@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Streaming writer for many BUFR messages into a single file or socket.
+
+Every section is encoded before the message starts, so the total length is known when section 0
+is written and nothing is patched afterwards. Only one message's section 4 is held in memory at a
+time, however many messages are written.
+"""
+from typing import Optional
+
+from bufrtools.encoding.bufr import section1_bytes, section3_bytes, pack_data
+from bufrtools.util.instrument import stage
+
+# Largest message the 3 byte total length of section 0 can describe
+MAX_MESSAGE_LENGTH = (1 << 24) - 1
+
+
+class MessageWriter:
+    """Appends encoded BUFR messages to a binary sink.
+
+    The sink is anything with a `write` method, like a file or `io.BytesIO`, or a socket, which is
+    written to with `sendall`. When a WMO abbreviated heading is given, each message is wrapped in
+    the GTS bulletin envelope: start of heading, channel sequence number, abbreviated heading, the
+    message and end of text. `length_prefix` additionally precedes every bulletin with its 8 digit
+    length and the `00` format identifier of the WMO FTP file format.
+    """
+
+    def __init__(self,
+                 sink,
+                 heading: Optional[str] = None,
+                 length_prefix: bool = False,
+                 sequence_number: int = 1):
+        """Initializes a writer appending to `sink`."""
+        self._write = sink.write if hasattr(sink, 'write') else sink.sendall
+        self.heading = heading
+        self.length_prefix = length_prefix
+        self.sequence_number = sequence_number
+        self.messages_written = 0
+        self.bytes_written = 0
+
+    def write(self, message: dict, heading: Optional[str] = None) -> int:
+        """Writes the message and returns the number of bytes written, including any envelope.
+
+        `message` has the same keys as the message accepted by
+        `bufrtools.encoding.bufr.encode_bufr`. `heading` overrides the writer's abbreviated heading
+        for this message.
+        """
+        with stage('pack_section4') as record:
+            writer = pack_data(message)
+            data = writer.getbuffer()
+            record.add(len(message['section4']), len(data))
+        section1 = section1_bytes(message['section1'])
+        section3 = section3_bytes(message['section3'])
+        section4_len = 4 + len(data)
+        total_len = 8 + len(section1) + len(section3) + section4_len + 4
+        if total_len > MAX_MESSAGE_LENGTH:
+            data.release()
+            raise ValueError(f'Message of {total_len} bytes exceeds the BUFR maximum length')
+
+        heading = heading or self.heading
+        envelope_start = envelope_end = b''
+        if heading:
+            envelope_start = (f'\x01\r\r\n{self.sequence_number % 1000:03d}\r\r\n{heading}\r\r\n'
+                              .encode('ascii'))
+            envelope_end = b'\r\r\n\x03'
+            self.sequence_number += 1
+            if self.length_prefix:
+                bulletin_len = len(envelope_start) + total_len + len(envelope_end)
+                envelope_start = f'{bulletin_len:08d}00'.encode('ascii') + envelope_start
+
+        written = len(envelope_start) + total_len + len(envelope_end)
+        with stage('write_message') as record:
+            write = self._write
+            write(envelope_start + b'BUFR' + total_len.to_bytes(3, 'big') + b'\x04' + section1 +
+                  section3 + section4_len.to_bytes(3, 'big') + b'\x00')
+            write(data)
+            write(b'7777' + envelope_end)
+            data.release()
+            record.add(1, written)
+
+        self.messages_written += 1
+        self.bytes_written += written
+        return written
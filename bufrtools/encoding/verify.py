@@ -0,0 +1,547 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Round-trip verification of encoded BUFR messages.
+
+An encoded message is decoded in process from the compiled plan of its section 3 and every element
+is compared with the section 4 the message was encoded from. A numeric value matches when its field
+is within half a unit of the last digit of its descriptor's scale, values that pack to every bit set
+are the missing value. Strings are compared as they're written, right-justified and truncated to
+the width of their field.
+
+The fields of uncompressed messages are located and read for all the elements at once. Blocks of
+columns are matched with the runs of the plan the decoder finds at the same place, and are compared
+with the values they were packed from a batch of rows at a time, without locating their elements
+one by one.
+Compressed messages and messages with the new reference values of 2-03 are decoded value by value
+instead.
+"""
+import math
+from typing import Any, Dict, List, Tuple, Union, Iterator, Sequence, NamedTuple
+from functools import lru_cache
+
+import numpy as np
+
+from bufrtools.tables.plan import STRING, NUMERIC, REFERENCE, Plan, get_plan
+from bufrtools.util.parse import parse_ref
+from bufrtools.util.bitmath import FIELD_MASKS, extract_uints
+from bufrtools.util.instrument import stage
+from bufrtools.encoding.bufr import is_values, expand_plan, expand_elements
+from bufrtools.decoding.bufr import (Walk, walk_plan, expand_walk, read_string, read_subsets,
+                                     decode_sections, signed_reference)
+
+# Number of mismatches reported by default, verification stops after the first ones
+MAX_MISMATCHES = 10
+
+# Largest distance between a packed field and the value it was encoded from, in units of the last
+# digit of the scale, with room for floating point error
+TOLERANCE = 0.5 + 1e-6
+
+# Errors the decoders raise on data they can't decode, which fail the verification
+DECODE_ERRORS = (ValueError, IndexError, KeyError, OverflowError)
+
+# Rows of the blocks of columns compared at once, few enough for the arrays to stay in cache
+BATCH_ROWS = 1 << 14
+
+
+class Mismatch(NamedTuple):
+    """An element whose decoded value isn't the value it was encoded from.
+
+    A message that can't be decoded is a single mismatch with a subset and element of -1 and the
+    error as the decoded value.
+    """
+
+    subset: int
+    element: int
+    fxy: str
+    expected: Any
+    decoded: Any
+
+    def __str__(self) -> str:
+        """Returns a description of the mismatch."""
+        if self.subset < 0:
+            return f'Unable to decode the message: {self.decoded}'
+        return (f'Subset {self.subset}, element {self.element} ({self.fxy}): expected '
+                f'{self.expected!r}, decoded {self.decoded!r}')
+
+
+class PlanArrays(NamedTuple):
+    """The fields of the steps of a plan as arrays, indexed by step.
+
+    `width` is the width of numeric fields, strings are read as a single bit. `missing` is the
+    all-ones value of numeric fields, or a value no field can hold if the field has no missing
+    value.
+    """
+
+    kind: np.ndarray
+    fxy: np.ndarray
+    width: np.ndarray
+    factor: np.ndarray
+    offset: np.ndarray
+    missing: np.ndarray
+
+
+@lru_cache(maxsize=256)
+def get_plan_arrays(plan: Plan) -> PlanArrays:
+    """Returns the fields of the steps of the plan as arrays."""
+    steps = plan.steps
+    never = np.iinfo(np.int64).min
+    return PlanArrays(
+        np.array([step.kind for step in steps], dtype=np.int8),
+        np.array([int(step.fxy) for step in steps], dtype=np.int64),
+        np.array([1 if step.kind == STRING else step.bit_len for step in steps], dtype=np.int64),
+        np.array([10.0 ** step.scale for step in steps], dtype=np.float64),
+        np.array([step.offset or 0 for step in steps], dtype=np.float64),
+        np.array([never if step.missing < 0 else step.missing for step in steps], dtype=np.int64),
+    )
+
+
+def expected_elements(message: dict) -> Iterator[tuple]:
+    """Yields the (fxy, type, bit_len, scale, offset, value) of every element of every subset.
+
+    Elements are yielded in the order they're packed in, subset after subset.
+    """
+    section3 = message['section3']
+    section4 = message['section4']
+    if not section3['compressed_flag']:
+        if not is_values(section4):
+            yield from expand_elements(section4)
+            return
+        values = iter(section4)
+        plan = get_plan(section3['descriptors'])
+        for _ in range(section3['number_of_subsets']):
+            yield from expand_plan(plan, values)
+        return
+    if section4 and is_values(section4[0]):
+        plan = get_plan(section3['descriptors'])
+        for values in section4:
+            yield from expand_plan(plan, values)
+        return
+    for records in section4:
+        yield from expand_elements(records)
+
+
+def expected_arrays(message: dict,
+                    skip: Sequence[int] = ()) -> Tuple[np.ndarray, np.ndarray, Dict[int, Any]]:
+    """Returns the descriptors and numeric values of every element of an uncompressed message.
+
+    Descriptors are integers and missing numeric values NaN. Strings are returned by the index of
+    their element and have a NaN numeric value. Blocks of columns are expanded with a copy each,
+    except for the records whose indices are in `skip`.
+    """
+    fxys = []
+    values = []
+    strings = {}
+    codes = {}
+    size = 0
+    pending_fxys = []
+    pending_values = []
+    if is_values(message['section4']):
+        records = ({'fxy': fxy, 'type': typename, 'bit_len': bit_len, 'value': value}
+                   for fxy, typename, bit_len, _, _, value in expected_elements(message))
+    else:
+        records = message['section4']
+    for index, seq in enumerate(records):
+        typename = seq['type']
+        if typename == 'columns':
+            if index in skip:
+                continue
+            if pending_fxys:
+                fxys.append(np.array(pending_fxys, dtype=np.int64))
+                values.append(np.array(pending_values, dtype=np.float64))
+                pending_fxys, pending_values = [], []
+            layout = seq['layout']
+            block = column_block(seq['value'])
+            layout_codes = codes.get(layout.fxy)
+            if layout_codes is None:
+                layout_codes = codes[layout.fxy] = np.array([int(fxy) for fxy in layout.fxy])
+            block_fxys = np.empty(block.shape, dtype=np.int64)
+            block_fxys[:] = layout_codes
+            fxys.append(block_fxys.ravel())
+            values.append(block.ravel())
+            size += block.size
+            continue
+        if typename == 'operator' or seq['bit_len'] < 1:
+            continue
+        value = seq['value']
+        if typename == 'string':
+            strings[size] = value
+            value = None
+        pending_fxys.append(int(seq['fxy']))
+        pending_values.append(math.nan if value is None else float(value))
+        size += 1
+    fxys.append(np.array(pending_fxys, dtype=np.int64))
+    values.append(np.array(pending_values, dtype=np.float64))
+    return np.concatenate(fxys), np.concatenate(values), strings
+
+
+def count_rows(columns: Sequence) -> int:
+    """Returns the number of rows of a block of columns, scalars are repeated in every row."""
+    return max((len(column) for column in columns
+                if getattr(column, 'ndim', isinstance(column, (list, tuple)))), default=1)
+
+
+def column_block(columns: Sequence) -> np.ndarray:
+    """Returns the columns of a block as the rows and columns of an array, scalars are repeated."""
+    nrows = count_rows(columns)
+    block = np.empty((nrows, len(columns)), dtype=np.float64)
+    for k, column in enumerate(columns):
+        block[:, k] = column
+    return block
+
+
+def find_blocks(records: List[dict]) -> List[Tuple[int, int, int]]:
+    """Returns the (record index, bit offset, rows) of every block of columns in the records.
+
+    The bit offsets are where the blocks are packed, following the widths the records before them
+    are encoded with.
+    """
+    blocks = []
+    bit_offset = 0
+    # 2-01-YYY changes the width of numeric elements and 2-08-YYY the width of strings
+    width_delta = 0
+    string_bitlength = None
+    for index, seq in enumerate(records):
+        typename = seq['type']
+        if typename == 'columns':
+            columns = seq['value']
+            nrows = count_rows(columns)
+            row_bits = int(seq['layout'].bit_len.sum())
+            if row_bits:
+                blocks.append((index, bit_offset, nrows))
+            bit_offset += nrows * row_bits
+        elif typename == 'operator':
+            f, x, y = parse_ref(seq['fxy'])
+            if (f, x) == (2, 8):
+                string_bitlength = y * 8 if y > 0 else None
+            if (f, x) == (2, 1):
+                width_delta = y - 128 if y > 0 else 0
+        elif seq['bit_len'] >= 1:
+            if typename == 'numeric':
+                bit_offset += seq['bit_len'] + width_delta
+            elif typename == 'string':
+                bit_offset += string_bitlength or seq['bit_len']
+    return blocks
+
+
+def match_blocks(records: List[dict], walk: Walk, arrays: PlanArrays) -> Dict[int, tuple]:
+    """Returns the blocks of columns that are runs of the plan, keyed by record index.
+
+    A block matches the occurrence of a static run of numeric steps that the decoder found where the
+    block was packed, with a repeat for every row and the descriptors of the columns as its steps.
+    Every match is the (run key, bit offset, rows) of the block.
+    """
+    by_offset = {}
+    for key, (firsts, counts) in walk.occurrences.items():
+        for first, count in zip(firsts, counts):
+            by_offset[first] = (key, count)
+    matched = {}
+    for index, bit_offset, nrows in find_blocks(records):
+        key, count = by_offset.get(bit_offset, (None, 0))
+        if key is None or count != nrows:
+            continue
+        indices = walk.runs[key][1]
+        codes = [int(fxy) for fxy in records[index]['layout'].fxy]
+        if (len(indices) == len(codes) and (arrays.kind[indices] == NUMERIC).all() and
+                arrays.fxy[indices].tolist() == codes):
+            matched[index] = (key, bit_offset, nrows)
+    return matched
+
+
+def without_blocks(walk: Walk, matched: Dict[int, tuple]) -> Walk:
+    """Returns the walk without the occurrences of the matched blocks."""
+    offsets = {bit_offset for _, bit_offset, _ in matched.values()}
+    occurrences = {}
+    for key, (firsts, counts) in walk.occurrences.items():
+        kept = [(first, count) for first, count in zip(firsts, counts) if first not in offsets]
+        if kept:
+            occurrences[key] = ([first for first, _ in kept], [count for _, count in kept])
+    return walk._replace(occurrences=occurrences)
+
+
+def read_rows(body: memoryview, row_starts: np.ndarray, offsets: np.ndarray,
+              widths: np.ndarray) -> np.ndarray:
+    """Returns the fields of rows of columns that start at the bit offsets of `row_starts`.
+
+    The columns have the same offsets from the start of every row, the fields are returned column
+    by column. Neighbouring columns are read together, as many as fit in the 57 bits
+    `extract_uints` can read, and split afterwards.
+    """
+    ncols = len(offsets)
+    fields = np.empty((ncols, len(row_starts)), dtype=np.uint64)
+    if not len(row_starts):
+        return fields
+    # Only the bytes the rows span are read
+    start = int(row_starts.min()) >> 3
+    stop = (int(row_starts.max() + offsets[-1] + widths[-1]) + 7) >> 3
+    body = body[start:stop]
+    row_starts = row_starts - (start << 3)
+    first = 0
+    for stop in range(1, ncols + 1):
+        if stop < ncols and offsets[stop] + widths[stop] - offsets[first] <= 57:
+            continue
+        bits = int(offsets[stop - 1] + widths[stop - 1] - offsets[first])
+        words = extract_uints(body, row_starts + offsets[first], bits)
+        shifts = bits - (offsets[first:stop] - offsets[first]) - widths[first:stop]
+        out = fields[first:stop]
+        np.right_shift(words, shifts.astype(np.uint64)[:, None], out=out)
+        out &= FIELD_MASKS[widths[first:stop]][:, None]
+        first = stop
+    return fields
+
+
+def compare_blocks(body: memoryview,
+                   records: List[dict],
+                   walk: Walk,
+                   matched: Dict[int, tuple],
+                   arrays: PlanArrays,
+                   max_mismatches: int = MAX_MISMATCHES) -> List[tuple]:
+    """Returns the first mismatches of every run of the matched blocks of columns.
+
+    The blocks of a run are read and compared at once, with the width, scale and reference value of
+    every column taken from the plan. A field that holds the value it was packed from, rounded to
+    the nearest integer, matches, the others are compared within the tolerance. Mismatches are the
+    (bit offset, block bit offset, index in the block, fxy, expected, decoded) of their element.
+    """
+    # Blocks of the same run are compared in batches of up to BATCH_ROWS rows
+    batches = {}
+    for index, (key, bit_offset, nrows) in sorted(matched.items(), key=lambda item: item[1][1]):
+        runs = batches.setdefault(key, [[]])
+        if runs[-1] and sum(block[2] for block in runs[-1]) + nrows > BATCH_ROWS:
+            runs.append([])
+        runs[-1].append((index, bit_offset, nrows))
+    mismatches = []
+    found = dict.fromkeys(batches, 0)
+    for key, blocks in ((key, blocks) for key, runs in batches.items() for blocks in runs):
+        if found[key] >= max_mismatches:
+            continue
+        _, indices, offsets, bits = walk.runs[key]
+        ncols = len(indices)
+        rows = np.array([nrows for _, _, nrows in blocks], dtype=np.int64)
+        firsts = np.array([bit_offset for _, bit_offset, _ in blocks], dtype=np.int64)
+        # The bit offset of every row of every block, each row is a repeat of the run
+        block_rows = np.repeat(np.arange(len(blocks)), rows)
+        row_in_block = np.arange(len(block_rows)) - np.repeat(np.cumsum(rows) - rows, rows)
+        row_starts = firsts[block_rows] + bits * row_in_block
+        raw = read_rows(body, row_starts, offsets, arrays.width[indices])
+
+        # The values are packed in place, the value of a field that doesn't match is looked up again
+        packed = np.empty((ncols, len(row_starts)), dtype=np.float64)
+        for (index, _, _), start, stop in zip(blocks, np.cumsum(rows) - rows, np.cumsum(rows)):
+            for k, column in enumerate(records[index]['value']):
+                packed[k, start:stop] = column
+        packed *= arrays.factor[indices][:, None]
+        packed -= arrays.offset[indices][:, None]
+        np.rint(packed, out=packed)
+        missing = arrays.missing[indices]
+        np.copyto(packed, np.broadcast_to(missing.astype(np.float64)[:, None], packed.shape),
+                  where=np.isnan(packed))
+        candidates = np.flatnonzero(raw != packed)
+        for flat in candidates.tolist():
+            col, row = divmod(flat, len(row_starts))
+            step = indices[col]
+            column = records[blocks[block_rows[row]][0]]['value'][col]
+            value = column if np.ndim(column) == 0 else column[row_in_block[row]]
+            value = math.nan if value is None else float(value)
+            decoded = None
+            if raw[col, row] != missing[col]:
+                decoded = float((arrays.offset[step] + float(raw[col, row])) / arrays.factor[step])
+            if element_matches(f'{arrays.fxy[step]:06d}', 'numeric', int(arrays.width[step]),
+                               int(round(math.log10(arrays.factor[step]))), arrays.offset[step],
+                               value, decoded):
+                continue
+            mismatches.append((int(row_starts[row] + offsets[col]), int(firsts[block_rows[row]]),
+                               int(row_in_block[row]) * ncols + col, int(arrays.fxy[step]),
+                               value, decoded))
+            found[key] += 1
+            if found[key] >= max_mismatches:
+                break
+    return mismatches
+
+
+def expected_string(value: Any, bit_len: int) -> Any:
+    """Returns the string a CCITT IA5 field holding the value decodes to."""
+    if value is None:
+        return None
+    nchars = bit_len // 8
+    return str(value).rjust(nchars)[:nchars].strip()
+
+
+def verify_message(message: dict,
+                   data: Union[bytes, memoryview],
+                   max_mismatches: int = MAX_MISMATCHES) -> List[Mismatch]:
+    """Returns the first mismatches between the encoded message and the message it was encoded from.
+
+    `message` is the message as given to `encode_bufr` and `data` its encoded bytes. An empty list
+    means every element decoded to the value it was encoded from. An element that decodes to
+    another descriptor, or a message that decodes to a different number of elements, is reported
+    as a mismatch too and ends the comparison.
+    """
+    with stage('verify') as record:
+        data = memoryview(data)
+        try:
+            sections = decode_sections(data)
+            section3 = sections['section3']
+            plan = get_plan(section3['descriptors'])
+            if section3['compressed_flag'] or any(step.kind == REFERENCE for step in plan.steps):
+                mismatches = verify_elements(message, data, max_mismatches)
+            else:
+                mismatches = verify_fields(message, data, sections, plan, max_mismatches)
+        except DECODE_ERRORS as e:
+            # Sections that are cut short or describe more data than there is
+            mismatches = [Mismatch(-1, -1, '', None, f'{type(e).__name__}: {e}')]
+        record.add(len(message['section4']), len(data))
+    return mismatches
+
+
+def verify_fields(message: dict, data: memoryview, sections: dict, plan: Plan,
+                  max_mismatches: int = MAX_MISMATCHES) -> List[Mismatch]:
+    """Returns the first mismatches of an uncompressed message, reading all its fields at once."""
+    section3 = sections['section3']
+    section4 = sections['section4']
+    body = data[section4['offset'] + 4:section4['offset'] + section4['length']]
+    walk = walk_plan(body, plan, section3['number_of_subsets'])
+    arrays = get_plan_arrays(plan)
+    records = message['section4']
+    matched = {} if is_values(records) else match_blocks(records, walk, arrays)
+    layout = expand_walk(without_blocks(walk, matched))
+    fxys, values, strings = expected_arrays(message, matched)
+
+    # Elements are numbered within their subset, counting the elements of the matched blocks
+    subset_starts = np.array(walk.starts[:-1], dtype=np.int64)
+    block_offsets = np.array(sorted(bit_offset for _, bit_offset, _ in matched.values()),
+                             dtype=np.int64)
+    block_sizes = {bit_offset: nrows * len(walk.runs[key][1])
+                   for key, bit_offset, nrows in matched.values()}
+    block_elements = np.concatenate([[0], np.cumsum([block_sizes[int(bit_offset)]
+                                                     for bit_offset in block_offsets])])
+
+    def count_before(bit_offset):
+        """Returns the number of elements before the bit offset and the subset they belong to."""
+        subset = max(int(np.searchsorted(subset_starts, bit_offset, side='right')) - 1, 0)
+        first = subset_starts[subset] if len(subset_starts) else 0
+        count = int(np.searchsorted(layout.bit_offsets, bit_offset) -
+                    np.searchsorted(layout.bit_offsets, first))
+        count += int(block_elements[np.searchsorted(block_offsets, bit_offset)] -
+                     block_elements[np.searchsorted(block_offsets, first)])
+        return subset, count
+
+    def mismatch(bit_offset, fxy, expected, decoded, within=0):
+        subset, element = count_before(bit_offset)
+        return Mismatch(subset, element + within, f'{fxy:06d}', expected, decoded)
+
+    steps = layout.steps
+    decoded_fxys = arrays.fxy[steps]
+    # Elements are only compared up to the first that doesn't line up
+    size = min(len(steps), len(fxys))
+    aligned = np.flatnonzero(decoded_fxys[:size] != fxys[:size])
+    if len(aligned):
+        size = int(aligned[0])
+    steps = steps[:size]
+    bit_offsets = layout.bit_offsets[:size]
+    expected = values[:size]
+
+    raw = extract_uints(body, bit_offsets, arrays.width[steps]).astype(np.int64)
+    packed = expected * arrays.factor[steps] - arrays.offset[steps]
+    missing = arrays.missing[steps]
+    with np.errstate(invalid='ignore'):
+        expected_missing = np.isnan(packed) | (np.rint(packed) == missing)
+        decoded_missing = raw == missing
+        matches = np.where(expected_missing, decoded_missing,
+                           ~decoded_missing & (np.abs(raw - packed) <= TOLERANCE))
+    # Strings are compared one by one
+    is_string = arrays.kind[steps] == STRING
+    bad = np.flatnonzero(~(matches | is_string))[:max_mismatches].tolist()
+    for i in np.flatnonzero(is_string).tolist():
+        if len(bad) >= max_mismatches and i > bad[-1]:
+            break
+        field_len = plan.steps[steps[i]].bit_len
+        if expected_string(strings.get(i), field_len) != read_string(body, int(bit_offsets[i]),
+                                                                     field_len):
+            bad.append(i)
+    bad.sort()
+
+    found = []
+    for i in bad[:max_mismatches]:
+        fxy = int(fxys[i])
+        bit_offset = int(bit_offsets[i])
+        if is_string[i]:
+            field_len = plan.steps[steps[i]].bit_len
+            decoded = read_string(body, bit_offset, field_len)
+            found.append((bit_offset, mismatch(bit_offset, fxy, strings.get(i), decoded)))
+            continue
+        step = steps[i]
+        value = None
+        if not decoded_missing[i]:
+            value = float((arrays.offset[step] + raw[i]) / arrays.factor[step])
+        found.append((bit_offset, mismatch(bit_offset, fxy, float(values[i]), value)))
+    # Nothing after the first element that doesn't line up is compared
+    end = walk.starts[-1]
+    if size < max(len(layout.steps), len(fxys)):
+        end = int(layout.bit_offsets[size]) if size < len(layout.steps) else walk.starts[-1]
+    for bit_offset, first, within, fxy, expected_value, decoded in compare_blocks(
+            body, records, walk, matched, arrays, max_mismatches):
+        if bit_offset < end:
+            found.append((bit_offset, mismatch(first, fxy, expected_value, decoded, within)))
+    found.sort(key=lambda item: item[0])
+    mismatches = [item for _, item in found[:max_mismatches]]
+    if len(mismatches) < max_mismatches and size < max(len(layout.steps), len(fxys)):
+        # Report the descriptors of the first element that doesn't line up, None if there's none
+        expected = f'{int(fxys[size]):06d}' if size < len(fxys) else None
+        decoded = f'{int(decoded_fxys[size]):06d}' if size < len(decoded_fxys) else None
+        mismatches.append(mismatch(end, int(expected or decoded), expected, decoded))
+    return mismatches
+
+
+def verify_elements(message: dict, data: Union[bytes, memoryview],
+                    max_mismatches: int = MAX_MISMATCHES) -> List[Mismatch]:
+    """Returns the first mismatches of the message, decoding it value by value."""
+    expected = expected_elements(message)
+    mismatches = []
+    subset = element = 0
+    for subset, decoded in enumerate(read_subsets(data)):
+        for element, (fxy, value) in enumerate(decoded):
+            encoded = next(expected, None)
+            if encoded is None:
+                mismatches.append(Mismatch(subset, element, fxy, None, fxy))
+                return mismatches
+            encoded_fxy, typename, bit_len, scale, offset, encoded_value = encoded
+            if encoded_fxy != fxy:
+                # The elements no longer line up, nothing after this can be compared
+                mismatches.append(Mismatch(subset, element, fxy, encoded_fxy, fxy))
+                return mismatches
+            if not element_matches(fxy, typename, bit_len, scale, offset, encoded_value, value):
+                mismatches.append(Mismatch(subset, element, fxy, encoded_value, value))
+                if len(mismatches) >= max_mismatches:
+                    return mismatches
+    encoded = next(expected, None)
+    if encoded is not None:
+        mismatches.append(Mismatch(subset, element + 1, encoded[0], encoded[0], None))
+    return mismatches
+
+
+def element_matches(fxy: str, typename: str, bit_len: int, scale: int, offset: int, expected: Any,
+                    decoded: Any) -> bool:
+    """Returns True if the decoded value of the element matches the value it was encoded from."""
+    if typename == 'string':
+        return expected_string(expected, bit_len) == decoded
+    if expected is not None:
+        expected = float(expected)
+    if typename == 'reference':
+        if expected is None or math.isnan(expected):
+            return decoded is None
+        return signed_reference(round(expected), bit_len) == decoded
+    if expected is None or math.isnan(expected):
+        return decoded is None
+    packed = expected * math.pow(10, scale) - offset
+    if not fxy.startswith('031') and round(packed) == (1 << bit_len) - 1:
+        return decoded is None
+    if decoded is None:
+        return False
+    return abs(decoded * math.pow(10, scale) - offset - packed) <= TOLERANCE
+
+
+def format_mismatches(mismatches: List[Mismatch]) -> str:
+    """Returns a report of the mismatches, one per line."""
+    lines = [f'Verification failed, the first {len(mismatches)} mismatches:']
+    lines.extend(f'  {mismatch}' for mismatch in mismatches)
+    return '\n'.join(lines)
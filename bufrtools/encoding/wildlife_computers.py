@@ -3,9 +3,9 @@
 """Encoding support for wildlife computers netCDF."""
 
 
-import io
 import sys
-from typing import List
+import threading
+from typing import List, Iterator, Optional
 from pathlib import Path
 from argparse import Namespace, ArgumentParser
 from datetime import datetime
@@ -13,10 +13,13 @@ from datetime import datetime
 import numpy as np
 import pandas as pd
 
-from bufrtools.tables import get_sequence_description
+from bufrtools.tables import get_sequence_template
 from bufrtools.encoding import bufr as encoder
+from bufrtools.encoding.encoder import Encoder
+from bufrtools.encoding.verify import Mismatch, verify_message, format_mismatches
 from bufrtools.util.gis import azimuth, haversine_distance
-from bufrtools.util.parse import parse_input_to_dataframe
+from bufrtools.util.instrument import dump, stage, collect
+from bufrtools.util.parse import iter_input_chunks, parse_input_to_dataframe
 
 
 def get_section1() -> dict:
@@ -42,17 +45,45 @@ def get_section1() -> dict:
     return section1
 
 
-def get_section3() -> dict:
+def get_section3(number_of_subsets: int = 1, compressed: bool = False) -> dict:
     """Returns the section3 part of the message to be encoded."""
     section3 = {
-        'number_of_subsets': 1,
+        'number_of_subsets': number_of_subsets,
         'observed_flag': True,
-        'compressed_flag': False,
+        'compressed_flag': compressed,
         'descriptors': ['315023'],
     }
     return section3
 
 
+# Encoders reuse their buffer, so every thread keeps its own
+_ENCODERS = threading.local()
+
+
+def get_encoder() -> Encoder:
+    """Returns the encoder of the profile messages, created once per thread.
+
+    The typical time of the section 1 template is replaced by the time every message is encoded.
+    """
+    encoder = getattr(_ENCODERS, 'encoder', None)
+    if encoder is None:
+        section3 = get_section3()
+        encoder = _ENCODERS.encoder = Encoder(section3['descriptors'], get_section1(),
+                                              section3['observed_flag'],
+                                              section3['compressed_flag'])
+    return encoder
+
+
+def get_positions(df: pd.DataFrame) -> pd.DataFrame:
+    """Returns the time, position and shallowest depth of every profile, sorted by profile."""
+    return df.groupby('profile').agg(
+        time=('time', 'first'),
+        lon=('lon', 'first'),
+        lat=('lat', 'first'),
+        z=('z', 'min'),
+    )
+
+
 def drift(df: pd.DataFrame) -> np.ndarray:
     """Returns the speed/drift values for the dataset.
 
@@ -61,49 +92,49 @@ def drift(df: pd.DataFrame) -> np.ndarray:
     travel no distance over no time will have a drift of zero. The last element of the returned
     array will be 0, as it can not be effectively calculated.
     """
-    t = df.groupby('profile')['time'].first()
+    return drift_speed(get_positions(df))
+
+
+def drift_speed(positions: pd.DataFrame) -> np.ndarray:
+    """Returns the speed/drift values between the profile positions returned by `get_positions`."""
     # Calculate time differences and convert to seconds
-    dt = np.diff(t).astype('timedelta64[s]').view('int64')
-
-    x = df.groupby('profile')['lon'].first() * np.pi / 180
-    y = df.groupby('profile')['lat'].first() * np.pi / 180
-    ds = haversine_distance(x.values, y.values)
-    ds_dt = np.zeros_like(t.view('float64'))
-    for i in range(ds.shape[0]):
-        if np.abs(ds[i]) < 0.0001 and np.abs(dt[i]) < 0.0001:
-            ds_dt[i] = 0
-        else:
-            ds_dt[i] = ds[i] / dt[i]
+    dt = np.diff(positions['time'].values).astype('timedelta64[s]').view('int64')
+
+    x = positions['lon'].values * np.pi / 180
+    y = positions['lat'].values * np.pi / 180
+    ds = haversine_distance(x, y)
+    ds_dt = np.zeros(len(positions), dtype=np.float64)
+    stationary = (np.abs(ds) < 0.0001) & (np.abs(dt) < 0.0001)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ds_dt[:-1] = np.where(stationary, 0, ds / dt)
     return ds_dt
 
 
 def get_trajectory_sequences(df: pd.DataFrame) -> List[dict]:
     """Returns a sequence of records for the trajectory part of the BUFR message."""
     # Pull profile locations out as the first point in each profile
-    t = df.groupby('profile')['time'].first()
-    x = df.groupby('profile')['lon'].first() * np.pi / 180
-    y = df.groupby('profile')['lat'].first() * np.pi / 180
+    positions = get_positions(df)
+    x = positions['lon'].values * np.pi / 180
+    y = positions['lat'].values * np.pi / 180
 
-    theta = azimuth(x.values, y.values) * 180 / np.pi
+    theta = azimuth(x, y) * 180 / np.pi
     theta_mask = ~np.isnan(theta)
     theta[theta_mask] = (theta[theta_mask] + 360) % 360
-    speed = drift(df)
+    speed = drift_speed(positions)
 
     trajectory = pd.DataFrame({
-        'time': t[:-1],
-        'profile': df.groupby('profile')['profile'].first()[:-1],
-        'lat': df.groupby('profile')['lat'].first()[:-1],
-        'lon': df.groupby('profile')['lon'].first()[:-1],
+        'time': positions['time'].values[:-1],
+        'profile': positions.index.values[:-1],
+        'lat': positions['lat'].values[:-1],
+        'lon': positions['lon'].values[:-1],
         'direction': theta[:-1],
-        'speed': speed[:-1]
+        'speed': speed[:-1],
+        'z': positions['z'].values[:-1],
     })
 
     trajectory = trajectory[trajectory.speed > 0]
-    trajectory['z'] = df.groupby('profile')['z'].min()
     # Should we ever have a negative depth?
     #trajectory['z'] = trajectory.z.apply(lambda x: max(0, x))
-    # Drop the profile index before merge
-    trajectory = trajectory.reset_index(drop=True)
     # Combine back with the full dataset after calculating
     # speed and direction
     trajectory = pd.merge(trajectory, df[['profile', 'z', 'temperature']])
@@ -117,49 +148,73 @@ def get_trajectory_sequences(df: pd.DataFrame) -> List[dict]:
         'bit_len': 8,
         'value': len(trajectory)
     })
-    trajectory_seq = get_sequence_description('315023').iloc[18:37]
-    for _, row in trajectory.iterrows():
-        for seq in process_trajectory(trajectory_seq.copy(), row):
-            sequence.append(seq)
+    layout = encoder.compile_layout(get_sequence_template('315023').records(18, 37))
+    sequence.extend(process_trajectory(layout, trajectory))
     return sequence
 
 
-def process_trajectory(trajectory_seq: pd.DataFrame, row) -> List[dict]:
-    """Returns the sequence for the given row of the trajectory data frame."""
-
-    # Get temperature
-    temperature = getattr(row, 'temperature', np.nan)
-    temperature += 273.15  # Convert from deg_C to Kelvin
-
-    trajectory_seq['value'] = [
-        26,                          # Last known position
-        np.nan,                      # Sequence
-        row.time.year,
-        row.time.month,
-        row.time.day,
-        np.nan,                      # Sequence
-        row.time.hour,
-        row.time.minute,
-        np.nan,                      # Lat/Lon Sequence,
-        row.lat,
-        row.lon,
-        row.direction,
-        row.speed,
-        0,                           # Fixed to good
-        0,                           # Fixed to good
-        1,                           # 500 m <= Radius <= 1500 m
-        row.z if row.z >= 0 else 0,
-        temperature,                 # Sea / Water Temperature (K)
-        31,                          # Missing Value
-    ]
-    return trajectory_seq.to_dict(orient='records')
+def assign_values(sequence: List[dict], values: list) -> List[dict]:
+    """Returns a copy of the sequence records with one value assigned to each record."""
+    if len(values) != len(sequence):
+        raise ValueError(f'Expected {len(sequence)} values, got {len(values)}')
+    return [{**seq, 'value': value} for seq, value in zip(sequence, values)]
+
+
+def process_trajectory(layout: encoder.ColumnLayout, trajectory: pd.DataFrame) -> List[dict]:
+    """Returns the sequence for every row of the trajectory data frame."""
+    time = trajectory['time'].dt
+    z = trajectory['z'].values
+    # Convert from deg_C to Kelvin
+    temperature = trajectory['temperature'].values + 273.15
+
+    return [{
+        'fxy': '315023',
+        'text': 'Trajectory (Sequence)',
+        'type': 'columns',
+        'layout': layout,
+        'value': [
+            26,                          # Last known position
+            time.year.values,
+            time.month.values,
+            time.day.values,
+            time.hour.values,
+            time.minute.values,
+            trajectory['lat'].values,
+            trajectory['lon'].values,
+            trajectory['direction'].values,
+            trajectory['speed'].values,
+            0,                           # Fixed to good
+            0,                           # Fixed to good
+            1,                           # 500 m <= Radius <= 1500 m
+            np.where(z >= 0, z, 0),
+            temperature,                 # Sea / Water Temperature (K)
+            31,                          # Missing Value
+        ],
+    }]
 
 
 def get_profile_sequence(df: pd.DataFrame) -> List[dict]:
     """Returns the sequences for the profiles."""
-    parent_seq = get_sequence_description('315023')
-    profile_description_seq = parent_seq.iloc[39:52]
-    profile_data_seq = parent_seq.iloc[55:67]
+    parent_seq = get_sequence_template('315023')
+    profile_description_seq = parent_seq.records(39, 52)
+    profile_data_layout = encoder.compile_layout(parent_seq.records(55, 67))
+
+    # Profiles are encoded in the order they first appear
+    grouped = df.groupby('profile', sort=False)
+    first_rows = grouped.head(1)
+    directions = np.where(grouped['z'].mean().values < 0, 0, 1)
+    # Row order that makes the rows of every profile contiguous, and where each profile ends
+    order = np.argsort(grouped.ngroup().values, kind='stable')
+    stops = np.cumsum(grouped.size().values)
+
+    nan = np.full(len(df), np.nan)
+    z = df['z'].values[order]
+    # Convert from dbar to Pa
+    pressure = (df['pressure'].values * 10000 if 'pressure' in df else nan)[order]
+    # Convert from deg_C to Kelvin
+    temperature = (df['temperature'].values + 273.15 if 'temperature' in df else nan)[order]
+    salinity = (df['salinity'].values if 'salinity' in df else nan)[order]
+
     sequence = []
     sequence.append({
         'fxy': '031001',
@@ -168,51 +223,55 @@ def get_profile_sequence(df: pd.DataFrame) -> List[dict]:
         'scale': 0,
         'offset': 0,
         'bit_len': 8,
-        'value': len(df.profile.unique()),
+        'value': len(first_rows),
     })
-    for profile_id in df.profile.unique():
-        profile = df[df['profile'] == profile_id]
-        profile_seq = process_profile_description(profile_description_seq.copy(), profile)
+    start = 0
+    for row, direction, stop in zip(first_rows.itertuples(), directions, stops):
+        profile_seq = process_profile_description(profile_description_seq, row, direction)
         sequence.extend(profile_seq)
-        data_seq = process_profile_data(profile_data_seq.copy(), profile)
+        data_seq = process_profile_data(profile_data_layout,
+                                        z[start:stop],
+                                        pressure[start:stop],
+                                        temperature[start:stop],
+                                        salinity[start:stop])
         sequence.extend(data_seq)
+        start = stop
     return sequence
 
 
-def process_profile_description(profile_seq: pd.DataFrame, profile: pd.DataFrame) -> List[dict]:
-    """Returns the sequence for the profile description part."""
-    first_row = profile.iloc[0]
-    date = first_row.time
-
-    year = date.year
-    month = date.month
-    day = date.day
-    hour = date.hour
-    minute = date.minute
-    lat = first_row.lat
-    lon = first_row.lon
-    profile_id = str(first_row.profile)
-    direction = 0 if (profile.z.mean() < 0) else 1
-    profile_seq['value'] = [
+def process_profile_description(profile_seq: List[dict], row, direction: int) -> List[dict]:
+    """Returns the sequence for the profile description part.
+
+    `row` is the first row of the profile and `direction` the code figure for the direction of the
+    profile.
+    """
+    date = row.time
+    return assign_values(profile_seq, [
         np.nan,     # Sequence
-        year,
-        month,
-        day,
+        date.year,
+        date.month,
+        date.day,
         np.nan,     # Sequence
-        hour,
-        minute,
+        date.hour,
+        date.minute,
         np.nan,     # Sequence
-        lat,
-        lon,
-        profile_id,
+        row.lat,
+        row.lon,
+        str(row.profile),
         np.nan,     # Upcast number
         direction,
-    ]
-    return profile_seq.to_dict(orient='records')
+    ])
+
 
+def process_profile_data(layout: encoder.ColumnLayout,
+                         z: np.ndarray,
+                         pressure: np.ndarray,
+                         temperature: np.ndarray,
+                         salinity: np.ndarray) -> List[dict]:
+    """Returns the sequence for the profile data 306035 Temperature and Salinity Profile.
 
-def process_profile_data(profile_seq: pd.DataFrame, profile: pd.DataFrame) -> List[dict]:
-    """Returns the sequence for the profile data 306035 Temperature and Salinity Profile."""
+    Pressure is in Pa and temperature in K, missing values are NaN.
+    """
     sequence = []
     sequence.append({
         'fxy': '031002',
@@ -221,22 +280,15 @@ def process_profile_data(profile_seq: pd.DataFrame, profile: pd.DataFrame) -> Li
         'scale': 0,
         'offset': 0,
         'bit_len': 16,
-        'value': len(profile),
+        'value': len(z),
     })
-    for i, row in profile.iterrows():
-        seq = profile_seq.copy()
-
-        # Get pressure
-        pressure = getattr(row, 'pressure', np.nan)
-        pressure *= 10000  # Convert from dbar to Pa
-        # Get temperature
-        temperature = getattr(row, 'temperature', np.nan)
-        temperature += 273.15  # Convert from deg_C to Kelvin
-        # Get salinity
-        salinity = getattr(row, 'salinity', np.nan)
-
-        seq['value'] = [
-            row.z if row.z > 0 else 0,  # Depth below sea water
+    sequence.append({
+        'fxy': '306035',
+        'text': 'Temperature and salinity profile (Sequence)',
+        'type': 'columns',
+        'layout': layout,
+        'value': [
+            np.where(z > 0, z, 0),      # Depth below sea water
             13,                         # Depth at a level
             0,                          # Unqualified
             pressure,                   # Pressure
@@ -248,8 +300,8 @@ def process_profile_data(profile_seq: pd.DataFrame, profile: pd.DataFrame) -> Li
             salinity,                   # Salinity
             12,                         # Salinity at a depth
             0,                          # Unqualified
-        ]
-        sequence.extend(seq.to_dict(orient='records'))
+        ],
+    })
     return sequence
 
 
@@ -262,15 +314,14 @@ def get_section4(df: pd.DataFrame, **kwargs) -> List[dict]:
     wigos_identifier_series = 0  # Placeholder
     wigos_issue_number = 0       # Placeholder
 
-    wigos_sequence = get_sequence_description('301150')
-    wigos_sequence['value'] = [
+    wigos_sequence = get_sequence_template('301150').records()
+    records.extend(assign_values(wigos_sequence, [
         np.nan,                   # Sequence
         wigos_identifier_series,  # 001125,WIGOS identifier series,,,Operational
         wigos_issuer,             # 001126,WIGOS issuer of identifier,,,Operational
         wigos_issue_number,       # 001127,WIGOS issue number,,,Operational
         wigos_local_identifier,   # 001128,WIGOS local identifier (character),,,Operational
-    ]
-    records.extend(wigos_sequence.to_dict(orient='records'))
+    ]))
 
     uuid = kwargs.pop('uuid')
     ptt = kwargs.pop('ptt')
@@ -279,8 +330,8 @@ def get_section4(df: pd.DataFrame, **kwargs) -> List[dict]:
     if wmo is None:
         wmo = 0
 
-    platform_id_sequence = get_sequence_description('315023')[6:16]
-    platform_id_sequence['value'] = [
+    platform_id_sequence = get_sequence_template('315023').records(6, 16)
+    records.extend(assign_values(platform_id_sequence, [
         np.nan,         # 201129,Change data width,,,Operational  # noqa
         wmo,            # 001087,WMO marine observing platform extended identifier ,WMO number where assigned,,Operational # noqa
         np.nan,         # 201000,Change data width,Cancel,,Operational
@@ -291,37 +342,100 @@ def get_section4(df: pd.DataFrame, **kwargs) -> List[dict]:
         995,            # 022067,Instrument type for water temperature and/or salinity measurement,set to 995 (attached to marine animal),,Operational # noqa
         ptt[:12],       # 001051,Platform transmitter ID number,e.g. Argos PTT,,Operational # noqa
         1,              # 002148,Data collection and/or location system,,,Operational # noqa
-    ]
-    records.extend(platform_id_sequence.to_dict(orient='records'))
+    ]))
     # WC profiles don't have enough data to fill in the trajectory portion of the BUFR, so we'll
     records.extend(get_trajectory_sequences(df))
     records.extend(get_profile_sequence(df))
     return records
 
 
-def encode(profile_dataset: Path, output: Path, **kwargs):
-    """Encodes the input `profile_dataset` as BUFR and writes it to `output`."""
-    df, meta = parse_input_to_dataframe(profile_dataset)
+def get_message(profile_dataset: Path, **kwargs) -> dict:
+    """Returns the message to encode for the input `profile_dataset`."""
+    with stage('parse_input') as record:
+        df, meta = parse_input_to_dataframe(profile_dataset)
+        record.add(len(df))
+    return build_message(df, meta, **kwargs)
+
 
+def get_messages(profile_dataset: Path, profiles_per_message: int, **kwargs) -> Iterator[dict]:
+    """Yields a message to encode for every `profiles_per_message` profiles of the input.
+
+    The input is read in chunks as the messages are consumed, so only the profiles of one message
+    are held in memory at a time. Trajectory segments that end in the next message are left out.
+    """
+    chunks = iter_input_chunks(profile_dataset, profiles_per_message)
+    while True:
+        with stage('parse_input') as record:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return
+            df, meta = chunk
+            record.add(len(df))
+        yield build_message(df, meta, **kwargs)
+
+
+def build_message(df: pd.DataFrame, meta: dict, **kwargs) -> dict:
+    """Returns the message to encode for the profiles in the data frame."""
     # If we were able to extract metadata attributes from the
     # source dataset, use those instead of the passed in values
     if meta:
         kwargs = {**kwargs, **meta}
+    if kwargs.get('uuid') is None:
+        raise ValueError('A uuid is required when the dataset has no uuid attribute')
 
-    context = {}
-    context['buf'] = buf = io.BytesIO()
-    encoder.encode_section0({}, context)
-    section1 = get_section1()
-    encoder.encode_section1({'section1': section1}, context)
-    section3 = get_section3()
-    encoder.encode_section3({'section3': section3}, context)
-    section4 = get_section4(df, **kwargs)
-    encoder.encode_section4({'section4': section4}, context)
-    encoder.encode_section5(context)
-    encoder.finalize_bufr(context)
+    with stage('get_section4') as record:
+        section4 = get_section4(df, **kwargs)
+        record.add(len(section4))
+
+    return {
+        'section1': get_section1(),
+        'section3': get_section3(),
+        'section4': section4,
+    }
+
+
+def encode_message(profile_dataset: Path, **kwargs) -> bytes:
+    """Returns the input `profile_dataset` encoded as a BUFR message."""
+    message = get_message(profile_dataset, **kwargs)
+    return get_encoder().encode(message['section4'], timestamp=datetime.utcnow())
 
-    buf.seek(0)
-    output.write_bytes(buf.read())
+
+def encode(profile_dataset: Path,
+           output: Path,
+           verify: bool = False,
+           profiles_per_message: Optional[int] = None,
+           **kwargs) -> List[Mismatch]:
+    """Encodes the input `profile_dataset` as BUFR and writes it to `output`.
+
+    All profiles go into a single message unless `profiles_per_message` is given, then the input is
+    streamed and a message is written for every `profiles_per_message` profiles. If `verify` is set,
+    every encoded message is decoded and compared with the message it was encoded from first, and
+    nothing is written unless they all match. Returns the first mismatches found.
+    """
+    if profiles_per_message is None:
+        messages = iter([get_message(profile_dataset, **kwargs)])
+    else:
+        messages = get_messages(profile_dataset, profiles_per_message, **kwargs)
+    mismatches = []
+    complete = False
+    try:
+        encoder = get_encoder()
+        with open(output, 'wb') as f:
+            for message in messages:
+                if not verify:
+                    encoder.write(f, message['section4'], timestamp=datetime.utcnow())
+                    continue
+                data = encoder.encode(message['section4'], timestamp=datetime.utcnow())
+                mismatches = verify_message(message, data)
+                if mismatches:
+                    return mismatches
+                f.write(data)
+        complete = True
+    finally:
+        # Don't leave a partial file behind
+        if not complete:
+            Path(output).unlink(missing_ok=True)
+    return mismatches
 
 
 def parse_args(argv) -> Namespace:
@@ -340,6 +454,20 @@ def parse_args(argv) -> Namespace:
                         '--ptt',
                         type=str,
                         default=None)
+    parser.add_argument('--profile-stats',
+                        type=str,
+                        default=None,
+                        help='Write the timings and counters of every stage as JSON to this file, '
+                        'or to stdout if it is -.')
+    parser.add_argument('--verify',
+                        action='store_true',
+                        help='Decode the encoded message and compare it with the input before '
+                        'writing it, fails on the first mismatches.')
+    parser.add_argument('--profiles-per-message',
+                        type=int,
+                        default=None,
+                        help='Stream the input and write a message for every this many profiles '
+                        'instead of a single message.')
 
     args = parser.parse_args(argv)
     return args
@@ -350,7 +478,17 @@ def main():
     args = parse_args(sys.argv[1:])
 
     assert args.profile_dataset.exists()
-    encode(args.profile_dataset, args.output, uuid=args.uuid, ptt=args.ptt)
+    if args.profile_stats is None:
+        mismatches = encode(args.profile_dataset, args.output, args.verify,
+                            args.profiles_per_message, uuid=args.uuid, ptt=args.ptt)
+    else:
+        with collect() as stats:
+            mismatches = encode(args.profile_dataset, args.output, args.verify,
+                                args.profiles_per_message, uuid=args.uuid, ptt=args.ptt)
+        dump(stats, args.profile_stats)
+    if mismatches:
+        print(format_mismatches(mismatches), file=sys.stderr)
+        return 1
     return 0
 
 
@@ -1,36 +1,36 @@
 #!/usr/bin/env python
 #-*- coding: utf-8 -*-
-"""Package for dealing with BUFR tables."""
-import csv
-import copy
-import codecs
+"""Package for dealing with BUFR tables.
 
-import pkg_resources
+The functions returning data frames import pandas when they're called, the encoder and decoder
+only use the registry and the compiled sequence templates.
+"""
+import copy
+from typing import TYPE_CHECKING
 
 import numpy as np
-import pandas as pd
 from bufrtools.util.parse import parse_ref
+from bufrtools.tables.sequence import SequenceTemplate, get_sequence_template  # noqa: F401
+from bufrtools.tables.codes import resolve_code_figures  # noqa: F401
+from bufrtools.tables.registry import get_registry
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-def get_code_table(fxy_str: str) -> pd.DataFrame:
+
+def get_code_table(fxy_str: str) -> 'pd.DataFrame':
     """Returns the code table for the given FXXYYY string."""
-    f, x, y = parse_ref(fxy_str)
-    filename = f'BUFRCREX_CodeFlag_en_{x:02d}.csv'
-    utf8_reader = codecs.getreader('utf-8')
-    with pkg_resources.resource_stream('bufrtools.tables', f'data/{filename}') as f:
-        reader = csv.DictReader(utf8_reader(f))
-        rows = []
-        for row in reader:
-            if fxy_str != row['FXY']:
-                continue
-            if '-' in row['CodeFigure']:
-                start, end = (int(i) for i in row['CodeFigure'].split('-'))
-                for i in range(start, end + 1):
-                    enumerated_row = copy.copy(row)
-                    enumerated_row['CodeFigure'] = i
-                    rows.append(enumerated_row)
-            else:
-                rows.append(row)
+    import pandas as pd
+    rows = []
+    for row in get_registry().code_table(fxy_str):
+        if '-' in row['CodeFigure']:
+            start, end = (int(i) for i in row['CodeFigure'].split('-'))
+            for i in range(start, end + 1):
+                enumerated_row = copy.copy(row)
+                enumerated_row['CodeFigure'] = i
+                rows.append(enumerated_row)
+        else:
+            rows.append(row)
     df = pd.DataFrame(rows)
     df = df.astype({'CodeFigure': np.uint16})
     return df
@@ -38,28 +38,12 @@ def get_code_table(fxy_str: str) -> pd.DataFrame:
 
 def get_code_table_figure(fxy_str: str, code_figure: int) -> dict:
     """Returns the code table row for the given FXXYYY string."""
-    f, x, y = parse_ref(fxy_str)
-    filename = f'BUFRCREX_CodeFlag_en_{x:02d}.csv'
-    utf8_reader = codecs.getreader('utf-8')
-    with pkg_resources.resource_stream('bufrtools.tables', f'data/{filename}') as f:
-        reader = csv.DictReader(utf8_reader(f))
-        for row in reader:
-            if fxy_str != row['FXY']:
-                continue
-            if '-' in row['CodeFigure']:
-                start, end = (int(i) for i in row['CodeFigure'].split('-'))
-                if start <= code_figure and code_figure <= end:
-                    return row
-            else:
-                try:
-                    val = int(row['CodeFigure'])
-                    if val == code_figure:
-                        return row
-                except ValueError:
-                    pass
+    row = get_registry().code_figure(fxy_str, code_figure)
+    if row is not None:
+        return dict(row)
 
 
-def get_summary(fxy_str: str) -> pd.DataFrame:
+def get_summary(fxy_str: str) -> 'pd.DataFrame':
     """Returns a summary table of the contents of the FXXYYY sequence."""
     f, x, y = parse_ref(fxy_str)
     references = table_d_lookup(f, x, y)
@@ -77,65 +61,45 @@ def get_summary(fxy_str: str) -> pd.DataFrame:
     return df[columns]
 
 
-def get_sequence_description(fxy_str: str) -> pd.DataFrame:
+def get_sequence_description(fxy_str: str) -> 'pd.DataFrame':
     """Returns a sequence description used for encoding/decoding."""
-    summary = get_summary(fxy_str).copy(deep=True)
-    # Get rid of the old index because it references a combination of other tables
-    summary.reset_index(drop=True, inplace=True)
-    summary.rename(columns={
-        'BUFR_Scale': 'scale',
-        'BUFR_ReferenceValue': 'offset',
-        'FXY': 'fxy',
-        'Parent': 'parent',
-        'BUFR_DataWidth_Bits': 'bit_len',
-    }, inplace=True)
-    summary['type'] = np.nan
-    summary['text'] = summary['Title']
-    for i, row in summary.iterrows():
-        f, x, y = parse_ref(row['fxy'])
-        typename = ''
-        title = f'{row["Title"]} ({row["BUFR_Unit"]})'
-        if f == 2:
-            typename = 'operator'
-        elif row['BUFR_Unit'] == 'CCITT IA5':
-            typename = 'string'
-        elif row['BUFR_Unit'] == 'Replication':
-            typename = 'replication'
-        else:
-            typename = 'numeric'
-        summary.iloc[i, summary.columns.get_loc('type')] = typename
-        summary.iloc[i, summary.columns.get_loc('text')] = title
-    return summary
-
-
-def get_table_a() -> pd.DataFrame:
+    import pandas as pd
+    template = get_sequence_template(fxy_str)
+    return pd.DataFrame({
+        'parent': template.parent,
+        'fxy': template.fxy,
+        'Title': template.title,
+        'Subtitle': template.subtitle,
+        'bit_len': template.bit_len,
+        'BUFR_Unit': template.unit,
+        'scale': template.scale,
+        'offset': template.offset,
+        'type': template.type,
+        'text': template.text,
+    })
+
+
+def get_table_a() -> 'pd.DataFrame':
     """Returns the Table A contents."""
-    filename = 'BUFR_TableA_en.csv'
-    stream = pkg_resources.resource_stream('bufrtools.tables', f'data/{filename}')
-    df = pd.read_csv(stream)
-    return df
+    import pandas as pd
+    return pd.DataFrame(get_registry().table_a())
 
 
-def get_table_d(f, x, y) -> pd.DataFrame:
+def get_table_d(f, x, y) -> 'pd.DataFrame':
     """Returns the contents of the Table D for the given FXXYYY string."""
+    import pandas as pd
     assert f == 3
     fxy_str = f'{f}{x:02d}{y:03d}'
-    filename = f'BUFR_TableD_en_{x:02d}.csv'
-    stream = pkg_resources.resource_stream('bufrtools.tables', f'data/{filename}')
-    df = pd.read_csv(stream, dtype={'FXY1': str, 'FXY2': str})
-    df = df[df['FXY1'] == fxy_str]
-    return df
+    return pd.DataFrame(get_registry().table_d(fxy_str))
 
 
-def get_table_b(f, x, y) -> pd.DataFrame:
+def get_table_b(f, x, y) -> 'pd.DataFrame':
     """Returns the contents of the Table B for the given FXXYYY string."""
+    import pandas as pd
     assert f == 0
     fxy_str = f'{f}{x:02d}{y:03d}'
-    filename = f'BUFRCREX_TableB_en_{x:02d}.csv'
-    stream = pkg_resources.resource_stream('bufrtools.tables', f'data/{filename}')
-    df = pd.read_csv(stream, dtype={'FXY': str})
-    df = df[df['FXY'] == fxy_str]
-    return df
+    row = get_registry().table_b(fxy_str)
+    return pd.DataFrame([row] if row is not None else [])
 
 
 def table_a_lookup(code_figure: int) -> dict:
@@ -173,8 +137,9 @@ def table_d_lookup(f, x, y, parent=None):
     return sub_references
 
 
-def combine_references(references) -> pd.DataFrame:
+def combine_references(references) -> 'pd.DataFrame':
     """Returns a data frame for a generic reference, that will be flattened."""
+    import pandas as pd
     frames = []
     for parent, reference, title, subtitle in references:
         f, x, y = parse_ref(reference)
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Builds the precompiled cache of the packaged BUFR tables."""
+import sys
+from typing import List
+from pathlib import Path
+from argparse import Namespace, ArgumentParser
+
+from bufrtools.tables.storage import build_cache
+
+
+def parse_args(argv: List[str]) -> Namespace:
+    """Returns an argument namespace argument parsed from the command line arguments."""
+    parser = ArgumentParser(description=main.__doc__)
+    parser.add_argument('-o',
+                        '--output',
+                        type=Path,
+                        default=None,
+                        help='Filename to output to, defaults to the packaged cache.')
+    args = parser.parse_args(argv)
+    return args
+
+
+def main():
+    """Builds the precompiled cache of the packaged BUFR tables."""
+    args = parse_args(sys.argv[1:])
+    path = build_cache(str(args.output) if args.output else None)
+    print(path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Module for resolving whole arrays of code figures to the entry names of their code table.
+
+A code table is compiled once into sorted, non-overlapping ranges of code figures, ranges like
+`0-36000` are kept as they are instead of being expanded figure by figure. Resolving an array of
+figures is then a binary search of the range starts followed by a single gather of the names.
+"""
+from bisect import bisect_right
+from typing import Optional, NamedTuple
+from functools import lru_cache
+
+import numpy as np
+
+from bufrtools.tables.registry import get_registry, parse_code_figure
+
+
+class CodeTable(NamedTuple):
+    """The code figure ranges of a code table and the entry name of each range.
+
+    `names` holds one more entry than there are ranges, a trailing None that figures outside every
+    range resolve to.
+    """
+
+    fxy: str
+    starts: np.ndarray
+    ends: np.ndarray
+    names: np.ndarray
+
+    def lookup(self, figures) -> np.ndarray:
+        """Returns an object array of the entry names of the figures, None where there is none.
+
+        Figures may be floats, NaN resolves to None.
+        """
+        figures = np.asarray(figures)
+        if not len(self.starts):
+            return np.full(figures.shape, None, dtype=object)
+        index = np.searchsorted(self.starts, figures, side='right') - 1
+        found = (index >= 0) & (figures <= self.ends[index])
+        return self.names[np.where(found, index, len(self.starts))]
+
+    def name(self, figure: int) -> Optional[str]:
+        """Returns the entry name of a single code figure or None if there is none."""
+        i = bisect_right(self.starts, figure) - 1
+        if i >= 0 and figure <= self.ends[i]:
+            return self.names[i]
+        return None
+
+
+@lru_cache(maxsize=None)
+def compile_code_table(fxy: str, table_version: int) -> CodeTable:
+    """Returns the code table of the descriptor in the given version of the tables.
+
+    Where the ranges of rows overlap, the row listed first in the table wins.
+    """
+    ranges = []
+    for row in get_registry().code_table(fxy):
+        code_range = parse_code_figure(row['CodeFigure'])
+        if code_range is not None:
+            ranges.append((code_range[0], code_range[1], row['EntryName_en']))
+    # Sorting is stable, so rows sharing a start stay in the order they're listed
+    ranges.sort(key=lambda r: r[0])
+    starts, ends, names = [], [], []
+    for start, end, name in ranges:
+        if ends and start <= ends[-1]:
+            if end <= ends[-1]:
+                continue
+            start = ends[-1] + 1
+        starts.append(start)
+        ends.append(end)
+        names.append(name)
+    names.append(None)
+    return CodeTable(fxy, np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64),
+                     np.array(names, dtype=object))
+
+
+def get_code_table_resolver(fxy: str) -> CodeTable:
+    """Returns the code table of the descriptor, compiled once per table version."""
+    return compile_code_table(fxy, get_registry().version)
+
+
+def resolve_code_figures(fxy: str, figures) -> np.ndarray:
+    """Returns an object array of the entry names of the code figures of the descriptor.
+
+    Figures that aren't in the code table resolve to None.
+    """
+    return get_code_table_resolver(fxy).lookup(figures)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Module for compiling section 3 descriptors into flat execution plans.
+
+A plan is the list of steps the section 4 data of one subset is made of. Sequences are expanded and
+the operators 2-01 to 2-08 are applied while compiling, so every step carries the width, scale and
+reference value it is encoded with. Replications are kept as a step followed by the steps of its
+body, which are run `count` times, or as many times as the factor of a delayed replication.
+"""
+from typing import List, Tuple, Optional, NamedTuple
+from functools import lru_cache
+
+from bufrtools.util.parse import parse_ref
+from bufrtools.tables.registry import get_registry
+
+# Kinds of plan steps
+NUMERIC = 0
+STRING = 1
+REPLICATION = 2
+DELAYED_REPLICATION = 3
+# 2-03: a new reference value for the element, in `bit_len` bits with a sign bit
+REFERENCE = 4
+# 2-04: an associated field of `bit_len` bits preceding the element
+ASSOCIATED = 5
+
+# Units of elements that 2-01, 2-02 and 2-07 don't apply to
+UNSCALED_UNITS = ('CCITT IA5', 'Code table', 'Flag table')
+
+
+class Step(NamedTuple):
+    """A single step of a plan.
+
+    `offset` is None for elements whose reference value is redefined with 2-03, the reference value
+    is then read from the data. `missing` is the all-ones value of the field, -1 when the field has
+    no missing value. `span` is the number of steps in the body of a replication.
+    """
+
+    kind: int
+    fxy: str
+    bit_len: int = 0
+    scale: int = 0
+    offset: Optional[int] = 0
+    missing: int = -1
+    span: int = 0
+    count: int = 0
+
+
+class Plan(NamedTuple):
+    """The compiled steps of a list of section 3 descriptors."""
+
+    descriptors: Tuple[str, ...]
+    steps: Tuple[Step, ...]
+
+
+@lru_cache(maxsize=None)
+def get_element_row(fxy: str, table_version: int) -> Tuple[str, int, int, int]:
+    """Returns the (unit, bit_len, scale, offset) of the Table B element."""
+    row = get_registry().table_b(fxy)
+    if row is None:
+        raise ValueError(f'Unknown element descriptor: {fxy}')
+    return (row['BUFR_Unit'], int(row['BUFR_DataWidth_Bits']), int(row['BUFR_Scale']),
+            int(row['BUFR_ReferenceValue']))
+
+
+def new_state() -> dict:
+    """Returns the operator state in effect at the start of a subset."""
+    return {
+        'width': 0,
+        'scale': 0,
+        'increase': 0,
+        'defining': 0,
+        'references': frozenset(),
+        'associated': (),
+        'local_width': None,
+        'string_width': None,
+    }
+
+
+def numeric_step(fxy: str, bit_len: int, scale: int, offset, missing: bool = True) -> Step:
+    """Returns the step of a numeric field."""
+    return Step(NUMERIC, fxy, bit_len, scale, offset, (1 << bit_len) - 1 if missing else -1)
+
+
+def element_steps(fxy: str, state: dict, table_version: int) -> List[Step]:
+    """Returns the steps of an element descriptor with the operators in effect applied to it."""
+    if state['local_width'] is not None:
+        # 2-06 describes the width of the local element that follows it
+        bit_len = state['local_width']
+        state['local_width'] = None
+        return [numeric_step(fxy, bit_len, 0, 0)]
+    unit, bit_len, scale, offset = get_element_row(fxy, table_version)
+    if state['defining']:
+        return [Step(REFERENCE, fxy, state['defining'])]
+    steps = []
+    # Class 31 elements, like the replication factors, have no associated field and are never
+    # missing
+    is_class31 = fxy.startswith('031')
+    if state['associated'] and not is_class31:
+        bits = sum(state['associated'])
+        steps.append(Step(ASSOCIATED, f'204{bits:03d}', bits, missing=(1 << bits) - 1))
+    if unit == 'CCITT IA5':
+        steps.append(Step(STRING, fxy, state['string_width'] or bit_len))
+        return steps
+    if unit not in UNSCALED_UNITS:
+        increase = state['increase']
+        bit_len += state['width'] + (10 * increase + 2) // 3
+        scale += state['scale'] + increase
+        offset *= 10 ** increase
+    if fxy in state['references']:
+        if state['increase']:
+            raise ValueError(f'2-07 can not be combined with the new reference value of {fxy}')
+        offset = None
+    if bit_len < 1:
+        raise ValueError(f'Operators leave {fxy} with a width of {bit_len} bits')
+    steps.append(numeric_step(fxy, bit_len, scale, offset, not is_class31))
+    return steps
+
+
+def apply_operator(fxy: str, x: int, y: int, state: dict, steps: List[Step]):
+    """Updates the operator state for the 2-XX-YYY operator, appending any step it inserts."""
+    if x == 1:
+        state['width'] = y - 128 if y else 0
+    elif x == 2:
+        state['scale'] = y - 128 if y else 0
+    elif x == 3:
+        if y == 255:
+            state['defining'] = 0
+        elif y == 0:
+            state['references'] = frozenset()
+        else:
+            state['defining'] = y
+    elif x == 4:
+        # Associated fields nest, 2-04-000 cancels the most recent one
+        state['associated'] = state['associated'] + (y, ) if y else state['associated'][:-1]
+    elif x == 5:
+        steps.append(Step(STRING, fxy, y * 8))
+    elif x == 6:
+        state['local_width'] = y
+    elif x == 7:
+        state['increase'] = y
+    elif x == 8:
+        state['string_width'] = y * 8 if y else None
+    else:
+        raise ValueError(f'Unsupported operator descriptor: {fxy}')
+
+
+def compile_descriptors(descriptors: List[str], state: dict, steps: List[Step],
+                        table_version: int):
+    """Appends the steps of the descriptors to `steps`, updating the operator state."""
+    i = 0
+    while i < len(descriptors):
+        fxy = descriptors[i]
+        f, x, y = parse_ref(fxy)
+        i += 1
+        if f == 0:
+            if state['defining']:
+                state['references'] = state['references'] | {fxy}
+            steps.extend(element_steps(fxy, state, table_version))
+        elif f == 1:
+            start = len(steps)
+            if y == 0:
+                # Delayed replication, the factor is the next descriptor
+                factor = element_steps(descriptors[i], state, table_version)[-1]
+                i += 1
+                steps.append(factor._replace(kind=DELAYED_REPLICATION))
+            else:
+                steps.append(Step(REPLICATION, fxy, count=y))
+            before = dict(state)
+            compile_descriptors(descriptors[i:i + x], state, steps, table_version)
+            i += x
+            if state != before:
+                raise ValueError(f'Operators that outlast the replication {fxy} are not supported')
+            steps[start] = steps[start]._replace(span=len(steps) - start - 1)
+        elif f == 2:
+            apply_operator(fxy, x, y, state, steps)
+        elif f == 3:
+            rows = get_registry().table_d(fxy)
+            if not rows:
+                raise ValueError(f'Unknown sequence descriptor: {fxy}')
+            compile_descriptors([row['FXY2'] for row in rows], state, steps, table_version)
+
+
+@lru_cache(maxsize=256)
+def compile_plan(descriptors: Tuple[str, ...], table_version: int) -> Plan:
+    """Returns the plan for the section 3 descriptors in the given version of the tables."""
+    steps = []
+    compile_descriptors(list(descriptors), new_state(), steps, table_version)
+    return Plan(descriptors, tuple(steps))
+
+
+def get_plan(descriptors: List[str]) -> Plan:
+    """Returns the plan for the section 3 descriptors, compiled once per table version."""
+    return compile_plan(tuple(descriptors), get_registry().version)
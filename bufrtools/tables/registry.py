@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Module for the in-memory index of the packaged BUFR tables."""
+import threading
+from typing import List, Callable, Optional
+
+from bufrtools.tables.storage import (  # noqa: F401
+    MASTER_TABLE_VERSION, INTEGER_COLUMNS, read_table, load_cache, load_table
+)
+
+# Code figure ranges spanning more figures than this are kept as ranges instead of being expanded
+MAX_EXPANDED_RANGE = 1024
+
+
+def parse_code_figure(code_figure: str) -> Optional[tuple]:
+    """Returns the inclusive (start, end) range of the code figure or None if it isn't numeric."""
+    try:
+        if '-' in code_figure:
+            start, end = (int(i) for i in code_figure.split('-'))
+            return start, end
+        value = int(code_figure)
+        return value, value
+    except ValueError:
+        return None
+
+
+class TableRegistry:
+    """Index of the Table A, B, D and code/flag table rows.
+
+    Every packaged table is read at most once, the first time a descriptor that lives in it is
+    looked up, from the precompiled cache when there is one for the version and from the CSV file
+    otherwise. Rows are indexed by their FXY string and code figures by (FXY, figure). Lookups
+    may run in several threads.
+    """
+
+    def __init__(self, version: int = MASTER_TABLE_VERSION, cache_path: Optional[str] = None):
+        """Initializes an empty registry for the given master table version."""
+        self.version = version
+        self._cache = load_cache(cache_path, version)
+        self._loaded = set()
+        self._lock = threading.Lock()
+        self._table_a = []
+        self._table_b = {}
+        self._table_d = {}
+        self._code_tables = {}
+        self._code_figures = {}
+        self._code_ranges = {}
+
+    def _load_once(self,
+                   filename: str,
+                   index: Callable[[List[dict]], None],
+                   parse: bool = True):
+        """Indexes the rows of the file with `index` the first time it's requested.
+
+        The file is loaded under a lock and only marked as loaded once its rows are indexed, so
+        concurrent lookups wait for it rather than finding nothing.
+        """
+        if filename in self._loaded:
+            return
+        with self._lock:
+            if filename in self._loaded:
+                return
+            try:
+                rows = load_table(filename, parse, self._cache)
+            except FileNotFoundError:
+                rows = []
+            index(rows)
+            self._loaded.add(filename)
+
+    def table_a(self) -> List[dict]:
+        """Returns the rows of Table A."""
+        self._load_once('BUFR_TableA_en.csv', self._index_table_a)
+        return self._table_a
+
+    def _index_table_a(self, rows: List[dict]):
+        """Keeps the rows of Table A."""
+        self._table_a = rows
+
+    def table_b(self, fxy: str) -> Optional[dict]:
+        """Returns the Table B row for the element descriptor or None if there isn't one."""
+        self._load_once(f'BUFRCREX_TableB_en_{fxy[1:3]}.csv', self._index_table_b)
+        return self._table_b.get(fxy)
+
+    def _index_table_b(self, rows: List[dict]):
+        """Indexes Table B rows by FXY."""
+        for row in rows:
+            self._table_b[row['FXY']] = row
+
+    def table_d(self, fxy: str) -> List[dict]:
+        """Returns the Table D rows for the sequence descriptor, one per descriptor it contains."""
+        self._load_once(f'BUFR_TableD_en_{fxy[1:3]}.csv', self._index_table_d)
+        return self._table_d.get(fxy, [])
+
+    def _index_table_d(self, rows: List[dict]):
+        """Indexes Table D rows by the FXY of their sequence."""
+        for row in rows:
+            self._table_d.setdefault(row['FXY1'], []).append(row)
+
+    def _load_code_tables(self, fxy: str):
+        """Indexes the code and flag tables in the file that holds the descriptor."""
+        self._load_once(f'BUFRCREX_CodeFlag_en_{fxy[1:3]}.csv', self._index_code_tables,
+                        parse=False)
+
+    def _index_code_tables(self, rows: List[dict]):
+        """Indexes code and flag table rows by FXY, and code figures by (FXY, figure)."""
+        for row in rows:
+            row_fxy = row['FXY']
+            self._code_tables.setdefault(row_fxy, []).append(row)
+            code_range = parse_code_figure(row['CodeFigure'])
+            if code_range is None:
+                continue
+            start, end = code_range
+            if end - start > MAX_EXPANDED_RANGE:
+                self._code_ranges.setdefault(row_fxy, []).append((start, end, row))
+                continue
+            for figure in range(start, end + 1):
+                self._code_figures.setdefault((row_fxy, figure), row)
+
+    def code_table(self, fxy: str) -> List[dict]:
+        """Returns the rows of the code or flag table for the descriptor as they appear."""
+        self._load_code_tables(fxy)
+        return self._code_tables.get(fxy, [])
+
+    def code_figure(self, fxy: str, code_figure: int) -> Optional[dict]:
+        """Returns the code table row for the code figure of the descriptor or None."""
+        self._load_code_tables(fxy)
+        row = self._code_figures.get((fxy, code_figure))
+        if row is not None:
+            return row
+        for start, end, row in self._code_ranges.get(fxy, ()):
+            if start <= code_figure <= end:
+                return row
+        return None
+
+
+_registry = None
+
+
+def get_registry() -> TableRegistry:
+    """Returns the registry shared by the whole process."""
+    global _registry
+    if _registry is None:
+        _registry = TableRegistry()
+    return _registry
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Module for compiled sequence templates."""
+from typing import List, Tuple, Optional, Sequence, NamedTuple
+from functools import lru_cache
+
+import numpy as np
+from bufrtools.util.parse import parse_ref
+from bufrtools.tables.registry import get_registry
+
+
+class SequenceTemplate(NamedTuple):
+    """Immutable, flattened description of every descriptor in a Table D sequence.
+
+    Each field holds one entry per descriptor, in the same order as the rows returned by
+    `bufrtools.tables.get_sequence_description`. Scale and offset are NaN for descriptors that
+    aren't Table B elements.
+    """
+
+    fxy: Tuple[str, ...]
+    parent: Tuple[str, ...]
+    title: Tuple[str, ...]
+    subtitle: Tuple[str, ...]
+    unit: Tuple[str, ...]
+    text: Tuple[str, ...]
+    type: Tuple[str, ...]
+    bit_len: np.ndarray
+    scale: np.ndarray
+    offset: np.ndarray
+
+    @property
+    def size(self) -> int:
+        """Returns the number of descriptors in the template."""
+        return len(self.fxy)
+
+    def records(self,
+                start: int = 0,
+                stop: Optional[int] = None,
+                values: Optional[Sequence] = None) -> List[dict]:
+        """Returns section 4 records for the descriptors from `start` up to `stop`.
+
+        If `values` is given, it holds one value per descriptor in the range.
+        """
+        stop = self.size if stop is None else stop
+        bit_len = self.bit_len[start:stop].tolist()
+        scale = self.scale[start:stop].tolist()
+        offset = self.offset[start:stop].tolist()
+        records = [{
+            'parent': self.parent[i],
+            'fxy': self.fxy[i],
+            'text': self.text[i],
+            'type': self.type[i],
+            'bit_len': bit_len[j],
+            'scale': scale[j],
+            'offset': offset[j],
+        } for j, i in enumerate(range(start, stop))]
+        if values is not None:
+            if len(values) != len(records):
+                raise ValueError(f'Expected {len(records)} values, got {len(values)}')
+            for record, value in zip(records, values):
+                record['value'] = value
+        return records
+
+
+def sequence_references(fxy_str: str, parent: str = None) -> List[tuple]:
+    """Returns the (parent, fxy, title, subtitle) references that the sequence expands to."""
+    rows = get_registry().table_d(fxy_str)
+    if not rows:
+        raise ValueError(f'Unknown sequence descriptor: {fxy_str}')
+    references = []
+    if parent is None:
+        references.append((fxy_str, fxy_str, rows[0]['Title_en'], ''))
+        parent = fxy_str
+    for row in rows:
+        ref = row['FXY2']
+        reference = (parent, ref, row['ElementName_en'], row['ElementDescription_en'])
+        f, x, y = parse_ref(ref)
+        if f in (0, 1) or (f == 2 and x in (1, 8)):
+            references.append(reference)
+        elif f == 3:
+            references.append(reference)
+            references.extend(sequence_references(ref, ref))
+    return references
+
+
+def describe_reference(reference: tuple) -> tuple:
+    """Returns the (unit, type, bit_len, scale, offset) of a single sequence reference."""
+    _, fxy, _, _ = reference
+    f, x, y = parse_ref(fxy)
+    nan = float('nan')
+    if f == 1:
+        return 'Replication', 'replication', 0, nan, nan
+    if f == 2:
+        return 'Operator', 'operator', 0, nan, nan
+    if f == 3:
+        return 'Sequence', 'numeric', 0, nan, nan
+    row = get_registry().table_b(fxy)
+    if row is None:
+        raise ValueError(f'Unknown element descriptor: {fxy}')
+    unit = row['BUFR_Unit']
+    typename = 'string' if unit == 'CCITT IA5' else 'numeric'
+    return (unit, typename, row['BUFR_DataWidth_Bits'], float(row['BUFR_Scale']),
+            float(row['BUFR_ReferenceValue']))
+
+
+def read_only(array: np.ndarray) -> np.ndarray:
+    """Returns the array after marking it read-only."""
+    array.flags.writeable = False
+    return array
+
+
+@lru_cache(maxsize=None)
+def compile_sequence(fxy_str: str, table_version: int) -> SequenceTemplate:
+    """Returns the compiled template for the sequence in the given version of the tables."""
+    references = sequence_references(fxy_str)
+    described = [describe_reference(reference) for reference in references]
+    title = tuple(reference[2] for reference in references)
+    unit = tuple(d[0] for d in described)
+    return SequenceTemplate(
+        fxy=tuple(reference[1] for reference in references),
+        parent=tuple(reference[0] for reference in references),
+        title=title,
+        subtitle=tuple(reference[3] for reference in references),
+        unit=unit,
+        text=tuple(f'{t} ({u})' for t, u in zip(title, unit)),
+        type=tuple(d[1] for d in described),
+        bit_len=read_only(np.array([d[2] for d in described], dtype=np.int64)),
+        scale=read_only(np.array([d[3] for d in described], dtype=np.float64)),
+        offset=read_only(np.array([d[4] for d in described], dtype=np.float64)),
+    )
+
+
+def get_sequence_template(fxy_str: str) -> SequenceTemplate:
+    """Returns the compiled template for the FXXYYY sequence, compiled once per table version."""
+    return compile_sequence(fxy_str, get_registry().version)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Module for reading the packaged BUFR tables from their CSV files or the precompiled cache.
+
+The cache is a pickle, keyed by master table version, holding the parsed rows of every packaged
+CSV file, each compressed separately so only the files that are looked up get unpickled. Rebuild
+it whenever the CSV files change with::
+
+    python -m bufrtools.tables
+"""
+import os
+import csv
+import zlib
+import pickle
+from typing import Dict, List, Optional
+
+# Master table version of the packaged tables, which is the version the encoders declare
+MASTER_TABLE_VERSION = 39
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+# Columns that are parsed as integers, every other column is kept as a string
+INTEGER_COLUMNS = {
+    'ClassNo',
+    'Category',
+    'BUFR_Scale',
+    'BUFR_ReferenceValue',
+    'BUFR_DataWidth_Bits',
+    'CREX_Scale',
+    'CREX_DataWidth_Char',
+}
+
+# Pickle protocol 4 is readable by every supported Python version
+PICKLE_PROTOCOL = 4
+
+
+def read_table(filename: str, parse: bool = True) -> List[dict]:
+    """Returns the rows of a packaged table CSV file.
+
+    If `parse` is set the integer columns are parsed and empty cells are returned as NaN, the same
+    values pandas uses when reading the CSV. Otherwise every cell is returned as a string.
+    """
+    rows = []
+    with open(os.path.join(DATA_DIR, filename), encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            if parse:
+                for key, value in row.items():
+                    if value == '':
+                        row[key] = float('nan')
+                    elif key in INTEGER_COLUMNS:
+                        row[key] = int(value)
+            rows.append(row)
+    return rows
+
+
+def is_parsed(filename: str) -> bool:
+    """Returns True if the cells of the table file are parsed, code and flag tables aren't."""
+    return not filename.startswith('BUFRCREX_CodeFlag')
+
+
+def get_cache_path(version: int = MASTER_TABLE_VERSION) -> str:
+    """Returns the path of the packaged cache for the master table version."""
+    return os.path.join(DATA_DIR, f'tables-v{version}.pickle')
+
+
+def build_cache(path: Optional[str] = None, version: int = MASTER_TABLE_VERSION) -> str:
+    """Parses every packaged CSV file and writes them to the cache, returns the cache path."""
+    path = path or get_cache_path(version)
+    tables = {}
+    for filename in sorted(os.listdir(DATA_DIR)):
+        if not filename.endswith('.csv'):
+            continue
+        rows = read_table(filename, is_parsed(filename))
+        tables[filename] = zlib.compress(pickle.dumps(rows, protocol=PICKLE_PROTOCOL))
+    with open(path, 'wb') as f:
+        pickle.dump({'version': version, 'tables': tables}, f, protocol=PICKLE_PROTOCOL)
+    return path
+
+
+def load_cache(path: Optional[str] = None,
+               version: int = MASTER_TABLE_VERSION) -> Optional[Dict[str, bytes]]:
+    """Returns the compressed table rows keyed by filename.
+
+    Returns None if there is no cache or it was built for a different master table version.
+    """
+    path = path or get_cache_path(version)
+    try:
+        with open(path, 'rb') as f:
+            cache = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    if cache.get('version') != version:
+        return None
+    return cache['tables']
+
+
+def load_table(filename: str,
+               parse: bool = True,
+               cache: Optional[Dict[str, bytes]] = None) -> List[dict]:
+    """Returns the rows of a packaged table, from the cache if it holds the file."""
+    if cache is not None and filename in cache and parse == is_parsed(filename):
+        return pickle.loads(zlib.decompress(cache[filename]))
+    return read_table(filename, parse)
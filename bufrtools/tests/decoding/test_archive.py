@@ -0,0 +1,61 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for the parallel decoding of BUFR files."""
+import copy
+from pathlib import Path
+
+import yaml
+import pyarrow.parquet as pq
+import pytest
+
+import bufrtools
+from bufrtools.tables import get_sequence_template
+from bufrtools.decoding import archive
+from bufrtools.encoding.stream import MessageWriter
+
+
+@pytest.fixture
+def bufr_file(tmp_path):
+    """Fixture for a file of five messages, the fourth of which can't be decoded."""
+    root = Path(bufrtools.__file__).parent.parent
+    message = yaml.safe_load((root / 'examples' / 'basic-atn.yml').read_text('utf-8'))
+    message['section3']['descriptors'] = ['301011', '001079']
+    template = get_sequence_template('301011')
+    identifier = {'fxy': '001079', 'type': 'string', 'bit_len': 64}
+    path = tmp_path / 'feed.bufr'
+    with open(path, 'wb') as f:
+        writer = MessageWriter(f)
+        for day in range(1, 6):
+            msg = copy.deepcopy(message)
+            msg['section4'] = template.records(values=[None, 2020, 6, day])
+            msg['section4'].append({**identifier, 'value': f'tag{day}'})
+            if day == 4:
+                # Section 3 describes more data than section 4 holds
+                msg['section3']['descriptors'] = ['301011', '301011', '001079']
+            writer.write(msg)
+    return path
+
+
+def test_decode_many(bufr_file):
+    """Tests that shards are decoded in worker processes and returned in message order."""
+    batches = list(archive.decode_many(bufr_file, workers=2, shard_size=2))
+    assert len(batches) == 3
+    table = batches[0].to_pandas()
+    assert table['message'].tolist() == [0, 0, 0, 0, 1, 1, 1, 1]
+    assert table['subset'].tolist() == [0] * 8
+    assert table['element'].tolist() == [0, 1, 2, 3] * 2
+    assert table['value'].tolist()[:3] == [2020, 6, 1]
+    assert table['string_value'].tolist()[3] == 'tag1'
+    # The fourth message fails and is left out
+    assert batches[1].to_pandas()['message'].unique().tolist() == [2]
+
+
+def test_write_parquet(bufr_file, tmp_path):
+    """Tests that every shard is written as a row group."""
+    output = tmp_path / 'feed.parquet'
+    rows = archive.write_parquet(bufr_file, output, workers=2, shard_size=2)
+    assert rows == 16
+    parquet = pq.ParquetFile(output)
+    assert parquet.metadata.num_row_groups == 3
+    df = parquet.read().to_pandas()
+    assert df[df['fxy'] == '004003']['value'].tolist() == [1, 2, 3, 5]
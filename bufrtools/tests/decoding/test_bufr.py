@@ -0,0 +1,245 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for decoding whole BUFR messages."""
+from pathlib import Path
+from unittest.mock import patch
+
+import yaml
+import numpy as np
+import pandas as pd
+import pytest
+
+import bufrtools
+from bufrtools.tables import get_sequence_description
+from bufrtools.encoding import wildlife_computers
+from bufrtools.tables.plan import get_plan
+from bufrtools.decoding.bufr import (decode_bufr, locate_plan, read_subsets, decode_sections,
+                                     decode_subsets)
+from bufrtools.encoding.bufr import encode_bufr
+from bufrtools.util.bitmath import extract_uint
+
+
+def get_example_path(example_name: str) -> Path:
+    """Returns the path to an eample."""
+    root = Path(bufrtools.__file__).parent.parent
+    examples = Path(root, 'examples')
+    filepath = Path(examples, example_name)
+    return filepath
+
+
+@pytest.fixture
+def basic_message():
+    """Fixture for the basic animal tag message and its encoded bytes."""
+    message = yaml.safe_load(get_example_path('basic-atn.yml').read_text('utf-8'))
+    context = {}
+    encode_bufr(message, context)
+    return message, context['buf'].read()
+
+
+def test_decode_sections(basic_message):
+    """Tests that the sections surrounding the data are decoded with the encoder's keys."""
+    message, data = basic_message
+    decoded = decode_sections(data)
+    assert decoded['section0'] == {'total_length': 174, 'edition': 4}
+    for key, value in message['section1'].items():
+        assert decoded['section1'][key] == value
+    for key, value in message['section3'].items():
+        assert decoded['section3'][key] == value
+    assert decoded['section4']['offset'] == 39
+
+
+def test_decode_bufr_round_trip(basic_message):
+    """Tests that every element in section 4 decodes back to the encoded value."""
+    message, _ = basic_message
+    message['section3']['descriptors'] = ['301150', '301011', '022043', '201129', '001087',
+                                          '201000', '208004', '001079', '208000']
+    values = [np.nan, 0, 22000, 0, 'ct145', np.nan, 2020, 6, 10, 284.15, np.nan, 7654321,
+              np.nan, np.nan, 'P1', np.nan]
+    records = pd.concat([
+        get_sequence_description('301150'),
+        get_sequence_description('301011'),
+    ]).to_dict(orient='records')
+    records = records + [
+        {'fxy': '022043', 'type': 'numeric', 'bit_len': 15, 'scale': 2, 'offset': 0},
+        {'fxy': '201129', 'type': 'operator', 'bit_len': 0},
+        {'fxy': '001087', 'type': 'numeric', 'bit_len': 23, 'scale': 0, 'offset': 0},
+        {'fxy': '201000', 'type': 'operator', 'bit_len': 0},
+        {'fxy': '208004', 'type': 'operator', 'bit_len': 0},
+        {'fxy': '001079', 'type': 'string', 'bit_len': 64, 'scale': 0, 'offset': 0},
+        {'fxy': '208000', 'type': 'operator', 'bit_len': 0},
+    ]
+    for rec, value in zip(records, values):
+        rec['value'] = value
+    message['section4'] = records
+    context = {}
+    encode_bufr(message, context)
+
+    expected = [rec for rec in records if rec['type'] in ('numeric', 'string') and rec['bit_len']]
+    decoded = list(decode_bufr(memoryview(context['buf'].read())))
+    assert [d['fxy'] for d in decoded] == [rec['fxy'] for rec in expected]
+    assert [d['value'] for d in decoded] == [
+        0, 22000, 0, 'ct145', 2020, 6, 10, 284.15, 7654321, 'P1'
+    ]
+
+
+def test_decode_bufr_wildlife_computers(tmp_path):
+    """Tests that a Wildlife Computers message decodes with every replication expanded."""
+    output = tmp_path / 'profile.bufr'
+    wildlife_computers.encode(get_example_path('profile.csv'),
+                              output,
+                              uuid='58112217efec720cd46e264e',
+                              ptt='160376')
+    decoded = list(decode_bufr(output.read_bytes()))
+    assert decoded[5]['value'] == '58112217efec720cd46e264e'
+    assert decoded[8]['value'] == '160376'
+    # Trajectory replication factor followed by 16 elements for each point
+    trajectory_count = int(decoded[10]['value'])
+    assert trajectory_count == 88
+    profile_factor = decoded[11 + 16 * trajectory_count]
+    assert profile_factor['fxy'] == '031001'
+    assert decoded[-1]['fxy'] == '033050'
+
+
+def test_decode_bufr_is_lazy(tmp_path):
+    """Tests that the first element is yielded before the rest of the subset is decoded."""
+    output = tmp_path / 'profile.bufr'
+    wildlife_computers.encode(get_example_path('profile.csv'),
+                              output,
+                              uuid='58112217efec720cd46e264e',
+                              ptt='160376')
+    elements = decode_bufr(output.read_bytes())
+    with patch('bufrtools.decoding.bufr.extract_uint', wraps=extract_uint) as extract:
+        assert next(elements)['fxy'] == '001125'
+    assert extract.call_count < 10
+
+
+def test_decode_bufr_rejects_other_data():
+    """Tests that data that isn't a BUFR edition 4 message is rejected."""
+    with pytest.raises(ValueError):
+        list(decode_bufr(b'GRIB\x00\x00\x08\x04'))
+
+
+def compressed_subset(identifier: str, temperature: float, levels: list) -> list:
+    """Returns the section 4 records of one subset for the compressed message tests."""
+    records = get_sequence_description('301011').to_dict(orient='records')
+    for rec, value in zip(records, [np.nan, 2020, 6, 10]):
+        rec['value'] = value
+    records += [
+        {'fxy': '001079', 'type': 'string', 'bit_len': 64, 'value': identifier},
+        {'fxy': '022043', 'type': 'numeric', 'bit_len': 15, 'scale': 2, 'offset': 0,
+         'value': temperature},
+        {'fxy': '101000', 'type': 'replication', 'bit_len': 0},
+        {'fxy': '031001', 'type': 'numeric', 'bit_len': 8, 'scale': 0, 'offset': 0,
+         'value': len(levels)},
+    ]
+    for level in levels:
+        records.append({'fxy': '022043', 'type': 'numeric', 'bit_len': 15, 'scale': 2,
+                        'offset': 0, 'value': level})
+    return records
+
+
+def test_decode_bufr_compressed(basic_message):
+    """Tests that compressed subsets decode back to the values of every subset."""
+    message, _ = basic_message
+    message['section3'].update({
+        'number_of_subsets': 3,
+        'compressed_flag': True,
+        'descriptors': ['301011', '001079', '022043', '101000', '031001', '022043'],
+    })
+    message['section4'] = [
+        compressed_subset('A', 284.15, [1.0, 2.0]),
+        compressed_subset('BB', np.nan, [1.0, np.nan]),
+        compressed_subset('A', 290.0, [np.nan, np.nan]),
+    ]
+    context = {}
+    encode_bufr(message, context)
+    data = context['buf'].read()
+    assert decode_sections(data)['section3']['compressed_flag']
+
+    decoded = list(decode_bufr(data))
+    assert len(decoded) == 3 * 8
+    values = [[d['value'] for d in decoded[i * 8:(i + 1) * 8]] for i in range(3)]
+    assert values[0] == [2020, 6, 10, 'A', 284.15, 2, 1.0, 2.0]
+    assert values[1] == [2020, 6, 10, 'BB', None, 2, 1.0, None]
+    assert values[2] == [2020, 6, 10, 'A', 290.0, 2, None, None]
+
+
+def test_read_subsets(basic_message):
+    """Tests that reading values matches the values of the decoded elements."""
+    message, _ = basic_message
+    message['section3']['descriptors'] = ['301011', '001079', '022043', '101000', '031001',
+                                          '022043']
+    message['section4'] = compressed_subset('A', 284.15, [1.0, np.nan])
+    context = {}
+    encode_bufr(message, context)
+    uncompressed = context['buf'].read()
+    message['section3'].update({'number_of_subsets': 2, 'compressed_flag': True})
+    message['section4'] = [
+        compressed_subset('A', 284.15, [1.0, 2.0]),
+        compressed_subset('BB', np.nan, [1.0, np.nan]),
+    ]
+    context = {}
+    encode_bufr(message, context)
+    for encoded in (uncompressed, context['buf'].read()):
+        expected = [[(d['fxy'], d['value']) for d in subset] for subset in decode_subsets(encoded)]
+        assert list(read_subsets(encoded)) == expected
+
+
+def test_locate_plan():
+    """Tests that the located fields of a profile are the elements read from it, in order."""
+    message = wildlife_computers.get_message(get_example_path('profile.csv'),
+                                             uuid='58112217efec720cd46e264e', ptt='160376')
+    context = {}
+    encode_bufr(message, context)
+    data = memoryview(context['buf'].getvalue())
+    sections = decode_sections(data)
+    section4 = sections['section4']
+    body = data[section4['offset'] + 4:section4['offset'] + section4['length']]
+    plan = get_plan(sections['section3']['descriptors'])
+    layout = locate_plan(body, plan, 1)
+    elements = next(read_subsets(data))
+    assert [plan.steps[i].fxy for i in layout.steps] == [fxy for fxy, _ in elements]
+    assert layout.subsets.tolist() == [0, len(elements)]
+    assert (np.diff(layout.bit_offsets) == [plan.steps[i].bit_len for i in layout.steps[:-1]]).all()
+
+
+def test_locate_plan_rejects_references():
+    """Tests that plans with the new reference values of 2-03 aren't located."""
+    plan = get_plan(['203010', '012101', '203255', '012101', '203000', '012101'])
+    with pytest.raises(ValueError, match='new reference value of 012101'):
+        locate_plan(bytes(16), plan, 1)
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_encode_and_read_values(basic_message, compressed):
+    """Tests that values encoded with a compiled plan decode back, operators included."""
+    message, _ = basic_message
+    descriptors = ['301011', '203010', '012101', '203255', '012101', '203000', '204003', '031021',
+                   '012101', '204000', '205004', '001079', '103000', '031001', '102002', '007062',
+                   '022043']
+    subsets = [
+        [2020, 6, 10, -5, 273.15, 2, 5, 280.0, 'ABCD', 'tag', 1, 1.5, 284.15, 2.5, 285.0],
+        [2020, 6, 10, -5, 250.0, 2, None, np.nan, 'ABCD', None, 1, 1.5, np.nan, 3.5, 290.0],
+    ]
+    message['section3'].update({
+        'number_of_subsets': 2,
+        'compressed_flag': compressed,
+        'descriptors': descriptors,
+    })
+    message['section4'] = subsets if compressed else subsets[0] + subsets[1]
+    context = {}
+    encode_bufr(message, context)
+    data = context['buf'].read()
+    decoded = list(read_subsets(data))
+    assert [fxy for fxy, _ in decoded[0]] == [
+        '004001', '004002', '004003', '012101', '012101', '031021', '204003', '012101', '205004',
+        '001079', '031001', '007062', '022043', '007062', '022043'
+    ]
+    for values, expected in zip(decoded, subsets):
+        expected = [None if value is np.nan else value for value in expected]
+        assert [value for _, value in values] == pytest.approx(expected)
+
+    # The element dictionaries are decoded from the same plan
+    elements = list(decode_subsets(data))
+    assert [[(d['fxy'], d['value']) for d in subset] for subset in elements] == decoded
+    assert list(decode_bufr(data)) == [d for subset in elements for d in subset]
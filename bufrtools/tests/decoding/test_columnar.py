@@ -0,0 +1,130 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for decoding BUFR messages into columns."""
+import copy
+from pathlib import Path
+
+import yaml
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import bufrtools
+from bufrtools.tables import get_code_table_figure, get_sequence_template
+from bufrtools.decoding import columnar
+from bufrtools.encoding.bufr import encode_bufr
+from bufrtools.encoding.stream import MessageWriter
+
+
+def get_message(day: int, levels: list, compressed: bool = False) -> dict:
+    """Returns a message of two subsets with a date, an identifier and replicated levels."""
+    root = Path(bufrtools.__file__).parent.parent
+    message = yaml.safe_load((root / 'examples' / 'basic-atn.yml').read_text('utf-8'))
+    message['section3'].update({
+        'number_of_subsets': 2,
+        'compressed_flag': compressed,
+        'descriptors': ['301011', '001079', '101000', '031001', '007062'],
+    })
+    template = get_sequence_template('301011')
+    subsets = []
+    for identifier in ('tag', 'other'):
+        records = template.records(values=[None, 2020, 6, day])
+        records += [
+            {'fxy': '001079', 'type': 'string', 'bit_len': 64, 'value': identifier},
+            {'fxy': '101000', 'type': 'replication', 'bit_len': 0},
+            {'fxy': '031001', 'type': 'numeric', 'bit_len': 8, 'scale': 0, 'offset': 0,
+             'value': len(levels)},
+        ]
+        for level in levels:
+            records.append({'fxy': '007062', 'type': 'numeric', 'bit_len': 17, 'scale': 1,
+                            'offset': 0, 'value': level})
+        subsets.append(records)
+    message['section4'] = subsets if compressed else subsets[0]
+    if not compressed:
+        message['section3']['number_of_subsets'] = 1
+    return message
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_column_sink(compressed):
+    """Tests that every subset is a row with a list of values per descriptor."""
+    sink = columnar.ColumnSink()
+    for day, levels in ((1, [1.5, 2.0]), (2, [np.nan])):
+        context = {}
+        encode_bufr(get_message(day, levels, compressed), context)
+        assert sink.add_message(context['buf'].read()) == (2 if compressed else 1)
+    table = sink.to_table()
+    assert table.column_names == ['message', 'subset', '004001', '004002', '004003', '001079',
+                                  '031001', '007062']
+    rows = 4 if compressed else 2
+    assert table.num_rows == rows == sink.num_rows
+    columns = table.to_pydict()
+    assert columns['message'] == ([0, 0, 1, 1] if compressed else [0, 1])
+    assert columns['004003'] == ([[1], [1], [2], [2]] if compressed else [[1], [2]])
+    assert columns['007062'][0] == [1.5, 2.0]
+    assert columns['007062'][-1] == [None]
+    if compressed:
+        assert columns['001079'] == [['tag'], ['other'], ['tag'], ['other']]
+
+
+def test_column_sink_operators():
+    """Tests that associated fields are numeric columns and character data string columns."""
+    message = get_message(1, [])
+    message['section3']['descriptors'] = ['301011', '204003', '031021', '012101', '204000',
+                                          '205004']
+    message['section4'] = [2020, 6, 10, 2, 5, 280.0, 'ABCD']
+    context = {}
+    encode_bufr(message, context)
+    sink = columnar.ColumnSink()
+    assert sink.add_message(context['buf'].read()) == 1
+    table = sink.to_table()
+    assert table.column_names == ['message', 'subset', '004001', '004002', '004003', '031021',
+                                  '204003', '012101', '205004']
+    assert table.schema.field('204003').type == pa.list_(pa.float64())
+    assert table.schema.field('205004').type == pa.list_(pa.string())
+    columns = table.to_pydict()
+    assert columns['204003'] == [[5.0]]
+    assert columns['012101'] == [[280.0]]
+    assert columns['205004'] == [['ABCD']]
+
+
+def test_read_table(tmp_path):
+    """Tests that a file is read into a table, leaving out the messages that fail."""
+    path = tmp_path / 'feed.bufr'
+    with open(path, 'wb') as f:
+        writer = MessageWriter(f)
+        for day in range(1, 4):
+            message = get_message(day, [float(day)] * day)
+            if day == 2:
+                # Section 3 describes more data than section 4 holds
+                message['section3']['descriptors'] = ['301011'] * 20
+            writer.write(copy.deepcopy(message))
+    table = columnar.read_table(path)
+    assert table.column('message').to_pylist() == [0, 2]
+    assert table.column('007062').to_pylist() == [[1.0], [3.0, 3.0, 3.0]]
+
+    output = tmp_path / 'feed.parquet'
+    sink = columnar.ColumnSink()
+    sink.add_message(path.read_bytes())
+    sink.write_parquet(output)
+    assert pq.read_table(output).column('031001').to_pylist() == [[1.0]]
+
+
+def test_annotate_code_tables():
+    """Tests that code table columns get a list column of their entry names."""
+    table = pa.table({
+        'message': pa.array([0, 0], type=pa.int32()),
+        '033050': pa.array([[1.0, None], [12.0]], type=pa.list_(pa.float64())),
+    })
+    table = columnar.annotate_code_tables(table.slice(0))
+    assert table.column_names == ['message', '033050', '033050_name']
+    assert table.column('033050_name').to_pylist() == [
+        ['Correct value (all checks passed)', None],
+        [get_code_table_figure('033050', 12)['EntryName_en']],
+    ]
+    # Slices keep the names of their own rows
+    table = columnar.annotate_code_tables(table.drop(['033050_name']).slice(1))
+    assert table.column('033050_name').to_pylist() == [
+        [get_code_table_figure('033050', 12)['EntryName_en']],
+    ]
@@ -0,0 +1,89 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for scanning files of concatenated BUFR messages."""
+import copy
+from datetime import datetime
+from pathlib import Path
+
+import yaml
+import pytest
+
+import bufrtools
+from bufrtools.tables import get_sequence_template
+from bufrtools.decoding import scan
+from bufrtools.encoding.stream import MessageWriter
+
+
+@pytest.fixture
+def bufr_file(tmp_path):
+    """Fixture for a file of three messages with GTS envelopes and junk between them."""
+    root = Path(bufrtools.__file__).parent.parent
+    message = yaml.safe_load((root / 'examples' / 'basic-atn.yml').read_text('utf-8'))
+    message['section3']['descriptors'] = ['301011']
+    message['section4'] = get_sequence_template('301011').records(values=[None, 2020, 6, 10])
+    path = tmp_path / 'feed.bufr'
+    with open(path, 'wb') as f:
+        f.write(b'BUFR junk that is not a message')
+        writer = MessageWriter(f, heading='IOZX01 KWBC 101200')
+        for category in (31, 1, 2):
+            msg = copy.deepcopy(message)
+            msg['section1']['data_category'] = category
+            writer.write(msg)
+    return path
+
+
+def test_build_index(bufr_file):
+    """Tests that every message is found and summarized."""
+    entries = scan.build_index(str(bufr_file))
+    assert [entry.data_category for entry in entries] == [31, 1, 2]
+    assert [entry.length for entry in entries] == [50, 50, 50]
+    assert entries[0].number_of_subsets == 1
+    assert entries[0].date == datetime(2020, 6, 10, 15, 0, 0)
+    data = bufr_file.read_bytes()
+    for entry in entries:
+        assert data[entry.offset:entry.offset + 4] == b'BUFR'
+        assert data[entry.offset + entry.length - 4:entry.offset + entry.length] == b'7777'
+
+
+def test_saved_index(bufr_file, monkeypatch):
+    """Tests that the index is saved next to the file and reused until the file changes."""
+    entries = scan.build_index(str(bufr_file))
+    assert Path(f'{bufr_file}.bufridx').exists()
+
+    def fail(data):
+        raise AssertionError('File was scanned again')
+
+    monkeypatch.setattr(scan, 'scan_messages', fail)
+    assert scan.build_index(str(bufr_file)) == entries
+
+    monkeypatch.undo()
+    with open(bufr_file, 'ab') as f:
+        f.write(bufr_file.read_bytes()[entries[0].offset:entries[0].offset + entries[0].length])
+    assert len(scan.build_index(str(bufr_file))) == 4
+
+
+def test_index_not_saved(bufr_file, monkeypatch, caplog):
+    """Tests that a file is indexed even where its index can't be saved."""
+    monkeypatch.setattr(scan, 'get_index_path', lambda path: f'{path}.missing/index')
+    assert len(scan.build_index(str(bufr_file))) == 3
+    assert 'Unable to save the index' in caplog.text
+
+
+def test_scan_memoryview(bufr_file):
+    """Tests that messages are found in a view of part of a buffer."""
+    data = bufr_file.read_bytes()
+    entries = scan.build_index(str(bufr_file))
+    start = entries[0].offset + 1
+    found = list(scan.scan_messages(memoryview(data)[start:]))
+    assert [entry.offset + start for entry in found] == [entry.offset for entry in entries[1:]]
+
+
+def test_bufr_file_random_access(bufr_file):
+    """Tests that a single message is decoded from the memory-mapped file."""
+    with scan.BufrFile(bufr_file) as bufr:
+        assert len(bufr) == 3
+        with bufr.message(2) as data:
+            assert data[:4] == b'BUFR'
+            assert data[18] == 2
+        decoded = bufr.decode(1)
+    assert [element['value'] for element in decoded] == [2020, 6, 10]
@@ -0,0 +1,77 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for batch encoding."""
+import shutil
+from pathlib import Path
+
+import pytest
+
+import bufrtools
+from bufrtools.encoding import batch
+
+
+def get_example_path(example_name: str) -> Path:
+    """Returns the path to an example."""
+    return Path(bufrtools.__file__).parent.parent / 'examples' / example_name
+
+
+def test_collect_jobs(tmp_path):
+    """Tests that inputs are collected from directories, glob patterns and manifests."""
+    data = tmp_path / 'data'
+    data.mkdir()
+    for name in ['a.csv', 'b.parquet', 'notes.txt']:
+        (data / name).touch()
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('input,output,uuid,ptt\ndata/c.nc,c-out.bufr,c-uuid,\n')
+    output_dir = tmp_path / 'out'
+
+    jobs = batch.collect_jobs([str(data)], output_dir, manifest=manifest, ptt='1')
+    assert [job.input.name for job in jobs] == ['a.csv', 'b.parquet', 'c.nc']
+    assert jobs[0].output == output_dir / 'a.bufr'
+    assert jobs[-1] == batch.Job(data / 'c.nc', output_dir / 'c-out.bufr', 'c-uuid', '1')
+
+    jobs = batch.collect_jobs([str(data / '*.parquet')], output_dir)
+    assert [job.input.name for job in jobs] == ['b.parquet']
+
+
+def test_collect_jobs_mirrors_glob_paths(tmp_path):
+    """Tests that inputs sharing a name are written to the subdirectories they were found in."""
+    for deployment in ['x', 'y']:
+        (tmp_path / deployment).mkdir()
+        (tmp_path / deployment / 'profile.nc').touch()
+    output_dir = tmp_path / 'out'
+    jobs = batch.collect_jobs([str(tmp_path / '**' / '*.nc')], output_dir)
+    assert [job.output for job in jobs] == [
+        output_dir / 'x' / 'profile.bufr',
+        output_dir / 'y' / 'profile.bufr',
+    ]
+
+    # Inputs that would overwrite each other are rejected before anything is encoded
+    (tmp_path / 'x' / 'profile.csv').touch()
+    with pytest.raises(ValueError, match='would both be written to'):
+        batch.collect_jobs([str(tmp_path / 'x')], output_dir)
+
+
+def test_run_batch(tmp_path):
+    """Tests that datasets are encoded in worker processes and failures are reported."""
+    shutil.copy(get_example_path('profile.csv'), tmp_path / 'profile.csv')
+    shutil.copy(get_example_path('profile.parquet'), tmp_path / 'profile2.parquet')
+    (tmp_path / 'broken.csv').write_text('not,a\nprofile,dataset\n')
+    output_dir = tmp_path / 'out'
+    jobs = batch.collect_jobs([str(tmp_path)], output_dir, uuid='58112217efec720cd46e264e',
+                              ptt='160376')
+
+    results = batch.run_batch(jobs, workers=2)
+    assert [result.input.name for result in results] == [job.input.name for job in jobs]
+    broken, csv_result, parquet_result = results
+    # The error of the loader itself is reported
+    assert broken.error.startswith('AttributeError')
+    assert not broken.output.exists()
+    for result in (csv_result, parquet_result):
+        assert result.error is None
+        assert result.size == 28159
+        assert result.output.read_bytes()[:4] == b'BUFR'
+    # Only the outputs are left behind, no temporary files
+    assert sorted(p.name for p in output_dir.iterdir()) == ['profile.bufr', 'profile2.bufr']
+    summary = batch.format_summary(results, 1.0)
+    assert '2 encoded, 1 failed' in summary
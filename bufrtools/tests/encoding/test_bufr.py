@@ -0,0 +1,112 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for the common BUFR encoding functions."""
+import io
+
+import numpy as np
+import pytest
+
+from bufrtools.encoding import bufr
+from bufrtools.util.bitmath import BitWriter
+
+
+def encode_records(records: list) -> bytes:
+    """Returns the section 4 bytes for the given records."""
+    context = {'buf': io.BytesIO()}
+    bufr.encode_section4({'section4': records}, context)
+    return context['buf'].getvalue()
+
+
+def test_encode_columns_matches_records():
+    """Tests that the vectorized column path produces the same bits as the per-record path."""
+    elements = [
+        {'fxy': '007062', 'type': 'numeric', 'bit_len': 17, 'scale': 1, 'offset': 0},
+        {'fxy': '008080', 'type': 'numeric', 'bit_len': 6, 'scale': 0, 'offset': 0},
+        {'fxy': '022043', 'type': 'numeric', 'bit_len': 19, 'scale': 3, 'offset': 0},
+        {'fxy': '005001', 'type': 'numeric', 'bit_len': 25, 'scale': 5, 'offset': -9000000},
+    ]
+    depth = np.array([0.0, 10.25, 2000.5, np.nan])
+    temperature = np.array([284.15, np.nan, 275.001, 300.0])
+    lat = np.array([-89.99999, 21.6038, 0.0, np.nan])
+    header = {'fxy': '001023', 'type': 'numeric', 'bit_len': 3, 'scale': 0, 'offset': 0,
+              'value': 5}
+
+    records = [header]
+    for i in range(len(depth)):
+        for element, value in zip(elements, [depth[i], 13, temperature[i], lat[i]]):
+            records.append({**element, 'value': value})
+
+    layout = bufr.compile_layout(elements)
+    columns = [{
+        'fxy': '306035',
+        'type': 'columns',
+        'layout': layout,
+        'value': [depth, 13, temperature, lat],
+    }]
+    assert encode_records([header] + columns) == encode_records(records)
+
+
+def test_scale_columns_missing_values():
+    """Tests that NaN values are encoded as all ones without scale or offset."""
+    layout = bufr.compile_layout([
+        {'fxy': '022043', 'type': 'numeric', 'bit_len': 19, 'scale': 3, 'offset': 0},
+        {'fxy': '008080', 'type': 'numeric', 'bit_len': 6, 'scale': 0, 'offset': 0},
+    ])
+    ints = bufr.scale_columns(layout, [np.array([np.nan, 1.5]), np.nan])
+    np.testing.assert_array_equal(ints, [[0x7ffff, 0x3f], [1500, 0x3f]])
+
+
+def test_compressed_section4():
+    """Tests the reference, increment width and increments written for compressed elements."""
+    writer = BitWriter()
+    bufr.pack_compressed_numeric(writer, [1.5, np.nan, 1.25, 1.5], 15, 2, 0)
+    # Reference 125, increments need 5 bits because all ones marks the missing subset
+    expected = BitWriter()
+    expected.write_uint(125, 15)
+    expected.write_uint(5, 6)
+    for increment in [25, 31, 0, 25]:
+        expected.write_uint(increment, 5)
+    assert writer.getvalue() == expected.getvalue()
+
+    element = {'fxy': '022043', 'type': 'numeric', 'bit_len': 15, 'scale': 2, 'offset': 0}
+    factor = {'fxy': '031001', 'type': 'numeric', 'bit_len': 8, 'scale': 0, 'offset': 0}
+    message = {
+        'section3': {'number_of_subsets': 2, 'compressed_flag': True},
+        'section4': [
+            [{**factor, 'value': 1}, {**element, 'value': 280.0}],
+            [{**factor, 'value': 2}, {**element, 'value': 280.0}, {**element, 'value': 281.0}],
+        ],
+    }
+    with pytest.raises(ValueError):
+        bufr.encode_compressed_section4(message, {'buf': io.BytesIO()})
+
+
+@pytest.mark.parametrize('bit_offset', [0, 3])
+def test_pack_ascii_array(bit_offset):
+    """Tests that an array of strings packs to the same bits as packing the strings one by one."""
+    values = ['ct145-933-BAT2-18', 'short', None, 'a-profile-id-much-longer-than-the-field']
+    expected = BitWriter()
+    expected.write_uint(5, bit_offset)
+    for value in values:
+        if value is None:
+            expected.write_uint(0xffffffff, 32)
+        else:
+            bufr.pack_ascii(expected, value, 32)
+    writer = BitWriter()
+    writer.write_uint(5, bit_offset)
+    bufr.pack_ascii_array(writer, values, 32)
+    assert writer.getvalue() == expected.getvalue()
+
+
+def test_write_ascii():
+    """Tests that strings are right-justified and truncated on and off byte boundaries."""
+    buf = io.BytesIO(bytes(6))
+    bufr.write_ascii(buf, 'ab', 8, 24)
+    assert buf.getvalue() == b'\x00 ab\x00\x00'
+    bufr.write_ascii(buf, 'abcdef', 8, 24)
+    assert buf.getvalue() == b'\x00abc\x00\x00'
+
+    buf = io.BytesIO(b'\xff' + bytes(5))
+    bufr.write_ascii(buf, 'A', 4, 8)
+    # The leading bits of the first byte are kept, 'A' is 0x41
+    assert buf.getvalue()[:2] == b'\xf4\x10'
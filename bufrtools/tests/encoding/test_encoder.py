@@ -0,0 +1,91 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for the reusable encoder."""
+import io
+import socket
+from pathlib import Path
+from datetime import datetime
+
+import yaml
+import pytest
+
+import bufrtools
+from bufrtools.encoding.stream import MessageWriter
+from bufrtools.encoding.encoder import Encoder
+
+
+@pytest.fixture
+def message():
+    """Fixture for the basic animal tag message."""
+    root = Path(bufrtools.__file__).parent.parent
+    return yaml.safe_load((root / 'examples' / 'basic-atn.yml').read_text('utf-8'))
+
+
+def write_message(message: dict) -> bytes:
+    """Returns the message as written by the streaming writer."""
+    buf = io.BytesIO()
+    MessageWriter(buf).write(message)
+    return buf.getvalue()
+
+
+def test_encoder_matches_writer(message):
+    """Tests that messages encoded with a reused buffer match messages encoded from scratch."""
+    section3 = message['section3']
+    encoder = Encoder(section3['descriptors'], message['section1'], section3['observed_flag'],
+                      section3['compressed_flag'])
+    expected = write_message(message)
+    assert encoder.encode(message['section4']) == expected
+
+    # Values are encoded with the plan of the descriptors, and a smaller message after a larger one
+    # doesn't pick up anything left in the buffer
+    values = {
+        'section1': message['section1'],
+        'section3': {**section3, 'descriptors': ['301011', '101000', '031001', '022043'],
+                     'number_of_subsets': 2},
+        'section4': [2020, 6, 10, 3, 281.5, 282.5, 283.5] + [2021, 7, 11, 1, 284.5],
+    }
+    values_encoder = Encoder(['301011', '101000', '031001', '022043'], message['section1'])
+    assert values_encoder.encode(values['section4'], 2) == write_message(values)
+    values = {**values, 'section3': {**values['section3'], 'number_of_subsets': 1},
+              'section4': [2021, 7, 11, 0]}
+    assert values_encoder.encode(values['section4']) == write_message(values)
+
+    # The typical time is patched into the section 1 template
+    timestamp = datetime(2021, 3, 4, 5, 6, 7)
+    section1 = {**message['section1'], 'year': 2021, 'month': 3, 'day': 4, 'hour': 5,
+                'minute': 6, 'second': 7}
+    assert (encoder.encode(message['section4'], timestamp=timestamp) ==
+            write_message({**message, 'section1': section1}))
+
+
+def test_encoder_compressed_and_sockets():
+    """Tests compressed messages of several subsets and writing them to a socket."""
+    section1 = yaml.safe_load("""
+        originating_centre: 177
+        sub_centre: 0
+        data_category: 31
+        sub_category: 4
+        local_category: 0
+        master_table_version: 39
+        local_table_version: 255
+        year: 2020
+        month: 6
+        day: 10
+        hour: 2
+        minute: 3
+        second: 4
+        seq_no: 0
+    """)
+    descriptors = ['301011', '022043']
+    section4 = [[2020, 6, 10, 281.5], [2020, 6, 11, 282.5], [2020, 6, 12, None]]
+    encoder = Encoder(descriptors, section1, compressed=True)
+    expected = write_message({
+        'section1': section1,
+        'section3': {'number_of_subsets': 3, 'observed_flag': True, 'compressed_flag': True,
+                     'descriptors': descriptors},
+        'section4': section4,
+    })
+    left, right = socket.socketpair()
+    with left, right:
+        assert encoder.write(left, section4, 3) == len(expected)
+        assert right.recv(len(expected), socket.MSG_WAITALL) == expected
@@ -0,0 +1,137 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for the encoding service."""
+import asyncio
+import threading
+from pathlib import Path
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+
+import bufrtools
+from bufrtools.encoding import service, wildlife_computers
+
+
+def get_example_path(example_name: str) -> Path:
+    """Returns the path to an example."""
+    return Path(bufrtools.__file__).parent.parent / 'examples' / example_name
+
+
+async def send(reader: asyncio.StreamReader,
+               writer: asyncio.StreamWriter,
+               method: str,
+               target: str,
+               body: bytes = b''):
+    """Sends a request on the connection and returns the status code, headers and body."""
+    writer.write(f'{method} {target} HTTP/1.1\r\nHost: localhost\r\n'
+                 f'Content-Length: {len(body)}\r\n\r\n'.encode('latin-1') + body)
+    await writer.drain()
+    return await read_response(reader)
+
+
+async def read_response(reader: asyncio.StreamReader):
+    """Returns the status code, headers and body of the next response on the connection."""
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.lower()] = value.strip()
+    return status, headers, await reader.readexactly(int(headers['content-length']))
+
+
+def test_encode_service(tmp_path):
+    """Tests that datasets sent over a Unix socket are encoded by the worker processes."""
+    payload = get_example_path('profile.parquet').read_bytes()
+    socket_path = str(tmp_path / 'service.sock')
+
+    async def run():
+        encoder = service.EncodeService(workers=1)
+        await encoder.start(path=socket_path)
+        try:
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            assert await send(reader, writer, 'GET', '/health') == (200, {
+                'content-type': 'text/plain; charset=utf-8',
+                'content-length': '2',
+            }, b'ok')
+            # The connection is kept alive between requests
+            target = '/encode?uuid=58112217efec720cd46e264e&ptt=160376'
+            status, headers, body = await send(reader, writer, 'POST', target, payload)
+            assert status == 200
+            assert headers['content-type'] == 'application/octet-stream'
+            assert len(body) == 28159
+            assert body[:4] == b'BUFR' and body[-4:] == b'7777'
+
+            status, _, body = await send(reader, writer, 'POST', '/encode', b'not,a\n1,2\n')
+            assert status == 422
+            assert body.startswith(b'AttributeError')
+            assert (await send(reader, writer, 'GET', '/encode'))[0] == 405
+            assert (await send(reader, writer, 'GET', '/missing'))[0] == 404
+            writer.close()
+
+            # The connection is closed after a malformed request
+            reader, writer = await asyncio.open_unix_connection(socket_path)
+            writer.write(b'POST /encode HTTP/1.1\r\nContent-Length: -5\r\n\r\n')
+            status, headers, body = await read_response(reader)
+            assert (status, body) == (400, b'Malformed Content-Length')
+            assert headers['connection'] == 'close'
+            assert encoder.pending == 0
+            writer.close()
+        finally:
+            await encoder.close()
+
+    asyncio.run(run())
+
+
+def test_encode_payload_netcdf():
+    """Tests that netCDF payloads encode like the dataset file does."""
+    path = get_example_path('profile.nc')
+    kwargs = {'uuid': '58112217efec720cd46e264e', 'ptt': '160376'}
+    data = service.encode_payload(path.read_bytes(), **kwargs)
+    expected = wildlife_computers.encode_message(path, **kwargs)
+    # The typical time is the time of encoding
+    assert data[:23] + data[30:] == expected[:23] + expected[30:]
+
+
+def test_encode_service_backpressure():
+    """Tests that requests beyond the pending limit are turned away until a worker frees up."""
+    release = threading.Event()
+
+    def blocking_encode(payload, uuid=None, ptt=None):
+        release.wait(5)
+        return b'BUFR' + payload
+
+    async def run():
+        executor = ThreadPoolExecutor(max_workers=1)
+        encoder = service.EncodeService(workers=1, max_pending=1, executor=executor)
+        server = await encoder.start()
+        port = server.sockets[0].getsockname()[1]
+        try:
+            first = await asyncio.open_connection('127.0.0.1', port)
+            second = await asyncio.open_connection('127.0.0.1', port)
+            pending = asyncio.ensure_future(send(*first, 'POST', '/encode', b'1'))
+            while encoder.pending == 0:
+                await asyncio.sleep(0.01)
+            # The request is turned away without waiting for its body
+            second[1].write(b'POST /encode HTTP/1.1\r\nContent-Length: 1000000\r\n\r\n')
+            status, headers, _ = await asyncio.wait_for(read_response(second[0]), 5)
+            assert status == 503
+            assert headers['retry-after'] == '1'
+            assert headers['connection'] == 'close'
+            assert await second[0].read() == b''
+            # Requests without a body are still answered
+            third = await asyncio.open_connection('127.0.0.1', port)
+            assert (await send(*third, 'GET', '/health'))[::2] == (200, b'ok')
+            release.set()
+            assert (await pending)[::2] == (200, b'BUFR1')
+            assert (await send(*third, 'POST', '/encode', b'3'))[::2] == (200, b'BUFR3')
+            first[1].close()
+            second[1].close()
+            third[1].close()
+        finally:
+            await encoder.close()
+            executor.shutdown()
+
+    with patch('bufrtools.encoding.service.encode_payload', blocking_encode):
+        asyncio.run(run())
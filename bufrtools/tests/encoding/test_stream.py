@@ -0,0 +1,61 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for the streaming message writer."""
+import io
+import socket
+from pathlib import Path
+
+import yaml
+import pytest
+
+import bufrtools
+from bufrtools.decoding.bufr import decode_sections
+from bufrtools.encoding.bufr import encode_bufr
+from bufrtools.encoding.stream import MessageWriter
+
+
+@pytest.fixture
+def message():
+    """Fixture for the basic animal tag message."""
+    root = Path(bufrtools.__file__).parent.parent
+    return yaml.safe_load((root / 'examples' / 'basic-atn.yml').read_text('utf-8'))
+
+
+def test_writer_matches_encode_bufr(message):
+    """Tests that consecutive messages are written exactly as encode_bufr encodes them."""
+    context = {}
+    encode_bufr(message, context)
+    expected = context['buf'].read()
+
+    buf = io.BytesIO()
+    writer = MessageWriter(buf)
+    assert writer.write(message) == len(expected)
+    writer.write(message)
+    assert buf.getvalue() == expected * 2
+    assert writer.messages_written == 2
+    assert decode_sections(buf.getvalue()[len(expected):])['section0']['total_length'] == 174
+
+
+def test_writer_bulletin_headers(message):
+    """Tests the GTS bulletin envelope and the FTP file format length prefix."""
+    buf = io.BytesIO()
+    writer = MessageWriter(buf, heading='IOZX01 KWBC 101200', length_prefix=True,
+                           sequence_number=999)
+    first = writer.write(message)
+    writer.write(message, heading='IOZX02 KWBC 101200')
+    data = buf.getvalue()
+    assert data[:10] == f'{first - 10:08d}00'.encode('ascii')
+    assert data[10:].startswith(b'\x01\r\r\n999\r\r\nIOZX01 KWBC 101200\r\r\nBUFR')
+    assert data[:first].endswith(b'7777\r\r\n\x03')
+    assert data[first + 10:].startswith(b'\x01\r\r\n000\r\r\nIOZX02 KWBC 101200\r\r\nBUFR')
+
+
+def test_writer_socket_sink(message):
+    """Tests that messages can be streamed to a socket."""
+    sender, receiver = socket.socketpair()
+    with sender, receiver:
+        written = MessageWriter(sender).write(message)
+        data = b''
+        while len(data) < written:
+            data += receiver.recv(4096)
+    assert decode_sections(data)['section0']['total_length'] == written
@@ -0,0 +1,159 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for verifying encoded messages against the messages they were encoded from."""
+import io
+import copy
+from pathlib import Path
+from unittest.mock import patch
+
+import yaml
+import numpy as np
+import pytest
+
+import bufrtools
+from bufrtools.encoding import wildlife_computers
+from bufrtools.encoding.bufr import encode_bufr
+from bufrtools.encoding.stream import MessageWriter
+from bufrtools.encoding.verify import (BATCH_ROWS, Mismatch, verify_message, verify_elements,
+                                       format_mismatches)
+
+
+def get_example_path(example_name: str) -> Path:
+    """Returns the path to an example."""
+    root = Path(bufrtools.__file__).parent.parent
+    return Path(root, 'examples', example_name)
+
+
+def get_values_message(subsets: list, compressed: bool, references: bool) -> dict:
+    """Returns a message of two subsets given as values, with new reference values if set."""
+    message = yaml.safe_load(get_example_path('basic-atn.yml').read_text('utf-8'))
+    descriptors = ['301011', '204003', '031021', '012101', '204000', '001079', '103000', '031001',
+                   '102002', '007062', '022043']
+    if references:
+        descriptors[1:1] = ['203010', '012101', '203255', '012101', '203000']
+        subsets = [subset[:3] + [-5, 273.15] + subset[3:] for subset in subsets]
+    message['section3'].update({
+        'number_of_subsets': 2,
+        'compressed_flag': compressed,
+        'descriptors': descriptors,
+    })
+    message['section4'] = subsets if compressed else subsets[0] + subsets[1]
+    return message
+
+
+def encode(message: dict) -> bytes:
+    """Returns the encoded message."""
+    context = {}
+    encode_bufr(copy.deepcopy(message), context)
+    return context['buf'].getvalue()
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+@pytest.mark.parametrize('references', [False, True])
+def test_verify_values(compressed, references):
+    """Tests that encoded values verify and that changed values are reported."""
+    subsets = [
+        [2020, 6, 10, 2, 5, 280.0, 'tag', 1, 1.5, 284.15, 2.5, 285.0],
+        [2020, 6, 10, 2, None, np.nan, None, 1, 1.5, np.nan, 3.5, 290.0],
+    ]
+    message = get_values_message(subsets, compressed, references)
+    data = encode(message)
+    assert verify_message(message, data) == []
+
+    changed = get_values_message(copy.deepcopy(subsets), compressed, references)
+    values = changed['section4'][1] if compressed else changed['section4']
+    # Within half of the 0.01 K of the scale of 022043, but not of the 0.1 m of 007062
+    values[-1] += 0.004
+    values[-2] += 0.1
+    values[-3] = 284.25
+    mismatches = verify_message(changed, data)
+    assert [(m.fxy, m.decoded) for m in mismatches] == [
+        ('022043', None),
+        ('007062', pytest.approx(3.5)),
+    ]
+    assert all(m.subset == 1 for m in mismatches)
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_verify_records(compressed):
+    """Tests that records verify and that strings and values that pack to missing are compared."""
+    message = yaml.safe_load(get_example_path('basic-atn.yml').read_text('utf-8'))
+    records = [
+        {'fxy': fxy, 'type': typename, 'bit_len': bit_len, 'scale': 0, 'offset': 0, 'value': value}
+        for fxy, typename, bit_len, value in [
+            ('004001', 'numeric', 12, 2020),
+            ('004002', 'numeric', 4, 6),
+            ('004003', 'numeric', 6, 63),
+            ('001079', 'string', 64, 'a-very-long-identifier'),
+        ]
+    ]
+    message['section3'].update({
+        'number_of_subsets': 2 if compressed else 1,
+        'compressed_flag': compressed,
+        'descriptors': ['301011', '001079'],
+    })
+    message['section4'] = [records, records] if compressed else records
+    data = encode(message)
+    # 63 days is all ones, the missing value, and the identifier is truncated to 8 characters
+    assert verify_message(message, data) == []
+
+    records[3] = dict(records[3], value='another')
+    mismatches = verify_message(message, data)
+    assert [(m.element, m.expected, m.decoded) for m in mismatches][:1] == [
+        (3, 'another', 'a-very-l')
+    ]
+
+
+def test_verify_structure():
+    """Tests that missing elements and data that can't be decoded are reported."""
+    subsets = [[2020, 6, 10, 2, 5, 280.0, 'tag', 1, 1.5, 284.15, 2.5, 285.0]] * 2
+    message = get_values_message(subsets, False, False)
+    data = encode(message)
+    message['section3']['number_of_subsets'] = 1
+    message['section4'] = subsets[0]
+    mismatches = verify_message(message, data)
+    assert mismatches == [Mismatch(1, 0, '004001', None, '004001')]
+
+    message = yaml.safe_load(get_example_path('basic-atn.yml').read_text('utf-8'))
+    mismatches = verify_message(message, encode(message))
+    assert len(mismatches) == 1
+    assert format_mismatches(mismatches).splitlines()[1].startswith(
+        '  Unable to decode the message: ValueError')
+
+    # Section 3 runs past the end of the message
+    data = bytearray(encode(get_values_message(subsets, False, False)))
+    section3 = 8 + int.from_bytes(data[8:11], 'big')
+    data[section3:section3 + 3] = (200).to_bytes(3, 'big')
+    mismatches = verify_message(message, bytes(data))
+    assert len(mismatches) == 1
+    assert mismatches[0].decoded.startswith('IndexError')
+
+
+def test_verify_wildlife_computers():
+    """Tests that a wildlife computers profile verifies."""
+    message = wildlife_computers.get_message(get_example_path('profile.csv'),
+                                             uuid='58112217efec720cd46e264e', ptt='160376')
+    buf = io.BytesIO()
+    MessageWriter(buf).write(message)
+    assert verify_message(message, buf.getvalue()) == []
+
+
+@pytest.mark.parametrize('batch_rows', [BATCH_ROWS, 2])
+def test_verify_columns(batch_rows):
+    """Tests that changed values of blocks of columns are reported like element by element."""
+    message = wildlife_computers.get_message(get_example_path('profile.csv'),
+                                             uuid='58112217efec720cd46e264e', ptt='160376')
+    buf = io.BytesIO()
+    MessageWriter(buf).write(message)
+    data = buf.getvalue()
+    blocks = [seq for seq in message['section4'] if seq['type'] == 'columns']
+    years = np.array(blocks[0]['value'][1])
+    years[2] += 1
+    blocks[0]['value'][1] = years
+    depths = np.array(blocks[-1]['value'][0], dtype=np.float64)
+    depths[-1] += 1
+    blocks[-1]['value'][0] = depths
+    with patch('bufrtools.encoding.verify.BATCH_ROWS', batch_rows):
+        mismatches = verify_message(message, data)
+    assert [m.fxy for m in mismatches] == ['004001', '007062']
+    assert mismatches == verify_elements(message, data)
@@ -6,12 +6,17 @@ import tempfile
 from pathlib import Path
 from argparse import Namespace
 from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+import pandas as pd
 import pytest
 
 import bufrtools
 from bufrtools import decoding
 from bufrtools.encoding import wildlife_computers
+from bufrtools.encoding.verify import Mismatch
+from bufrtools.decoding.scan import scan_messages
 
 
 def get_example_path(example_name: str) -> Path:
@@ -38,7 +43,10 @@ def test_wildlife_computers_encoding_from_netcdf(parse_args, tempfile_fixture):
         output=Path(tempfile_fixture),
         profile_dataset=get_example_path('profile.nc'),
         uuid=None,
-        ptt=None
+        ptt=None,
+        profile_stats=None,
+        verify=False,
+        profiles_per_message=None
     )
     parse_args.return_value = args
     wildlife_computers.main()
@@ -57,7 +65,10 @@ def test_wildlife_computers_encoding_from_parquet(parse_args, tempfile_fixture):
         output=Path(tempfile_fixture),
         profile_dataset=get_example_path('profile.parquet'),
         uuid='58112217efec720cd46e264e',
-        ptt='160376'
+        ptt='160376',
+        profile_stats=None,
+        verify=False,
+        profiles_per_message=None
     )
     parse_args.return_value = args
     wildlife_computers.main()
@@ -76,7 +87,10 @@ def test_wildlife_computers_encoding_from_csv(parse_args, tempfile_fixture):
         output=Path(tempfile_fixture),
         profile_dataset=get_example_path('profile.csv'),
         uuid='58112217efec720cd46e264e',
-        ptt='160376'
+        ptt='160376',
+        profile_stats=None,
+        verify=False,
+        profiles_per_message=None
     )
     parse_args.return_value = args
     wildlife_computers.main()
@@ -86,3 +100,111 @@ def test_wildlife_computers_encoding_from_csv(parse_args, tempfile_fixture):
         assert file_id == b'BUFR'
         total_size = decoding.parse_unsigned_int(f.read(3), 24)
         assert total_size == 28159
+
+
+@patch('bufrtools.encoding.wildlife_computers.parse_args')
+def test_wildlife_computers_verify(parse_args, tmp_path):
+    """Tests that a verified message is written and a message that doesn't verify isn't."""
+    output = tmp_path / 'profile.bufr'
+    parse_args.return_value = Namespace(
+        output=output,
+        profile_dataset=get_example_path('profile.csv'),
+        uuid='58112217efec720cd46e264e',
+        ptt='160376',
+        profile_stats=None,
+        verify=True,
+        profiles_per_message=None,
+    )
+    assert wildlife_computers.main() == 0
+    assert output.stat().st_size == 28159
+
+    output.unlink()
+    mismatches = [Mismatch(0, 0, '001125', 1, 0)]
+    with patch('bufrtools.encoding.wildlife_computers.verify_message', return_value=mismatches):
+        assert wildlife_computers.main() == 1
+    assert not output.exists()
+
+
+@pytest.mark.parametrize('example', ['profile.nc', 'profile.csv', 'profile.parquet'])
+def test_wildlife_computers_profiles_per_message(example, tmp_path):
+    """Tests that the profiles are streamed into a message for every few profiles."""
+    output = tmp_path / 'profile.bufr'
+    mismatches = wildlife_computers.encode(get_example_path(example), output, verify=True,
+                                           profiles_per_message=50,
+                                           uuid='58112217efec720cd46e264e', ptt='160376')
+    assert mismatches == []
+    messages = list(scan_messages(output.read_bytes()))
+    assert len(messages) == 4
+
+    # With room for every profile the single message is unchanged
+    wildlife_computers.encode(get_example_path(example), output, profiles_per_message=1000,
+                              uuid='58112217efec720cd46e264e', ptt='160376')
+    assert output.stat().st_size == 28159
+
+
+def test_wildlife_computers_encode_message_threads():
+    """Tests that messages encoded on several threads at once aren't mixed up."""
+    path = get_example_path('profile.parquet')
+
+    def encode(_):
+        data = wildlife_computers.encode_message(path, uuid='58112217efec720cd46e264e',
+                                                 ptt='160376')
+        # Blanks the typical time, which is the time the message was encoded
+        return data[:23] + bytes(7) + data[30:]
+
+    expected = encode(None)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        messages = list(executor.map(encode, range(64)))
+    assert len(expected) == 28159
+    assert all(message == expected for message in messages)
+
+
+def test_profile_sequence_groups_interleaved_rows():
+    """Tests that profile rows are grouped by profile in the order the profiles first appear."""
+    df = pd.DataFrame({
+        'profile': ['b', 'a', 'b', 'a', 'b'],
+        'time': pd.to_datetime(['2020-06-10T01:00', '2020-06-10T02:00', '2020-06-10T01:00',
+                                '2020-06-10T02:00', '2020-06-10T01:00']),
+        'lat': [10.0, 11.0, 10.0, 11.0, 10.0],
+        'lon': [-150.0, -151.0, -150.0, -151.0, -150.0],
+        'z': [1.0, 2.0, 3.0, 4.0, 5.0],
+        'temperature': [20.0, 21.0, 22.0, 23.0, 24.0],
+    })
+    sequence = wildlife_computers.get_profile_sequence(df)
+    assert sequence[0]['value'] == 2
+    descriptions = [rec for rec in sequence if rec['fxy'] == '001079']
+    assert [rec['value'] for rec in descriptions] == ['b', 'a']
+    factors = [rec['value'] for rec in sequence if rec['fxy'] == '031002']
+    assert factors == [3, 2]
+    data = [rec['value'] for rec in sequence if rec['type'] == 'columns']
+    np.testing.assert_array_equal(data[0][0], [1.0, 3.0, 5.0])
+    np.testing.assert_allclose(data[1][6], [294.15, 296.15])
+    assert np.isnan(data[1][3]).all()
+
+
+def test_drift_speed():
+    """Tests that drift is zero for stationary segments and for the last position."""
+    positions = pd.DataFrame({
+        'time': pd.to_datetime(['2020-06-10T00:00', '2020-06-10T00:00', '2020-06-10T01:00']),
+        'lon': [-150.0, -150.0, -150.0],
+        'lat': [10.0, 10.0, 10.1],
+    })
+    speed = wildlife_computers.drift_speed(positions)
+    assert speed[0] == 0
+    assert speed[1] == pytest.approx(11131.95 / 3600, rel=1e-3)
+    assert speed[2] == 0
+
+
+def test_netcdf_without_uuid(tmp_path):
+    """Tests that the uuid passed in is used for a netCDF dataset without a uuid attribute."""
+    import netCDF4
+    path = tmp_path / 'profile.nc'
+    path.write_bytes(get_example_path('profile.nc').read_bytes())
+    with netCDF4.Dataset(str(path), 'a') as ds:
+        ds.delncattr('uuid')
+
+    message = next(wildlife_computers.get_messages(path, 1000, uuid='passed-in-uuid', ptt=None))
+    identifiers = [rec['value'] for rec in message['section4'] if rec['fxy'] == '001019']
+    assert identifiers == ['passed-in-uuid']
+    with pytest.raises(ValueError, match='uuid'):
+        next(wildlife_computers.get_messages(path, 1000, uuid=None, ptt=None))
@@ -0,0 +1,45 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for resolving arrays of code figures."""
+import numpy as np
+
+from bufrtools.tables import get_code_table_figure, resolve_code_figures
+from bufrtools.tables.codes import get_code_table_resolver
+
+
+def test_resolve_code_figures():
+    """Tests that figures resolve through single figures and ranges, misses resolve to None."""
+    names = resolve_code_figures('033050', np.array([1, 12, 99, -1]))
+    assert names.tolist() == [
+        'Correct value (all checks passed)',
+        get_code_table_figure('033050', 12)['EntryName_en'],
+        None,
+        None,
+    ]
+    # Missing values decoded as NaN resolve to None
+    names = resolve_code_figures('033050', np.array([np.nan, 4.0]))
+    assert names.tolist() == [None, get_code_table_figure('033050', 4)['EntryName_en']]
+    assert resolve_code_figures('033050', np.array([], dtype=np.int64)).tolist() == []
+
+
+def test_ranges_are_not_expanded():
+    """Tests that wide ranges are kept as a single range and agree with the registry."""
+    table = get_code_table_resolver('001036')
+    assert len(table.starts) < 100
+    figures = np.arange(0, 40000, 7)
+    expected = []
+    for figure in figures.tolist():
+        row = get_code_table_figure('001036', figure)
+        expected.append(row and row['EntryName_en'])
+    assert table.lookup(figures).tolist() == expected
+    assert table.name(36000) == expected[0]
+
+
+def test_duplicate_rows():
+    """Tests that the first of the rows listing the same figure wins, like in the registry."""
+    table = get_code_table_resolver('020105')
+    assert (np.diff(table.starts) > 0).all()
+    assert (table.ends[:-1] < table.starts[1:]).all()
+    for figure in range(10):
+        row = get_code_table_figure('020105', figure)
+        assert table.name(figure) == (row and row['EntryName_en'])
@@ -0,0 +1,56 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for the compiled descriptor plans."""
+import pytest
+
+from bufrtools.tables.plan import (STRING, NUMERIC, REFERENCE, ASSOCIATED, REPLICATION,
+                                   DELAYED_REPLICATION, Step, get_plan)
+
+
+def test_plan_expands_sequences_and_replications():
+    """Tests that sequences are expanded and replications span the steps of their body."""
+    plan = get_plan(['301011', '103000', '031001', '102002', '007062', '022043'])
+    assert plan is get_plan(['301011', '103000', '031001', '102002', '007062', '022043'])
+    assert [step.fxy for step in plan.steps[:3]] == ['004001', '004002', '004003']
+    factor, fixed, depth, temperature = plan.steps[3:]
+    assert factor == Step(DELAYED_REPLICATION, '031001', 8, span=3)
+    assert fixed == Step(REPLICATION, '102002', span=2, count=2)
+    assert depth == Step(NUMERIC, '007062', 17, 1, 0, (1 << 17) - 1)
+    assert temperature.bit_len == 15
+
+
+def test_plan_width_scale_and_increase_operators():
+    """Tests that 2-01, 2-02 and 2-07 change numeric elements but not code tables or strings."""
+    plan = get_plan(['201130', '202129', '012101', '020011', '001079', '201000', '202000',
+                     '207002', '012101', '207000', '012101'])
+    changed, code, string, increased, restored = plan.steps
+    assert (changed.bit_len, changed.scale) == (18, 3)
+    assert (code.bit_len, code.scale) == (4, 0)
+    assert string == Step(STRING, '001079', 64)
+    assert (increased.bit_len, increased.scale, increased.offset) == (23, 4, 0)
+    assert (restored.bit_len, restored.scale) == (16, 2)
+
+
+def test_plan_inserted_operators():
+    """Tests the steps of 2-03, 2-04, 2-05, 2-06 and 2-08."""
+    plan = get_plan(['203010', '012101', '203255', '012101', '203000', '204003', '031021',
+                     '012101', '204000', '205004', '206012', '012101', '208004', '001079'])
+    assert plan.steps[0] == Step(REFERENCE, '012101', 10)
+    assert plan.steps[1].offset is None
+    significance, associated, temperature, characters, local, string = plan.steps[2:]
+    assert significance.fxy == '031021'
+    assert associated == Step(ASSOCIATED, '204003', 3, missing=7)
+    assert temperature.offset == 0
+    assert characters == Step(STRING, '205004', 32)
+    assert (local.fxy, local.bit_len, local.scale) == ('012101', 12, 0)
+    assert string.bit_len == 32
+
+
+def test_plan_rejects_unsupported_operators():
+    """Tests that unsupported operators are rejected with the descriptor that uses them."""
+    with pytest.raises(ValueError, match='replication 102000'):
+        get_plan(['102000', '031001', '201129', '012101'])
+    with pytest.raises(ValueError, match='Unsupported operator descriptor: 221004'):
+        get_plan(['221004', '012101'])
+    with pytest.raises(ValueError, match='new reference value of 012101'):
+        get_plan(['203010', '012101', '203255', '207001', '012101'])
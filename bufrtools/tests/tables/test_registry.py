@@ -0,0 +1,91 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for the BUFR table registry."""
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bufrtools.tables.registry import TableRegistry
+from bufrtools.tables.storage import is_parsed, load_table, build_cache, load_cache
+
+
+def test_table_lookups():
+    """Tests that Table B and Table D rows are indexed by FXY."""
+    registry = TableRegistry()
+    row = registry.table_b('022043')
+    assert row['BUFR_Scale'] == 2
+    assert row['BUFR_DataWidth_Bits'] == 15
+    assert registry.table_b('022999') is None
+    assert [row['FXY2'] for row in registry.table_d('301011')] == ['004001', '004002', '004003']
+    assert registry.table_d('301999') == []
+
+
+def test_code_figures():
+    """Tests that code figures are indexed individually and through their ranges."""
+    registry = TableRegistry()
+    assert registry.code_figure('033050', 1)['EntryName_en'] == 'Correct value (all checks passed)'
+    # 10-14 is a reserved range in the GTSPP quality flag table
+    assert registry.code_figure('033050', 12)['CodeFigure'] == '10-14'
+    # 001036 has ranges too wide to be expanded
+    assert registry.code_figure('001036', 36000)['CodeFigure'] == '0-36000'
+    assert registry.code_figure('033050', 99) is None
+
+
+def test_files_are_read_once(monkeypatch):
+    """Tests that each table file is only read the first time it's needed."""
+    from bufrtools.tables import registry as registry_module
+
+    reads = []
+    load_table = registry_module.load_table
+
+    def counting_load_table(filename, parse=True, cache=None):
+        reads.append(filename)
+        return load_table(filename, parse, cache)
+
+    monkeypatch.setattr(registry_module, 'load_table', counting_load_table)
+    registry = TableRegistry()
+    for fxy in ['022043', '022045', '022043', '022064']:
+        registry.table_b(fxy)
+    assert reads == ['BUFRCREX_TableB_en_22.csv']
+
+
+def test_concurrent_cold_lookups(monkeypatch):
+    """Tests that lookups racing the first load of a table wait for its rows."""
+    from bufrtools.tables import registry as registry_module
+
+    load_table = registry_module.load_table
+
+    def slow_load_table(filename, parse=True, cache=None):
+        time.sleep(0.05)
+        return load_table(filename, parse, cache)
+
+    monkeypatch.setattr(registry_module, 'load_table', slow_load_table)
+    registry = TableRegistry()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        rows = list(executor.map(lambda _: registry.table_b('012101'), range(64)))
+    assert all(row is not None and row['FXY'] == '012101' for row in rows)
+
+
+def comparable(rows: list) -> list:
+    """Returns the rows with NaN cells as None, so that equal rows compare equal."""
+    return [{key: None if isinstance(value, float) and math.isnan(value) else value
+             for key, value in row.items()} for row in rows]
+
+
+def test_cache_is_current(tmp_path):
+    """Tests that the packaged cache matches the packaged CSV files."""
+    packaged = load_cache()
+    built = load_cache(build_cache(str(tmp_path / 'tables.pickle')))
+    assert sorted(packaged) == sorted(built)
+    # The rows are compared rather than the compressed bytes, which depend on the zlib build
+    for filename in built:
+        parse = is_parsed(filename)
+        assert (comparable(load_table(filename, parse, packaged)) ==
+                comparable(load_table(filename, parse, built))), filename
+
+
+def test_registry_without_cache(tmp_path):
+    """Tests that the CSV files are read when there's no cache for the table version."""
+    registry = TableRegistry(cache_path=str(tmp_path / 'missing.pickle'))
+    assert registry.table_b('022043')['BUFR_DataWidth_Bits'] == 15
+    assert registry.code_figure('033050', 12)['CodeFigure'] == '10-14'
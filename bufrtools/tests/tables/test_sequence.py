@@ -0,0 +1,37 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for the compiled sequence templates."""
+import numpy as np
+import pytest
+
+from bufrtools.tables import get_sequence_description, get_sequence_template
+
+
+def test_template_matches_sequence_description():
+    """Tests that the template describes the same descriptors as the sequence description."""
+    template = get_sequence_template('315023')
+    seq = get_sequence_description('315023')
+    assert template.size == len(seq)
+    assert list(template.fxy) == seq['fxy'].tolist()
+    assert list(template.text) == seq['text'].tolist()
+    np.testing.assert_array_equal(template.bit_len, seq['bit_len'].to_numpy())
+    np.testing.assert_array_equal(template.scale, seq['scale'].to_numpy())
+
+
+def test_template_is_compiled_once():
+    """Tests that templates are cached and can't be modified."""
+    template = get_sequence_template('301150')
+    assert get_sequence_template('301150') is template
+    with pytest.raises(ValueError):
+        template.bit_len[0] = 1
+
+
+def test_template_records():
+    """Tests that records are built for a range of descriptors with their values."""
+    template = get_sequence_template('301011')
+    records = template.records(1, values=[2020, 6, 10])
+    assert [r['fxy'] for r in records] == ['004001', '004002', '004003']
+    assert [r['value'] for r in records] == [2020, 6, 10]
+    assert records[0]['bit_len'] == 12
+    with pytest.raises(ValueError):
+        template.records(1, values=[2020])
@@ -1,7 +1,9 @@
 #!/usr/bin/env pytest
 #-*- coding: utf-8 -*-
 """Unit tests for bitmath."""
-from bufrtools.util.bitmath import encode_uint
+import numpy as np
+import pytest
+from bufrtools.util.bitmath import BitWriter, encode_uint, extract_uint, extract_uints
 
 
 def test_encode_uint():
@@ -20,3 +22,56 @@ def test_encode_uint():
     b = 0xf
     r = encode_uint(a, b, 0, 4)
     assert r == b'\xfa\xaa\xaa\xaa'
+
+
+def test_bit_writer():
+    """Tests that the bit writer packs values MSB first and pads the final byte."""
+    writer = BitWriter(1)
+    writer.write_uint(0x5, 3)
+    writer.write_uint(0x12, 14)
+    assert writer.bit_offset == 17
+    assert len(writer) == 3
+    assert writer.getvalue() == b'\xa0\x09\x00'
+
+    writer.write_bytes(b'AB')
+    writer.write_uint(0x1ff, 4)
+    assert writer.getvalue() == b'\xa0\x09\x20\xa1\x78'
+
+    writer.reset()
+    assert writer.getvalue() == b''
+    for i in range(1000):
+        writer.write_uint(i, 10)
+    expected = int(''.join(f'{i:010b}' for i in range(1000)), 2).to_bytes(1250, 'big')
+    assert writer.getvalue() == expected
+
+    writer.reset()
+    writer.write_uint(0x5, 3)
+    view = writer.getbuffer()
+    assert bytes(view) == b'\xa0'
+    view.release()
+    writer.write_uint(0xff, 8)
+    assert writer.getvalue() == b'\xa0\xff'
+
+
+def test_extract_uint():
+    """Tests that unsigned integers are extracted at arbitrary bit offsets."""
+    data = b'\xc0\x09\x08'
+    assert extract_uint(data, 3, 14) == 0x12
+    assert extract_uint(memoryview(data), 0, 24) == 0xc00908
+
+
+def test_extract_uints():
+    """Tests that fields anywhere in the data are extracted at once."""
+    widths = [3, 14, 1, 57, 8, 5]
+    values = [5, 0x12, 1, (1 << 57) - 2, 0xAB, 0]
+    writer = BitWriter()
+    for value, width in zip(values, widths):
+        writer.write_uint(value, width)
+    data = writer.getvalue()
+    offsets = np.cumsum([0] + widths[:-1])
+    # In any order
+    extracted = extract_uints(memoryview(data), offsets[::-1], widths[::-1])
+    assert extracted.tolist() == values[::-1]
+    assert extract_uints(data, [], []).tolist() == []
+    with pytest.raises(ValueError):
+        extract_uints(data, [len(data) * 8 - 4], [5])
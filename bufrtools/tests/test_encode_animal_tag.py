@@ -11,6 +11,7 @@ import pytest
 
 import bufrtools
 from bufrtools import decoding, encode_animal_tag
+from bufrtools.decoding.bufr import decode_bufr
 
 
 def get_example_path(example_name: str) -> Path:
@@ -34,7 +35,8 @@ def tempfile_fixture():
 def test_encode_animal_tag(parse_args, tempfile_fixture):
     """Tests that the basic encoding of YML descriptor sequences works."""
     basic_bufr = get_example_path('basic-atn.yml')
-    args = Namespace(data=None, descriptor=basic_bufr, output=Path(tempfile_fixture))
+    args = Namespace(data=None, descriptor=basic_bufr, output=Path(tempfile_fixture),
+                     profile_stats=None, verify=False)
     parse_args.return_value = args
     encode_animal_tag.main()
 
@@ -64,7 +66,8 @@ def test_encode_with_csv(parse_args, tempfile_fixture):
     """Tests that the encoding using a CSV data file works."""
     basic_bufr = get_example_path('basic-atn.yml')
     example_data = get_example_path('example-profile.csv')
-    args = Namespace(data=example_data, descriptor=basic_bufr, output=Path(tempfile_fixture))
+    args = Namespace(data=example_data, descriptor=basic_bufr, output=Path(tempfile_fixture),
+                     profile_stats=None, verify=False)
     parse_args.return_value = args
     encode_animal_tag.main()
 
@@ -102,3 +105,22 @@ def test_encode_with_csv(parse_args, tempfile_fixture):
         # f.seek(163)
         # sea_temp_data = f.read(3)
         # assert sea_temp_data == b'\x3b\xc4\x8b'
+
+
+@patch('bufrtools.encode_animal_tag.parse_args')
+def test_encode_with_csv_widths(parse_args, tempfile_fixture):
+    """Tests that 2-01-129 widens 001087 to 24 bits and that the message verifies."""
+    args = Namespace(data=get_example_path('example-profile.csv'),
+                     descriptor=get_example_path('basic-atn.yml'),
+                     output=Path(tempfile_fixture),
+                     profile_stats=None,
+                     verify=True)
+    parse_args.return_value = args
+    assert encode_animal_tag.main() == 0
+
+    offsets = {}
+    for element in decode_bufr(Path(tempfile_fixture).read_bytes()):
+        offsets.setdefault(element['fxy'], element['bit_offset'])
+    # 001087 is 23 bits in Table B, one more after 2-01-129, and 001019 follows it
+    assert offsets['001087'] == 164
+    assert offsets['001019'] == 188
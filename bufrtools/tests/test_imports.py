@@ -0,0 +1,36 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Tests that the encoder and decoder import without the dataset libraries.
+
+How long the imports take is measured by `benchmarks/bench_imports.py`.
+"""
+import sys
+import json
+import subprocess
+
+import pytest
+
+HEAVY_MODULES = ['pandas', 'pocean', 'cftime', 'netCDF4', 'pyarrow']
+
+IMPORT_SCRIPT = '''
+import sys, json
+import {module}
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+def import_in_subprocess(module: str) -> list:
+    """Returns the modules loaded by importing the module in a new process."""
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT.format(module=module)])
+    return json.loads(output)
+
+
+@pytest.mark.parametrize('module', [
+    'bufrtools.encoding.bufr',
+    'bufrtools.decoding.bufr',
+    'bufrtools.tables',
+])
+def test_core_imports(module):
+    """Tests that core modules import without loading the dataset libraries."""
+    loaded = {name.split('.')[0] for name in import_in_subprocess(module)}
+    assert loaded.isdisjoint(HEAVY_MODULES)
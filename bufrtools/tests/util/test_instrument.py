@@ -0,0 +1,61 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for the encode pipeline instrumentation."""
+import json
+import logging
+from pathlib import Path
+from argparse import Namespace
+from unittest.mock import patch
+
+import bufrtools
+from bufrtools.util import instrument
+from bufrtools.encoding import wildlife_computers
+
+
+def get_example_path(example_name: str) -> Path:
+    """Returns the path to an example."""
+    return Path(bufrtools.__file__).parent.parent / 'examples' / example_name
+
+
+def test_stage_disabled():
+    """Tests that stages record nothing unless stats are collected."""
+    with instrument.stage('pack_section4') as record:
+        record.add(10, 100)
+    assert record is instrument.NULL_STAGE
+
+
+def test_collect(caplog):
+    """Tests that every stage of the encode pipeline is recorded and reported."""
+    reported = []
+    with caplog.at_level(logging.DEBUG, logger='bufrtools.util.instrument'):
+        with instrument.collect(reported.append) as stats:
+            data = wildlife_computers.encode_message(get_example_path('profile.parquet'),
+                                                     uuid='58112217efec720cd46e264e',
+                                                     ptt='160376')
+    assert reported == [stats]
+    stages = stats.to_dict()
+    assert list(stages) == ['parse_input', 'get_section4', 'pack_section4', 'write_message']
+    assert stages['parse_input']['elements'] == 1725
+    assert stages['write_message']['bytes'] == len(data)
+    assert stages['pack_section4']['bytes'] == len(data) - 8 - 22 - 9 - 4 - 4
+    assert all(stage['calls'] == 1 and stage['seconds'] > 0 for stage in stages.values())
+    assert 0 <= stages['get_section4']['caches']['compile_sequence']['hit_rate'] <= 1
+    assert caplog.records[-1].profile_stats == stages
+
+
+@patch('bufrtools.encoding.wildlife_computers.parse_args')
+def test_profile_stats_flag(parse_args, tmp_path):
+    """Tests that the stats are dumped as JSON from the command line."""
+    stats_path = tmp_path / 'stats.json'
+    parse_args.return_value = Namespace(
+        output=tmp_path / 'profile.bufr',
+        profile_dataset=get_example_path('profile.csv'),
+        uuid='58112217efec720cd46e264e',
+        ptt='160376',
+        profile_stats=str(stats_path),
+        verify=False,
+        profiles_per_message=None,
+    )
+    wildlife_computers.main()
+    stats = json.loads(stats_path.read_text('utf-8'))
+    assert stats['write_message']['bytes'] == (tmp_path / 'profile.bufr').stat().st_size
@@ -0,0 +1,91 @@
+#!/usr/bin/env pytest
+#-*- coding: utf-8 -*-
+"""Unit tests for the dataset loaders."""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import bufrtools
+from bufrtools.util import parse
+from bufrtools.util.parse import (Loader, load_netcdf, iter_csv, sniff_format, group_profiles,
+                                  register_loader, iter_input_chunks, parse_input_to_dataframe)
+
+EXAMPLES = Path(bufrtools.__file__).parent.parent / 'examples'
+
+
+def test_sniff_format(tmp_path):
+    """Tests that the format is recognized from the leading bytes rather than the extension."""
+    assert sniff_format(EXAMPLES / 'profile.nc') == 'netcdf'
+    assert sniff_format(EXAMPLES / 'profile.parquet') == 'parquet'
+    assert sniff_format(EXAMPLES / 'profile.csv') == 'csv'
+    renamed = tmp_path / 'profile.csv'
+    renamed.write_bytes((EXAMPLES / 'profile.parquet').read_bytes())
+    assert sniff_format(renamed) == 'parquet'
+
+    # Unknown binary files are rejected without being read by any loader
+    unknown = tmp_path / 'profile.bin'
+    unknown.write_bytes(bytes(range(256)))
+    with pytest.raises(ValueError, match='Could not recognize'):
+        parse_input_to_dataframe(unknown)
+
+
+def test_loader_errors_are_raised(tmp_path):
+    """Tests that a file is read by its own loader only and its errors are raised as they are."""
+    truncated = tmp_path / 'profile.parquet'
+    truncated.write_bytes((EXAMPLES / 'profile.parquet').read_bytes()[:1000])
+    with pytest.raises(Exception, match='Parquet magic bytes not found'):
+        parse_input_to_dataframe(truncated)
+
+
+def test_register_loader(monkeypatch, tmp_path):
+    """Tests that plug-in loaders are matched by their leading bytes and extensions."""
+    monkeypatch.setattr(parse, 'LOADERS', dict(parse.LOADERS))
+    calls = []
+
+    def load_vendor(ipt):
+        calls.append(ipt)
+        return pd.read_csv(ipt, skiprows=1), {'ptt': '1'}
+
+    register_loader(Loader('vendor', load_vendor, magic=(b'VNDR', ), extensions=('.vnd', )))
+    path = tmp_path / 'tag.txt'
+    path.write_text('VNDR\nprofile,z\n0,1.5\n0,2.5\n1,1.0\n')
+    df, meta = parse_input_to_dataframe(path)
+    assert calls == [path]
+    assert meta == {'ptt': '1'}
+    assert df.z.tolist() == [1.5, 2.5, 1.0]
+
+    # Without a chunk reader the dataset is loaded whole and then regrouped
+    assert [len(df) for df, _ in iter_input_chunks(path, 1)] == [2, 1]
+
+    renamed = tmp_path / 'tag.vnd'
+    renamed.write_bytes(b'profile,z\n0,1.5\n')
+    assert sniff_format(renamed) == 'vendor'
+
+
+@pytest.mark.parametrize('example', ['profile.nc', 'profile.csv', 'profile.parquet'])
+def test_iter_input_chunks(example):
+    """Tests that every chunk holds whole profiles and together they hold the whole dataset."""
+    expected, _ = load_netcdf(EXAMPLES / 'profile.nc')
+    chunks = list(iter_input_chunks(EXAMPLES / example, 20))
+    assert [df.profile.nunique() for df, _ in chunks] == [20] * 7 + [17]
+    df = pd.concat([df for df, _ in chunks], ignore_index=True)
+    for column in ('lon', 'lat', 'z', 'profile', 'temperature'):
+        np.testing.assert_allclose(df[column].values, expected[column].values)
+    assert (df.time.values == expected.time.values).all()
+    if example == 'profile.nc':
+        assert chunks[0][1] == {'uuid': '58112217efec720cd46e264e', 'ptt': '160376'}
+
+
+def test_group_profiles_across_chunks():
+    """Tests that profiles that span chunks of the input are kept whole."""
+    chunks = iter_csv(EXAMPLES / 'profile.csv', chunk_rows=7)
+    grouped = list(group_profiles(chunks, 3))
+    assert len(grouped) == 53
+    assert sum(len(df) for df, _ in grouped) == 1725
+    profiles = [df.profile.unique().tolist() for df, _ in grouped]
+    assert profiles[0] == [0, 1, 2]
+    assert profiles[-1] == [156]
+    with pytest.raises(ValueError):
+        list(iter_input_chunks(EXAMPLES / 'profile.csv', 0))
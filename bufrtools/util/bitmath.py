@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 #-*- coding: utf-8 -*-
 """Utility functions for bit mangling."""
+import numpy as np
 
 
 def shift_uint(value: int, full_bitlength: int, bit_offset: int, bitlen: int) -> bytes:
@@ -31,3 +32,139 @@ def encode_uint(data: bytes, value: int, bit_offset: int, bitlen: int) -> bytear
         output[i] = data[i] ^ ((data[i] ^ shifted_value[i]) & mask[i])
 
     return output
+
+
+class BitWriter:
+    """Sequential writer that packs unsigned integers into a stream of bits.
+
+    Bits are accumulated in a Python integer and flushed as whole bytes into a preallocated
+    `bytearray` that grows by doubling. Values are written MSB first, which is the bit order used
+    by BUFR section 4.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """Initializes the writer with room for `capacity` bytes."""
+        self._buf = bytearray(max(capacity, 1))
+        self._pos = 0
+        self._acc = 0
+        self._nbits = 0
+
+    @property
+    def bit_offset(self) -> int:
+        """Returns the number of bits written so far."""
+        return self._pos * 8 + self._nbits
+
+    def __len__(self) -> int:
+        """Returns the number of bytes needed to hold the bits written so far."""
+        return (self.bit_offset + 7) // 8
+
+    def reset(self):
+        """Discards all written bits while keeping the allocated buffer."""
+        self._pos = 0
+        self._acc = 0
+        self._nbits = 0
+
+    def write_uint(self, value: int, bitlen: int):
+        """Appends the lowest `bitlen` bits of the unsigned integer `value`."""
+        self._acc = (self._acc << bitlen) | (value & ((1 << bitlen) - 1))
+        self._nbits += bitlen
+        # Flushing in blocks of a few hundred bits keeps the accumulator small enough that the
+        # shifts stay cheap while amortizing the cost of the flush itself
+        if self._nbits >= 512:
+            self._flush()
+
+    def write_bytes(self, data: bytes):
+        """Appends every byte of `data`."""
+        self.write_uint(int.from_bytes(data, 'big'), len(data) * 8)
+
+    def write_bits(self, data: bytes, bitlen: int):
+        """Appends the leading `bitlen` bits of `data`."""
+        self._flush()
+        if self._nbits == 0 and bitlen % 8 == 0:
+            nbytes = bitlen // 8
+            self._reserve(nbytes)
+            self._buf[self._pos:self._pos + nbytes] = data[:nbytes]
+            self._pos += nbytes
+            return
+        value = int.from_bytes(data, 'big') >> (len(data) * 8 - bitlen)
+        self.write_uint(value, bitlen)
+        self._flush()
+
+    def _reserve(self, nbytes: int):
+        """Grows the underlying buffer so that `nbytes` more bytes fit."""
+        needed = self._pos + nbytes
+        if needed > len(self._buf):
+            self._buf.extend(bytes(max(needed, 2 * len(self._buf)) - len(self._buf)))
+
+    def _flush(self):
+        """Moves every whole byte in the accumulator into the buffer."""
+        nbytes = self._nbits // 8
+        if nbytes == 0:
+            return
+        remainder = self._nbits % 8
+        self._reserve(nbytes)
+        chunk = self._acc >> remainder
+        self._buf[self._pos:self._pos + nbytes] = chunk.to_bytes(nbytes, 'big')
+        self._pos += nbytes
+        self._acc &= (1 << remainder) - 1
+        self._nbits = remainder
+
+    def getbuffer(self) -> memoryview:
+        """Returns a view of the bytes written so far without copying them.
+
+        The final partial byte is zero padded in place, so bits written afterwards start on a byte
+        boundary. The view must be released before writing more.
+        """
+        if self._nbits % 8:
+            self.write_uint(0, 8 - self._nbits % 8)
+        self._flush()
+        return memoryview(self._buf)[:self._pos]
+
+    def getvalue(self) -> bytes:
+        """Returns the bytes written so far, zero padding the final partial byte."""
+        self._flush()
+        data = bytes(self._buf[:self._pos])
+        if self._nbits:
+            data += bytes([(self._acc << (8 - self._nbits)) & 0xFF])
+        return data
+
+
+def extract_uint(data: bytes, bit_offset: int, bitlen: int) -> int:
+    """Returns the unsigned integer held in the `bitlen` bits of `data` after `bit_offset` bits."""
+    start = bit_offset >> 3
+    end = (bit_offset + bitlen + 7) >> 3
+    if end > len(data):
+        raise ValueError(f'Cannot read {bitlen} bits at bit offset {bit_offset} from '
+                         f'{len(data)} bytes')
+    value = int.from_bytes(data[start:end], 'big')
+    return (value >> ((end << 3) - bit_offset - bitlen)) & ((1 << bitlen) - 1)
+
+
+# Mask of the lowest n bits for every field width extract_uints can read
+FIELD_MASKS = (np.uint64(1) << np.arange(58, dtype=np.uint64)) - np.uint64(1)
+
+
+def extract_uints(data: bytes, bit_offsets: np.ndarray, bitlens: np.ndarray) -> np.ndarray:
+    """Returns the unsigned integers of fields anywhere in `data` as a uint64 NumPy array.
+
+    Field `i` holds the `bitlens[i]` bits after `bit_offsets[i]` bits, fields can't be wider than 57
+    bits.
+    """
+    bit_offsets = np.asarray(bit_offsets, dtype=np.int64)
+    bitlens = np.asarray(bitlens, dtype=np.int64)
+    if not len(bit_offsets):
+        return np.zeros(0, dtype=np.uint64)
+    if bitlens.max() > 57:
+        raise ValueError('Cannot extract fields wider than 57 bits')
+    if (bit_offsets + bitlens).max() > len(data) * 8:
+        raise ValueError(f'Cannot read past the end of {len(data)} bytes')
+    # Every field fits in the 8 bytes that start at the byte holding its first bit, which are read
+    # through a view with a big-endian word starting at every byte
+    window = np.zeros(len(data) + 8, dtype=np.uint8)
+    window[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    starts = np.ndarray((len(data), ), dtype='>u8', buffer=window, strides=(1, ))
+    words = starts[bit_offsets >> 3].astype(np.uint64)
+    shifts = (64 - (bit_offsets & 7) - bitlens).astype(np.uint64)
+    words >>= shifts
+    words &= FIELD_MASKS[bitlens]
+    return words
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#-*- coding: utf-8 -*-
+"""Opt-in timing and counters for the stages of the encode pipeline.
+
+Nothing is recorded unless stats are being collected with `collect`. Each stage then records its
+wall time, the number of elements and bytes it handled and how the compiled table caches fared
+while it ran. Stages nest freely, a stage entered more than once accumulates.
+"""
+import sys
+import json
+import time
+import logging
+from typing import Dict, Callable, Iterator, Optional
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+log = logging.getLogger(__name__)
+
+# Stats being collected in the current context, None when nothing is collected
+_current = ContextVar('bufrtools_stats', default=None)
+
+
+def get_caches() -> Dict[str, Callable]:
+    """Returns the memoized table lookups whose hit rates are recorded, keyed by name."""
+    from bufrtools.encoding.bufr import encode_descriptors
+    from bufrtools.tables.codes import compile_code_table
+    from bufrtools.tables.plan import compile_plan, get_element_row
+    from bufrtools.tables.sequence import compile_sequence
+    return {
+        'compile_sequence': compile_sequence,
+        'compile_plan': compile_plan,
+        'get_element_row': get_element_row,
+        'compile_code_table': compile_code_table,
+        'encode_descriptors': encode_descriptors,
+    }
+
+
+def cache_counts() -> Dict[str, tuple]:
+    """Returns the (hits, misses) of every recorded cache."""
+    counts = {}
+    for name, func in get_caches().items():
+        info = func.cache_info()
+        counts[name] = (info.hits, info.misses)
+    return counts
+
+
+class Stage:
+    """Wall time and counters of one stage."""
+
+    def __init__(self):
+        """Initializes an empty stage."""
+        self.calls = 0
+        self.seconds = 0.0
+        self.elements = 0
+        self.bytes = 0
+        self.caches = {}
+
+    def add(self, elements: int = 0, nbytes: int = 0):
+        """Adds to the number of elements and bytes handled by the stage."""
+        self.elements += elements
+        self.bytes += nbytes
+
+    def to_dict(self) -> dict:
+        """Returns the stage as a JSON serializable dictionary."""
+        caches = {}
+        for name, (hits, misses) in self.caches.items():
+            if hits or misses:
+                caches[name] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_rate': hits / (hits + misses),
+                }
+        return {
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'elements': self.elements,
+            'bytes': self.bytes,
+            'caches': caches,
+        }
+
+
+class NullStage:
+    """Stands in for a stage when nothing is collected, counters are ignored."""
+
+    def add(self, elements: int = 0, nbytes: int = 0):
+        """Ignores the counters."""
+
+
+NULL_STAGE = NullStage()
+
+
+class Stats:
+    """The stages recorded while collecting, in the order they were first entered."""
+
+    def __init__(self):
+        """Initializes empty stats."""
+        self.stages: Dict[str, Stage] = {}
+
+    def to_dict(self) -> dict:
+        """Returns the stats as a JSON serializable dictionary keyed by stage name."""
+        return {name: stage.to_dict() for name, stage in self.stages.items()}
+
+    def to_json(self, **kwargs) -> str:
+        """Returns the stats as JSON, keyword arguments are passed to `json.dumps`."""
+        return json.dumps(self.to_dict(), **kwargs)
+
+
+@contextmanager
+def collect(callback: Optional[Callable[[Stats], None]] = None) -> Iterator[Stats]:
+    """Collects the stats of every stage run inside the block.
+
+    When the block exits the stats are passed to `callback` and logged at debug level with the
+    dictionary of stats in the `profile_stats` extra of the record.
+    """
+    stats = Stats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if callback is not None:
+            callback(stats)
+        log.debug('Profile stats: %s', stats.to_json(), extra={'profile_stats': stats.to_dict()})
+
+
+@contextmanager
+def stage(name: str) -> Iterator:
+    """Times the block as the named stage, yields the stage to add counters to.
+
+    Yields a stage that ignores its counters when stats aren't being collected.
+    """
+    stats = _current.get()
+    if stats is None:
+        yield NULL_STAGE
+        return
+    record = stats.stages.get(name)
+    if record is None:
+        record = stats.stages[name] = Stage()
+    before = cache_counts()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds += time.perf_counter() - start
+        record.calls += 1
+        for cache, (hits, misses) in cache_counts().items():
+            total_hits, total_misses = record.caches.get(cache, (0, 0))
+            record.caches[cache] = (total_hits + hits - before[cache][0],
+                                    total_misses + misses - before[cache][1])
+
+
+def dump(stats: Stats, path: str):
+    """Writes the stats as JSON to the file at `path`, or to stdout if `path` is `-`."""
+    if str(path) == '-':
+        sys.stdout.write(stats.to_json(indent=2) + '\n')
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(stats.to_json(indent=2) + '\n')
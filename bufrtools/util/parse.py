@@ -1,12 +1,56 @@
 #!/usr/bin/env python
 #-*- coding: utf-8 -*-
-"""Module for basic and general parsing functions."""
+"""Module for basic and general parsing functions.
+
+The dataset loaders import pandas, pocean and cftime when they're called, so that the encoder and
+decoder modules, which only need `parse_ref`, import without them.
+
+Each dataset format is described by a `Loader` in a registry. The format of a file is recognized
+from its leading bytes, then from its extension, and only its own loader reads it. Packages add
+loaders for other formats with `register_loader` or through the `bufrtools.loaders` entry point
+group.
+"""
+from typing import TYPE_CHECKING, Dict, Tuple, Callable, Iterator, Optional, NamedTuple
 from pathlib import Path
 
-import cftime
-import pandas as pd
-from pocean.dsg import *  # noqa Import required for CFDataset
-from pocean.cf import CFDataset
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Leading bytes of the binary formats the loaders read, netCDF-4 files are HDF5 files
+PARQUET_MAGIC = b'PAR1'
+NETCDF_MAGIC = b'CDF'
+HDF5_MAGIC = b'\x89HDF\r\n\x1a\n'
+
+# Number of rows read from a CSV file at a time when streaming it
+CSV_CHUNK_ROWS = 100000
+
+# Number of leading bytes read to recognize the format of a file
+SNIFF_LENGTH = 512
+
+# Entry point group of the loaders that other packages provide
+LOADER_ENTRY_POINT = 'bufrtools.loaders'
+
+
+class Loader(NamedTuple):
+    """A dataset file format, how it's recognized and how it's read.
+
+    `load` returns the whole dataset as a data frame and a dictionary of metadata. `iter_chunks`, if
+    given, yields the dataset in chunks of rows instead and is passed the number of profiles wanted
+    per chunk, which it's free to ignore.
+    """
+
+    name: str
+    load: Callable[[Path], Tuple['pd.DataFrame', dict]]
+    magic: Tuple[bytes, ...] = ()
+    extensions: Tuple[str, ...] = ()
+    iter_chunks: Optional[Callable[[Path, int], Iterator[Tuple['pd.DataFrame', dict]]]] = None
+
+
+# Registered loaders by name, populated at the end of the module
+LOADERS: Dict[str, Loader] = {}
+
+# Whether the loaders of the entry point group have been registered
+_plugins_loaded = False
 
 
 def parse_ref(fxy) -> tuple:
@@ -17,7 +61,8 @@ def parse_ref(fxy) -> tuple:
     return f, x, y
 
 
-def load_csv(ipt: Path) -> pd.DataFrame:
+def load_csv(ipt: Path) -> 'pd.DataFrame':
+    import pandas as pd
     df = pd.read_csv(ipt)
     df['time'] = pd.to_datetime(df.time)
     return (
@@ -26,14 +71,18 @@ def load_csv(ipt: Path) -> pd.DataFrame:
     )
 
 
-def load_parquet(ipt: Path) -> pd.DataFrame:
+def load_parquet(ipt: Path) -> 'pd.DataFrame':
+    import pandas as pd
     return (
         pd.read_parquet(ipt),
         {}
     )
 
 
-def load_netcdf(ipt: Path) -> pd.DataFrame:
+def load_netcdf(ipt: Path) -> 'pd.DataFrame':
+    import cftime
+    import pocean.dsg  # noqa: F401 Import required for CFDataset
+    from pocean.cf import CFDataset
     ds = CFDataset.load(str(ipt))
     axes = dict(
         t='time',
@@ -44,12 +93,16 @@ def load_netcdf(ipt: Path) -> pd.DataFrame:
         trajectory='trajectory'
     )
 
-    meta = ds.meta()['attributes']
-    valid_meta = {
-        'uuid': meta.get('uuid')['data'],
-        'ptt': meta.get('ptt', '')['data']
-    }
-    df = ds.to_dataframe(axes=axes, clean_cols=False, clean_rows=False)
+    try:
+        meta = ds.meta()['attributes']
+        valid_meta = {
+            'uuid': meta.get('uuid')['data'],
+            'ptt': meta.get('ptt', '')['data']
+        }
+        df = ds.to_dataframe(axes=axes, clean_cols=False, clean_rows=False)
+    finally:
+        # Closing the dataset releases the HDF5 file before it's opened again
+        ds.close()
 
     try:
         df.time.astype(int)
@@ -65,20 +118,228 @@ def load_netcdf(ipt: Path) -> pd.DataFrame:
     )
 
 
-def parse_input_to_dataframe(ipt: Path) -> pd.DataFrame:
+def parse_input_to_dataframe(ipt: Path) -> 'pd.DataFrame':
+    """Returns the dataset as a data frame and a dictionary of its metadata.
+
+    The file is read once, by the loader of its format. Errors of the loader are raised as they are.
+    """
+    import pandas as pd
     # Shortcut to avoid needing a file at all
     if isinstance(ipt, pd.DataFrame):
         return (ipt, {})
+    return get_loader(ipt).load(ipt)
+
+
+def register_loader(loader: Loader):
+    """Adds the loader to the registry, replacing any loader of the same name.
+
+    Loaders registered later are matched first.
+    """
+    LOADERS[loader.name] = loader
+
+
+def load_plugins():
+    """Registers the loaders of the entry point group, once."""
+    global _plugins_loaded
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+    from importlib.metadata import entry_points
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        eps = eps.select(group=LOADER_ENTRY_POINT)
+    else:
+        eps = eps.get(LOADER_ENTRY_POINT, [])
+    for ep in eps:
+        register_loader(ep.load())
+
+
+def get_loader(ipt: Path) -> Loader:
+    """Returns the loader for the dataset file.
+
+    Leading bytes are matched before the extension. A file that matches neither is read as CSV if
+    it looks like text, otherwise a ValueError is raised.
+    """
+    load_plugins()
+    with open(ipt, 'rb') as f:
+        head = f.read(SNIFF_LENGTH)
+    loaders = list(reversed(LOADERS.values()))
+    for loader in loaders:
+        if any(head.startswith(magic) for magic in loader.magic):
+            return loader
+    suffix = Path(ipt).suffix.lower()
+    for loader in loaders:
+        if suffix in loader.extensions:
+            return loader
+    if b'\x00' not in head:
+        try:
+            head.decode('utf-8')
+            return LOADERS['csv']
+        except UnicodeDecodeError as e:
+            # The head may end in the middle of a character
+            if e.start >= len(head) - 3:
+                return LOADERS['csv']
+    raise ValueError(f'Could not recognize the format of {ipt}')
+
+
+def sniff_format(ipt: Path) -> str:
+    """Returns the name of the format of the dataset file, like `parquet`, `netcdf` or `csv`."""
+    return get_loader(ipt).name
+
+
+def iter_csv(ipt: Path,
+             profiles: Optional[int] = None,
+             chunk_rows: int = CSV_CHUNK_ROWS) -> Iterator[Tuple['pd.DataFrame', dict]]:
+    """Yields the rows of the CSV file `chunk_rows` at a time, whatever the number of profiles."""
+    import pandas as pd
+    for df in pd.read_csv(ipt, chunksize=chunk_rows):
+        df['time'] = pd.to_datetime(df.time)
+        yield df, {}
+
+
+def iter_parquet(ipt: Path,
+                 profiles: Optional[int] = None) -> Iterator[Tuple['pd.DataFrame', dict]]:
+    """Yields the rows of the Parquet file one row group at a time.
+
+    The row groups are yielded as they are, whatever the number of profiles.
+    """
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(ipt)
+    for i in range(parquet_file.num_row_groups):
+        yield parquet_file.read_row_group(i).to_pandas(), {}
+
+
+def iter_netcdf(ipt: Path, profiles: int) -> Iterator[Tuple['pd.DataFrame', dict]]:
+    """Yields the rows of the netCDF file `profiles` profiles at a time.
+
+    Only the profile variables and the observations of the profiles being yielded are read from a
+    contiguous ragged array dataset. Any other dataset is loaded whole with `load_netcdf`.
+    """
+    import netCDF4
+    import numpy as np
+    import pandas as pd
+    with netCDF4.Dataset(str(ipt)) as ds:
+        counts = None
+        for var in ds.variables.values():
+            if 'sample_dimension' in var.ncattrs():
+                counts = var
+                break
+        if counts is None:
+            yield load_netcdf(ipt)
+            return
+        valid_meta = {'ptt': getattr(ds, 'ptt', '')}
+        # Without the attribute the uuid passed to the encoder is used
+        uuid = getattr(ds, 'uuid', None)
+        if uuid is not None:
+            valid_meta['uuid'] = uuid
+        instance_dim = counts.dimensions[0]
+        sample_dim = counts.sample_dimension
+        instance_vars = []
+        sample_vars = []
+        for name, var in ds.variables.items():
+            if var is counts or 'instance_dimension' in var.ncattrs():
+                continue
+            if var.dimensions == (instance_dim, ):
+                instance_vars.append(name)
+            elif var.dimensions == (sample_dim, ):
+                sample_vars.append(name)
+
+        # The profile variables are small enough to read whole, the observations aren't
+        row_sizes = np.ma.filled(counts[:], 0).astype(np.int64)
+        row_stops = np.cumsum(row_sizes)
+        instances = {name: get_netcdf_values(ds.variables[name], slice(None))
+                     for name in instance_vars}
+        for start in range(0, len(row_sizes), profiles):
+            stop = min(start + profiles, len(row_sizes))
+            rows = slice(int(row_stops[start] - row_sizes[start]), int(row_stops[stop - 1]))
+            sizes = row_sizes[start:stop]
+            columns = {name: np.repeat(values[start:stop], sizes)
+                       for name, values in instances.items()}
+            for name in sample_vars:
+                columns[name] = get_netcdf_values(ds.variables[name], rows)
+            yield pd.DataFrame(columns), valid_meta
+
+
+def get_netcdf_values(var, index: slice):
+    """Returns the values of the netCDF variable, time variables are decoded as datetimes.
+
+    Masked floating point values are NaN.
+    """
+    import netCDF4
+    import numpy as np
+    import pandas as pd
+    values = var[index]
+    if var.name == 'time' and 'since' in getattr(var, 'units', ''):
+        dates = netCDF4.num2date(values, var.units, getattr(var, 'calendar', 'standard'),
+                                 only_use_cftime_datetimes=False,
+                                 only_use_python_datetimes=True)
+        return pd.to_datetime(np.ma.filled(dates, None))
+    if np.ma.isMaskedArray(values):
+        if values.dtype.kind == 'f':
+            return values.filled(np.nan)
+        return values.data
+    return np.asarray(values)
+
+
+def group_profiles(chunks: Iterator[Tuple['pd.DataFrame', dict]],
+                   profiles: int) -> Iterator[Tuple['pd.DataFrame', dict]]:
+    """Yields the rows of the chunks regrouped into data frames of `profiles` whole profiles.
+
+    The rows of every profile are expected to be contiguous, as they are in the contiguous ragged
+    arrays of a profile dataset, but may span any number of chunks. The last data frame may hold
+    fewer profiles.
+    """
+    import numpy as np
+    import pandas as pd
+    pending = []
+    opened = 0
+    last: Optional[object] = None
+    meta = {}
+    for df, meta in chunks:
+        if not len(df):
+            continue
+        ids = df['profile'].values
+        starts = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+        if opened == 0 or ids[0] != last:
+            starts = np.concatenate(([0], starts))
+        position = 0
+        for start in starts.tolist():
+            if opened == profiles:
+                pending.append(df.iloc[position:start])
+                yield pd.concat(pending, ignore_index=True), meta
+                pending = []
+                opened = 0
+                position = start
+            opened += 1
+        pending.append(df.iloc[position:])
+        last = ids[-1]
+    if pending:
+        yield pd.concat(pending, ignore_index=True), meta
+
+
+def iter_input_chunks(ipt: Path, profiles: int) -> Iterator[Tuple['pd.DataFrame', dict]]:
+    """Yields the input dataset as data frames of `profiles` whole profiles and its metadata.
+
+    The loader of the file's format reads it in chunks, so memory use depends on the number of
+    profiles per data frame rather than on the size of the file. Formats without a chunk reader are
+    loaded whole.
+    """
+    import pandas as pd
+    if profiles < 1:
+        raise ValueError('At least one profile is needed per chunk')
+    if isinstance(ipt, pd.DataFrame):
+        chunks = iter([(ipt, {})])
     else:
-        # Try to load as a pandas dataset file
-        loaders = [
-            load_csv,
-            load_parquet,
-            load_netcdf
-        ]
-        for load_func in loaders:
-            try:
-                return load_func(ipt)
-            except BaseException:
-                pass
-        raise ValueError(f"Could not load {ipt} as a dataset")
+        loader = get_loader(ipt)
+        if loader.iter_chunks is None:
+            chunks = iter([loader.load(ipt)])
+        else:
+            chunks = loader.iter_chunks(ipt, profiles)
+    return group_profiles(chunks, profiles)
+
+
+register_loader(Loader('csv', load_csv, extensions=('.csv', '.txt'), iter_chunks=iter_csv))
+register_loader(Loader('parquet', load_parquet, magic=(PARQUET_MAGIC, ),
+                       extensions=('.parquet', '.pq'), iter_chunks=iter_parquet))
+register_loader(Loader('netcdf', load_netcdf, magic=(NETCDF_MAGIC, HDF5_MAGIC),
+                       extensions=('.nc', '.nc4', '.cdf'), iter_chunks=iter_netcdf))
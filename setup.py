@@ -41,6 +41,6 @@ setup(
         ],
     },
     package_data     = {
-        'bufrtools.tables' : ['data/*.csv'],
+        'bufrtools.tables' : ['data/*.csv', 'data/*.pickle'],
     },
 )